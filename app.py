@@ -1,11 +1,24 @@
 import traceback
-from flask import render_template, request, redirect, url_for
+from flask import render_template, request, redirect, url_for, send_from_directory, jsonify
 import logging.config
 from flask import Flask
-import src.generate_forecast_plots as gfp
+import atexit
+import mimetypes
+import os
+import shutil
+import sys
 from flask_sqlalchemy import SQLAlchemy
-import pickle
-from src.create_database import User_App_Inputs
+
+# the src modules import each other top-level, so they are imported the same way here: as src.<module> they would be
+# loaded a second time and the app would configure and report on a different query cache than the one queries go to
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+import generate_forecast_plots as gfp
+import render_plots
+import static_assets
+import country_index
+import write_behind
+import query_cache
+from create_database import User_App_Inputs
 from datetime import datetime
 import plotly
 
@@ -23,6 +36,63 @@ logger = logging.getLogger(app.config["APP_NAME"])
 # Initialize the database
 db = SQLAlchemy(app)
 
+# user inputs are inserted in batches on a background thread so requests never wait on a database commit
+user_input_writer = write_behind.WriteBehindQueue(app.config["SQLALCHEMY_DATABASE_URI"], User_App_Inputs.__table__,
+                                                  max_batch_rows=app.config["WRITE_BEHIND_MAX_BATCH_ROWS"],
+                                                  max_batch_ms=app.config["WRITE_BEHIND_MAX_BATCH_MS"],
+                                                  max_queue_size=app.config["WRITE_BEHIND_MAX_QUEUE_SIZE"])
+atexit.register(user_input_writer.close)
+
+@app.route('/metrics/user_inputs')
+def user_input_metrics():
+    """Queue depth and write counters of the user input write-behind queue"""
+    return jsonify(user_input_writer.metrics())
+
+# forecast plot data is served from a read-through cache invalidated by the pipeline's data version
+query_cache.default_cache.configure(max_entries=app.config["QUERY_CACHE_MAX_ENTRIES"],
+                                    ttl_seconds=app.config["QUERY_CACHE_TTL_SECONDS"],
+                                    version_check_seconds=app.config["QUERY_CACHE_VERSION_CHECK_SECONDS"])
+
+@app.route('/metrics/query_cache')
+def query_cache_metrics():
+    """Hit/miss/eviction counters of the query cache"""
+    return jsonify(query_cache.default_cache.metrics())
+
+# fingerprinted copies of the generated static files published by the pipeline (see src/static_assets.py)
+asset_manifest = static_assets.AssetManifest(app.static_folder)
+
+@app.template_global()
+def asset_url(filename):
+    """
+    Url of the current fingerprinted version of a generated static file, falling back to the plain static file if it
+    has not been published
+    Args:
+        filename (str): plain filename relative to app/static, e.g. 'global_cases.html'
+
+    Returns:
+        url (str): url for the file
+    """
+    fingerprinted = asset_manifest.lookup(filename)
+    if fingerprinted is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=fingerprinted)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """
+    Serves a fingerprinted static file, precompressed if the client accepts it. The content of a fingerprinted file
+    never changes so it can be cached for a year.
+    """
+    variant, encoding = static_assets.choose_variant(app.static_folder, filename,
+                                                     request.headers.get('Accept-Encoding', ''))
+    response = send_from_directory(app.static_folder, variant,
+                                   mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(app.config["ASSET_MAX_AGE"])
+    return response
+
 @app.route('/')
 def index():
     """Main view that lists songs in the database.
@@ -39,21 +109,29 @@ def index():
         logger.warning("Not able to display index page error page returned")
         return render_template('error.html')
 
-def is_valid_country(country,country_list_file):
+# countries with a forecast, loaded once and reloaded when the pipeline writes a new country list
+country_service = country_index.CountryIndexService(app.config["COUNTRY_LIST_FILE"])
+
+def resolve_country(country):
     """
-    Checks to see if user input country is a valid country and if a forecast can be made for it
+    Resolves user input to a country for which a forecast can be made. Accents, case, punctuation and common aliases
+    are ignored, and a close enough misspelling is corrected to the best suggestion.
     Args:
         country (str): A country in the world
 
     Returns:
-        valid (bool): Flag to determine if the a forecast plot can be generated for the input country
+        resolved (str or None): the country name in the country list, None if the input could not be matched
+        suggestions (list of str): similar country names to offer when the input could not be matched
     """
-    valid = False
-    country_list = pickle.load(open(country_list_file, "rb"))
-    if country.upper() in (name.upper() for name in country_list):
-        valid = True
-
-    return valid
+    index = country_service.get()
+    resolved = index.resolve(country)
+    if resolved is not None:
+        return resolved, []
+    suggestions = index.suggest(country, limit=app.config["COUNTRY_SUGGESTIONS"])
+    if len(suggestions) > 0 and suggestions[0][1] >= app.config["COUNTRY_AUTOCORRECT_SCORE"]:
+        logger.info("Corrected country input {} to {}".format(country, suggestions[0][0]))
+        return suggestions[0][0], []
+    return None, [suggestion for suggestion, score in suggestions]
 
 @app.route('/add', methods=['POST'])
 def add_entry():
@@ -67,33 +145,38 @@ def add_entry():
     country_input = str(request.form['country_input'])
 
     #check validity of input
-    valid_input = is_valid_country(country_input,'countries.pkl')
+    country, suggestions = resolve_country(country_input)
 
     try:
-        user_input = User_App_Inputs(date=datetime.now().date(),name=name, age=int(age), country_of_residence=residence,country_input=country_input)
-        db.session.add(user_input)
-        db.session.commit()
-        logger.info("New user input added to database")
-    except TypeError:
+        user_input = dict(date=datetime.now().date(),name=name, age=int(age), country_of_residence=residence,country_input=country_input)
+    except (TypeError, ValueError):
         logger.warning("There was an issue with these inputs. Please verify age was submitted as an integer value. Error page returned")
         return render_template('error.html')
-    except Exception:
-        logger.warning("There was an issue with these inputs. Please make sure you filled out all fields")
-        return render_template('error.html')
+    if user_input_writer.submit(user_input):
+        logger.info("New user input queued for the database")
+    else:
+        logger.warning("User input could not be queued for the database")
 
-    #if not valid, return error page.
-    if valid_input == False:
+    #if not valid, return error page with the closest country names.
+    if country is None:
         logger.error("A forecast cannot be made for the input country, please try to verify spelling or try another country")
-        return render_template('error.html')
+        return render_template('error.html', suggestions=suggestions)
     else:
-        logger.info("Valid country input, {}".format(country_input))
-        country_forecast_df = gfp.get_country_forecasted_data(country_input,app.config["SQLALCHEMY_DATABASE_URI"])
-        country_plot_df = gfp.get_recent_country_confirmed_data(country_input,app.config["SQLALCHEMY_DATABASE_URI"])
+        logger.info("Valid country input, {}".format(country))
+        fname = "app/static/country_forecast.html"
+        # use the plot pre-rendered by render_plots.py when there is one
+        prerendered = os.path.join("app/static", "{}.html".format(render_plots.country_plot_filename(country)))
+        if os.path.exists(prerendered):
+            shutil.copyfile(prerendered, fname + ".tmp")
+            os.replace(fname + ".tmp", fname)
+            logger.info("Using pre-rendered country plot {}".format(prerendered))
+            return render_template('index.html')
+        country_forecast_df = gfp.get_country_forecasted_data(country,app.config["SQLALCHEMY_DATABASE_URI"])
+        country_plot_df = gfp.get_recent_country_confirmed_data(country,app.config["SQLALCHEMY_DATABASE_URI"])
         fig = gfp.generate_forecast_plot(country_forecast_df,country_plot_df)
-        fig.update_layout(title="Recent Confirmed Cases and Forecast for {}".format(country_input))
+        fig.update_layout(title="Recent Confirmed Cases and Forecast for {}".format(country))
         convToHtml = plotly.offline.plot(fig, include_plotlyjs=False, output_type='div')
         htmlout = '<script src="https://cdn.plot.ly/plotly-latest.min.js"></script>' + "\n" + convToHtml
-        fname = "app/static/country_forecast.html"
         with open(fname, 'w+') as f:
             logger.info("Overwriting country plot")
             f.write(htmlout)
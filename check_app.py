@@ -0,0 +1,48 @@
+import logging
+import sys
+
+"""
+Boot check for the Flask dashboard (app.py) in the layout of the app image: imports the app, which imports every src
+module it uses, and requests its pages, metrics and published assets with the Flask test client. Run from the directory
+the app runs from, with src on the PYTHONPATH like DockerfileApp sets it:
+
+    PYTHONPATH=src python check_app.py
+
+Exits with 1 if the app cannot be imported or a page does not respond with 200.
+"""
+
+logger = logging.getLogger("check_app")
+
+# pages requested, none of them needs the database (POST /add does, and rewrites app/static/country_forecast.html)
+PAGES = ['/', '/metrics/query_cache', '/metrics/user_inputs']
+
+
+def check_app():
+    """
+    Imports the app and requests each page and the current version of each published asset
+    Returns:
+        failures (list of str): description of each page that failed
+    """
+    import app as app_module
+    # importing the app reconfigures logging, which disables loggers created before it
+    logger.disabled = False
+    failures = []
+    client = app_module.app.test_client()
+    manifest = app_module.static_assets.read_asset_manifest(app_module.app.static_folder)
+    assets = ['/assets/' + entry['file'] for entry in manifest.values()]
+    for page in PAGES + assets:
+        response = client.get(page)
+        if response.status_code != 200:
+            failures.append("GET {} returned {}".format(page, response.status_code))
+        else:
+            logger.info("GET {} returned 200".format(page))
+    return failures
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(name)-12s %(levelname)-8s %(message)s")
+    failures = check_app()
+    for failure in failures:
+        logger.error(failure)
+    if len(failures) > 0:
+        sys.exit(1)
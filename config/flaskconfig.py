@@ -7,6 +7,16 @@ SQLALCHEMY_TRACK_MODIFICATIONS = True
 HOST = "0.0.0.0"
 SQLALCHEMY_ECHO = False  # If true, SQL for queries made will be printed
 SEND_FILE_MAX_AGE_DEFAULT = 0
+ASSET_MAX_AGE = 31536000  # cache lifetime (seconds) of fingerprinted files served from /assets
+COUNTRY_LIST_FILE = "countries.pkl"  # reloaded automatically when the file changes
+COUNTRY_SUGGESTIONS = 3  # number of similar country names shown when an input country is not recognized
+COUNTRY_AUTOCORRECT_SCORE = 0.5  # trigram similarity (0-1) above which a misspelled country is corrected automatically
+WRITE_BEHIND_MAX_BATCH_ROWS = 100  # user inputs are written once this many are queued...
+WRITE_BEHIND_MAX_BATCH_MS = 200  # ...or this many milliseconds after the first one of a batch, whichever comes first
+WRITE_BEHIND_MAX_QUEUE_SIZE = 10000  # user inputs beyond this many waiting to be written are dropped
+QUERY_CACHE_MAX_ENTRIES = 512  # query results kept before the least recently used is evicted
+QUERY_CACHE_TTL_SECONDS = 600  # seconds a cached query result is served for
+QUERY_CACHE_VERSION_CHECK_SECONDS = 10  # seconds between checks of the data version bumped by the pipeline
 
 # Connection string
 DB_HOST = os.environ.get('MYSQL_HOST')
@@ -0,0 +1,290 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import pickle
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+import requests
+import sqlalchemy as sql
+from werkzeug.serving import make_server
+
+"""
+Load test for the Flask dashboard (app.py). Starts the app on a local port against a throwaway SQLite database seeded
+with synthetic case and forecast data, then runs a scripted user scenario (locust style: each simulated user loops over
+weighted tasks) at increasing concurrency and reports p50/p95/p99 latency and throughput per endpoint.
+
+    python load_test.py --concurrency 1 4 16 --duration 10 --save_baseline data/load_test/baseline.json
+    python load_test.py --concurrency 1 4 16 --duration 10 --compare data/load_test/baseline.json
+
+Run from the directory the app runs from (like app.py it needs local.conf there and reads its templates and static files
+from relative paths). Note that POST /add rewrites app/static/country_forecast.html like a real submission does.
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+logger = logging.getLogger("load_test")
+
+# countries seeded in the test database, plus inputs a user might type
+SEED_COUNTRIES = ['Spain', 'Italy', 'Germany', 'France', 'United Kingdom', 'United States of America', 'Brazil', 'India',
+                  'Peru', 'Canada', 'Mexico', 'Chile', "Cote d'Ivoire", 'Korea (South)', 'Australia', 'Japan']
+TYPED_COUNTRIES = SEED_COUNTRIES + ['usa', 'south korea', 'Austrlia', 'germny', 'Atlantis']
+
+
+def seed_database(engine_string, country_list_file, nbr_days=120):
+    """
+    Creates the app's tables in a SQLite database with synthetic case and forecast data
+    Args:
+        engine_string (str): sqlalchemy string of the test database
+        country_list_file (str): path the country list pickle is written to
+        nbr_days (int): days of case history per country
+
+    Returns:
+        None -- seeds the database
+    """
+    from create_database import Base
+    engine = sql.create_engine(engine_string)
+    Base.metadata.create_all(engine)
+    dates = pd.date_range(end=pd.Timestamp.now().normalize(), periods=nbr_days)
+    rng = np.random.RandomState(0)
+    cases, forecasts = [], []
+    for country in SEED_COUNTRIES:
+        confirmed = np.cumsum(rng.randint(0, 500, nbr_days))
+        cases.append(pd.DataFrame({'Country': country, 'Date': dates, 'Confirmed': confirmed, 'Recovered': 0,
+                                   'Active': confirmed, 'Deaths': 0}))
+        forecasts.append(pd.DataFrame({'country': country,
+                                       'date': pd.date_range(dates[-1] + pd.Timedelta(days=1), periods=7),
+                                       'confirmed_cases_forecast': confirmed[-1] + 250 * np.arange(1, 8)}))
+    pd.concat(cases).to_sql('country_covid_daily_cases', engine, index=False, if_exists='replace')
+    pd.concat(forecasts).to_sql('country_covid_forecast', engine, index=False, if_exists='replace')
+    with open(country_list_file, 'wb') as f:
+        pickle.dump(SEED_COUNTRIES, f)
+
+
+def start_app(work_dir, verbose=False):
+    """
+    Starts app.py on a free local port against a seeded SQLite database in work_dir
+    Args:
+        work_dir (str): directory for the test database and country list
+        verbose (bool): keep the app's per-request info logging (otherwise only warnings and errors are logged)
+
+    Returns:
+        server: werkzeug server (call shutdown() to stop it)
+        base_url (str): url of the running app
+    """
+    engine_string = 'sqlite:///{}'.format(os.path.join(work_dir, 'load_test.db'))
+    country_list_file = os.path.join(work_dir, 'countries.pkl')
+    # flaskconfig.py reads the database from the environment when the app is imported
+    os.environ['SQLALCHEMY_DATABASE_URI'] = engine_string
+    seed_database(engine_string, country_list_file)
+    app_module = importlib.import_module('app')
+    app_module.country_service = app_module.country_index.CountryIndexService(country_list_file)
+    app_module.app.config['DEBUG'] = False
+    # importing the app reconfigures logging, which disables loggers created before it
+    logger.disabled = False
+    logger.setLevel(logging.INFO)
+    if not verbose:
+        for name in [app_module.app.config["APP_NAME"], 'werkzeug']:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+class DashboardUser:
+    """
+    Scripted user of the dashboard. Each iteration picks a task by weight: loading the index page, or submitting the
+    country form (which renders a forecast plot).
+    """
+    tasks = [('GET /', 3), ('POST /add', 1)]
+
+    def __init__(self, base_url, seed):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.random = random.Random(seed)
+
+    def index(self):
+        return self.session.get(self.base_url + '/', timeout=60)
+
+    def add(self):
+        form = {'name': 'load test', 'age': str(self.random.randint(18, 90)), 'country_of_residence': 'Spain',
+                'country_input': self.random.choice(TYPED_COUNTRIES)}
+        return self.session.post(self.base_url + '/add', data=form, timeout=60)
+
+    def run_task(self):
+        """
+        Runs one weighted task
+        Returns:
+            endpoint (str): name of the task
+            seconds (float): request latency
+            ok (bool): True for a 2xx/3xx response
+        """
+        endpoint = self.random.choices([task for task, weight in self.tasks],
+                                       weights=[weight for task, weight in self.tasks])[0]
+        start = time.perf_counter()
+        try:
+            response = self.index() if endpoint == 'GET /' else self.add()
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        return endpoint, time.perf_counter() - start, ok
+
+
+def run_stage(base_url, concurrency, duration, think_time=0.):
+    """
+    Runs concurrency simulated users for duration seconds
+    Args:
+        base_url (str): url of the running app
+        concurrency (int): number of simultaneous users
+        duration (float): seconds to run for
+        think_time (float): seconds each user waits between requests
+
+    Returns:
+        samples (dict): endpoint -> list of (latency seconds, ok) tuples
+        elapsed (float): wall seconds the stage ran for
+    """
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user_loop(seed):
+        user = DashboardUser(base_url, seed)
+        while time.perf_counter() < deadline:
+            endpoint, seconds, ok = user.run_task()
+            with lock:
+                samples[endpoint].append((seconds, ok))
+            if think_time > 0:
+                time.sleep(think_time)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user_loop, args=(concurrency * 1000 + i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed):
+    """
+    Latency percentiles and throughput per endpoint
+    Args:
+        samples (dict): endpoint -> list of (latency seconds, ok) tuples
+        elapsed (float): wall seconds the samples were collected over
+
+    Returns:
+        summary (dict): endpoint -> requests, errors, rps and p50/p95/p99 latency in ms
+    """
+    summary = {}
+    for endpoint, endpoint_samples in sorted(samples.items()):
+        latencies_ms = np.array([seconds for seconds, ok in endpoint_samples]) * 1000
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        summary[endpoint] = {'requests': len(endpoint_samples),
+                             'errors': sum(1 for seconds, ok in endpoint_samples if not ok),
+                             'rps': round(len(endpoint_samples) / elapsed, 2),
+                             'p50_ms': round(p50, 1), 'p95_ms': round(p95, 1), 'p99_ms': round(p99, 1)}
+    return summary
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    """
+    Compares results to a saved baseline
+    Args:
+        results (dict): concurrency -> summary, from this run
+        baseline (dict): concurrency -> summary, from the baseline file
+        tolerance (float): allowed relative increase in p95 latency or decrease in throughput
+
+    Returns:
+        regressions (list of str): description of each regression found
+    """
+    regressions = []
+    for concurrency, summary in results.items():
+        for endpoint, stats in summary.items():
+            base = baseline.get(concurrency, {}).get(endpoint)
+            if base is None:
+                continue
+            if stats['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                regressions.append("{} at concurrency {}: p95 {} ms vs {} ms baseline".format(
+                    endpoint, concurrency, stats['p95_ms'], base['p95_ms']))
+            if stats['rps'] < base['rps'] * (1 - tolerance):
+                regressions.append("{} at concurrency {}: {} req/s vs {} req/s baseline".format(
+                    endpoint, concurrency, stats['rps'], base['rps']))
+    return regressions
+
+
+def run_load_test(args):
+    """
+    Wrapper function that runs every concurrency stage and reports, saves or compares the results
+    Args:
+        args: from argparse
+           - concurrency (list of int): concurrency of each stage
+           - duration (float): seconds per stage
+           - think_time (float): seconds each user waits between requests
+           - save_baseline (str): optional path to save the results to as a baseline
+           - compare (str): optional path of a baseline to compare the results against
+           - tolerance (float): allowed relative regression when comparing
+           - verbose (bool): keep the app's per-request info logging
+
+    Returns:
+        regressions (list of str): regressions against the baseline, empty if no baseline was given
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        server, base_url = start_app(work_dir, args.verbose)
+        # warm up templates, imports and the country index before measuring
+        run_stage(base_url, 1, 1)
+        results = {}
+        try:
+            for concurrency in args.concurrency:
+                samples, elapsed = run_stage(base_url, concurrency, args.duration, args.think_time)
+                results[str(concurrency)] = summarize(samples, elapsed)
+                for endpoint, stats in results[str(concurrency)].items():
+                    logger.info("concurrency {:>3} {:<9} {:>6} requests {:>4} errors {:>8.2f} req/s  p50 {:>8.1f} ms  "
+                                "p95 {:>8.1f} ms  p99 {:>8.1f} ms".format(concurrency, endpoint, stats['requests'],
+                                                                         stats['errors'], stats['rps'], stats['p50_ms'],
+                                                                         stats['p95_ms'], stats['p99_ms']))
+        finally:
+            server.shutdown()
+
+    if args.save_baseline is not None:
+        os.makedirs(os.path.dirname(args.save_baseline) or '.', exist_ok=True)
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'created': pd.Timestamp.now().isoformat(), 'duration': args.duration, 'results': results}, f,
+                      indent=2)
+        logger.info("Baseline saved to {}".format(args.save_baseline))
+
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            logger.warning("Regression: {}".format(regression))
+        if len(regressions) == 0:
+            logger.info("No regressions against {}".format(args.compare))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the Flask dashboard against a local SQLite database.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 32],
+                        help='number of simultaneous users in each stage')
+    parser.add_argument('--duration', type=float, default=10, help='seconds each stage runs for')
+    parser.add_argument('--think_time', type=float, default=0, help='seconds each user waits between requests')
+    parser.add_argument('--save_baseline', default=None, help='path to save the results to as a baseline')
+    parser.add_argument('--compare', default=None, help='path of a saved baseline to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative increase in p95 latency/decrease in throughput against the baseline')
+    parser.add_argument('--verbose', action='store_true', help="Use arg to keep the app's per-request logging")
+    args = parser.parse_args()
+
+    regressions = run_load_test(args)
+    if len(regressions) > 0:
+        sys.exit(1)
@@ -3,8 +3,8 @@
 #get forecasts
 python3 src/generate_forecasts.py --config=config/config.yml
 
-#get forecast plots
-python3 src/generate_forecast_plots.py --config=config/config.yml
+#render all plots (trend, time-lapse, global and per-country forecasts)
+python3 src/render_plots.py --config=config/config.yml
 
 #get news headlines
 python3 src/get_news.py --config=config/config.yml
\ No newline at end of file
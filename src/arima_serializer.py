@@ -0,0 +1,316 @@
+import argparse
+import logging.config
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import yaml
+from scipy.stats import norm
+from statsmodels.tsa.arima_process import arma2ma
+import instrumentation
+import model_registry
+import baseline_models
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Compact serialization of fitted ARIMA models. ARIMAResults.save pickles the whole results object (training data, Hessian,
+intermediate arrays), while a forecast only needs the parameters, the order and the last few values of the series. A
+compact model file holds just those, in a versioned little endian binary layout:
+
+    header   magic b'ARIM', format version (uint16), p, d, q, k_trend (uint8 each)
+    float64  params (k_trend + p + q: constant, AR then MA coefficients), sigma2
+    float64  levels: last value of the series and of its first d - 1 differences (to integrate the forecast)
+    float64  last p values of the differenced series, oldest first
+    float64  last q residuals, oldest first
+
+CompactARIMA forecasts like ARIMAResults.forecast (forecast, standard errors, confidence intervals) from that state.
+Model files are told apart by their first bytes, so load_model reads compact files and the pickled models of older
+registry versions (and the pickled baseline models) alike.
+
+Run as a script, it compares the compact files to the pickles of a published version of the country models: file size,
+load time and the largest difference between the forecasts.
+"""
+
+MAGIC = b'ARIM'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sHBBBB')
+
+
+class CompactARIMA:
+    """The state of a fitted ARIMA model needed to forecast it"""
+
+    def __init__(self, order, k_trend, params, sigma2, levels, endog_tail, resid_tail):
+        """
+        Args:
+            order (tuple): (p, d, q)
+            k_trend (int): 1 with a constant, 0 without
+            params (array-like): constant (if any), AR then MA coefficients
+            sigma2 (float): variance of the residuals
+            levels (array-like): last value of the series and of its first d - 1 differences
+            endog_tail (array-like): last p values of the differenced series, oldest first
+            resid_tail (array-like): last q residuals, oldest first
+
+        Raises:
+            ValueError: if the arrays do not have the lengths the order calls for
+        """
+        self.order = tuple(int(x) for x in order)
+        self.k_trend = int(k_trend)
+        self.params = np.asarray(params, dtype=np.float64).ravel()
+        self.sigma2 = float(sigma2)
+        self.levels = np.asarray(levels, dtype=np.float64).ravel()
+        self.endog_tail = np.asarray(endog_tail, dtype=np.float64).ravel()
+        self.resid_tail = np.asarray(resid_tail, dtype=np.float64).ravel()
+        p, d, q = self.order
+        if (len(self.params), len(self.levels), len(self.endog_tail), len(self.resid_tail)) != (self.k_trend + p + q, d, p, q):
+            raise ValueError("ARIMA{} state does not match its order".format(self.order))
+
+    @property
+    def arparams(self):
+        return self.params[self.k_trend:self.k_trend + self.order[0]]
+
+    @property
+    def maparams(self):
+        return self.params[self.k_trend + self.order[0]:]
+
+    @classmethod
+    def from_results(cls, results):
+        """
+        Compact state of a fitted statsmodels ARIMAResults (or ARMAResults)
+        Args:
+            results: fitted model, e.g. from train_models.fit_arima_with_budget
+
+        Returns:
+            model (CompactARIMA): its compact state
+
+        Raises:
+            ValueError: for a model with exogenous regressors, which are not supported
+        """
+        if getattr(results, 'k_exog', 0):
+            raise ValueError("ARIMA models with exogenous regressors cannot be serialized compactly")
+        p, q, d = results.k_ar, results.k_ma, getattr(results, 'k_diff', 0)
+        # model.endog is the differenced series the ARMA part was fit to, model.data.endog the series itself
+        endog = np.asarray(results.model.endog, dtype=np.float64).ravel()
+        series = np.asarray(results.model.data.endog, dtype=np.float64).ravel()
+        resid = np.asarray(results.resid, dtype=np.float64).ravel()
+        levels = [np.diff(series[-d:], k)[-1] for k in range(d)]
+        return cls((p, d, q), results.k_trend, np.asarray(results.params), results.sigma2, levels,
+                   endog[len(endog) - p:], resid[len(resid) - q:])
+
+    def forecast(self, steps=1, alpha=.05):
+        """
+        Forecast the next steps days, like ARIMAResults.forecast
+        Args:
+            steps (int): number of days to forecast
+            alpha (float): the confidence intervals are (1 - alpha)
+
+        Returns:
+            forecast (numpy array): forecasts of the series
+            stderr (numpy array): standard error of each forecast
+            conf_int (numpy array): steps x 2 confidence intervals
+        """
+        p, d, q = self.order
+        arparams, maparams = self.arparams, self.maparams
+        # the constant is the mean of the differenced series, the intercept of the recursion is mean * (1 - sum(AR))
+        mu = self.params[0] * (1 - arparams.sum()) if self.k_trend else 0.
+        z = np.r_[self.endog_tail, np.zeros(steps)]
+        forecast = np.empty(steps)
+        for h in range(steps):
+            # AR terms over the last p values (forecasts once past the data), MA terms over the residuals still in reach
+            value = mu + np.dot(arparams[::-1], z[h:h + p])
+            value += np.dot(maparams[h:][::-1], self.resid_tail[h:]) if h < q else 0.
+            forecast[h] = z[h + p] = value
+        for level in self.levels[::-1]:
+            forecast = level + np.cumsum(forecast)
+
+        ma_rep = arma2ma(np.r_[1, -arparams], np.r_[1, maparams], lags=steps)
+        for _ in range(d):
+            ma_rep = np.cumsum(ma_rep)
+        stderr = np.sqrt(np.cumsum(ma_rep ** 2) * self.sigma2)
+        z_alpha = norm.ppf(1 - alpha / 2.)
+        conf_int = np.c_[forecast - z_alpha * stderr, forecast + z_alpha * stderr]
+        return forecast, stderr, conf_int
+
+    def to_bytes(self):
+        """The versioned binary layout of the model"""
+        p, d, q = self.order
+        values = np.r_[self.params, self.sigma2, self.levels, self.endog_tail, self.resid_tail]
+        return _HEADER.pack(MAGIC, FORMAT_VERSION, p, d, q, self.k_trend) + values.astype('<f8').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Model of a binary layout written by to_bytes
+        Args:
+            data (bytes): content of a compact model file
+
+        Returns:
+            model (CompactARIMA): the model
+
+        Raises:
+            ValueError: if the data is not a compact model of a supported format version, or is truncated
+        """
+        if len(data) < _HEADER.size:
+            raise ValueError("Not a compact ARIMA model: {} bytes".format(len(data)))
+        magic, version, p, d, q, k_trend = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a compact ARIMA model")
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported compact ARIMA format version {} (expected {})".format(version, FORMAT_VERSION))
+        sizes = [k_trend + p + q, 1, d, p, q]
+        values = np.frombuffer(data, dtype='<f8', offset=_HEADER.size)
+        if len(values) != sum(sizes):
+            raise ValueError("Compact ARIMA{} model is truncated or corrupt".format((p, d, q)))
+        params, sigma2, levels, endog_tail, resid_tail = np.split(values.astype(np.float64), np.cumsum(sizes)[:-1])
+        return cls((p, d, q), k_trend, params, sigma2[0], levels, endog_tail, resid_tail)
+
+    def save(self, fname):
+        """
+        Write the model to fname in the compact format
+        Args:
+            fname (str): path (including filename) to save to
+
+        Returns:
+            None -- saves the model
+        """
+        with open(fname, 'wb') as f:
+            f.write(self.to_bytes())
+
+
+def is_compact_file(fname):
+    """Whether fname is a compact model file (rather than a pickled model)"""
+    with open(fname, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load(fname):
+    """Model of a compact model file, see CompactARIMA.from_bytes"""
+    with open(fname, 'rb') as f:
+        return CompactARIMA.from_bytes(f.read())
+
+
+def save_model(model, fname):
+    """
+    Saves a trained model the way it is published: ARIMA models in the compact format, baseline models (already a few
+    floats) pickled. An ARIMA model that cannot be serialized compactly is pickled whole.
+    Args:
+        model: fitted ARIMAResults, CompactARIMA or baseline_models.BaselineModel
+        fname (str): path (including filename) to save to
+
+    Returns:
+        None -- saves the model
+    """
+    if isinstance(model, (baseline_models.BaselineModel, CompactARIMA)):
+        model.save(fname)
+        return
+    try:
+        compact = CompactARIMA.from_results(model)
+    except ValueError as e:
+        logger.warning("Saving the whole pickled model: {}".format(e))
+        model.save(fname)
+        return
+    compact.save(fname)
+
+
+def compare(model_paths, n_days=7, repeat=3):
+    """
+    Size and load time of pickled models against their compact files
+    Args:
+        model_paths (dict): name -> path of a pickled model (baseline models are skipped)
+        n_days (int): days forecast to check the compact model forecasts like the pickled one
+        repeat (int): each file set is loaded this many times and the fastest is kept
+
+    Returns:
+        comparison_df (pandas DataFrame): model, pickle_bytes, compact_bytes and the largest absolute forecast
+            difference of each ARIMA model
+        load_seconds (dict): 'pickle' and 'compact' -> time to load every model
+    """
+    rows, pickled, compact_paths = [], {}, {}
+    with tempfile.TemporaryDirectory() as compact_dir:
+        for name, path in model_paths.items():
+            with open(path, 'rb') as f:
+                model = pickle.load(f)
+            if isinstance(model, (baseline_models.BaselineModel, CompactARIMA)):
+                continue
+            compact_paths[name] = os.path.join(compact_dir, name)
+            save_model(model, compact_paths[name])
+            difference = np.max(np.abs(np.asarray(model.forecast(n_days)[0], dtype=float)
+                                       - load(compact_paths[name]).forecast(n_days)[0]))
+            rows.append({'model': name, 'pickle_bytes': os.path.getsize(path),
+                         'compact_bytes': os.path.getsize(compact_paths[name]), 'max_forecast_difference': difference})
+            pickled[name] = path
+
+        def time_loads(load_file, paths):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for path in paths.values():
+                    load_file(path)
+                timings.append(time.perf_counter() - start)
+            return min(timings)
+
+        def load_pickle(path):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+
+        load_seconds = {'pickle': time_loads(load_pickle, pickled), 'compact': time_loads(load, compact_paths)}
+    return pd.DataFrame(rows, columns=['model', 'pickle_bytes', 'compact_bytes', 'max_forecast_difference']), load_seconds
+
+
+@instrumentation.timed('run_compare_serialization')
+def run_compare_serialization(args):
+    """
+    Wrapper function to compare the pickled country models of a registry version to their compact files
+    Args:
+        args: from argparse
+           - config (str): Path to yaml file with model_registry and generate_forecasts as top level keys
+           - version (str): registry version of the country models, 'latest' by default
+           - s3_flag (bool): read the models from the s3 registry rather than the local one
+
+    Returns:
+        None -- wrapper function
+    """
+    try:
+        with open(args.config, "r") as f:
+            config = yaml.load(f,Loader=yaml.FullLoader)
+    except IOError:
+        logger.error("Could not read in the config file--verify correct filename/path.")
+        sys.exit(1)
+
+    registry = model_registry.get_registry(config['model_registry'],'country',args.s3_flag)
+    try:
+        version, entry = registry.resolve(args.version)
+        with open(registry.fetch(config['generate_forecasts']['get_country_list']['input_filename'],version), 'rb') as f:
+            countries = pickle.load(f)
+        model_paths = {"ARIMA_{}".format(country): registry.fetch("ARIMA_{}".format(country),version)
+                       for country in countries}
+    except Exception as e:
+        logger.error("Could not read the country models of version {}: {}:{}".format(args.version, type(e).__name__, e))
+        sys.exit(1)
+    model_paths = {name: path for name, path in model_paths.items() if not is_compact_file(path)}
+
+    comparison_df, load_seconds = compare(model_paths, config['generate_forecasts']['get_country_forecast']['n_days'])
+    instrumentation.add_rows(len(comparison_df))
+    if len(comparison_df) == 0:
+        logger.warning("Version {} has no pickled ARIMA models to compare".format(version))
+        return
+    logger.info("{} ARIMA models of version {}: {:.1f} KB pickled, {:.1f} KB compact ({:.0f}x smaller); loaded in "
+                "{:.3f}s pickled, {:.3f}s compact; largest forecast difference {:.2e}".format(
+                    len(comparison_df), version, comparison_df['pickle_bytes'].sum() / 1024,
+                    comparison_df['compact_bytes'].sum() / 1024,
+                    comparison_df['pickle_bytes'].sum() / comparison_df['compact_bytes'].sum(),
+                    load_seconds['pickle'], load_seconds['compact'], comparison_df['max_forecast_difference'].max()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the size and load time of pickled and compact country models')
+    parser.add_argument('--config', '-c', default='config.yml', help='path to yaml file with configurations')
+    parser.add_argument('--version', default='latest', help="Registry version of the country models (default: latest)")
+    parser.add_argument("--s3", dest='s3_flag', action='store_true', help="Use arg to read the models from s3 rather than locally.")
+    args = parser.parse_args()
+    run_compare_serialization(args)
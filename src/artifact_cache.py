@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging.config
+import os
+import re
+import tempfile
+import threading
+import time
+import boto3
+import botocore.exceptions as botoexceptions
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Local disk cache of s3 objects, content addressed by ETag:
+
+    <cache_dir>/objects/<etag>        object content
+    <cache_dir>/keys/<sha1 of key>    json with the ETag last seen for an s3 key
+
+A read with a known ETag (e.g. recorded in the model registry index) is served from disk with no s3 request at all. A
+read by key alone revalidates the cached copy with a conditional GET (If-None-Match), which downloads nothing when the
+object is unchanged. Files are written to a temporary name and renamed into place, so threads and processes sharing the
+cache never see a partial file, and the least recently used objects are evicted once the cache is over max_bytes.
+"""
+
+# s3 returns this error code for a conditional GET of an unchanged object
+NOT_MODIFIED_CODES = ("304", "NotModified")
+BLOCK_SIZE = 2 ** 20
+
+
+def etag_filename(etag):
+    """File name of an ETag (quotes and any other character unsafe in a file name dropped)"""
+    return re.sub(r'[^0-9A-Za-z_-]', '', etag)
+
+
+class ArtifactCache:
+    """
+    ETag keyed disk cache in front of an s3 client.
+
+        cache = ArtifactCache("models/cache", max_bytes=2 ** 30)
+        path = cache.get(bucket, "models/country/2020-06-04T09-30-12/ARIMA_Spain", etag='"9b2cf535f27731c974343645a3985328"')
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 ** 30, s3=None, min_age_seconds=300):
+        """
+        Args:
+            cache_dir (str): local directory of the cache
+            max_bytes (int): size of the cached objects above which the least recently used are evicted
+            s3: optional boto3 s3 client
+            min_age_seconds (float): objects used more recently than this are never evicted, so a path just returned by
+                get stays valid while it is being read
+        """
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.keys_dir = os.path.join(cache_dir, "keys")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.keys_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.min_age_seconds = min_age_seconds
+        self.s3 = s3 if s3 is not None else boto3.client("s3")
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'not_modified': 0, 'downloads': 0, 'evictions': 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def object_path(self, etag):
+        return os.path.join(self.objects_dir, etag_filename(etag))
+
+    def key_path(self, s3_bucket_name, key):
+        return os.path.join(self.keys_dir, hashlib.sha1("{}/{}".format(s3_bucket_name, key).encode('utf-8')).hexdigest())
+
+    def known_etag(self, s3_bucket_name, key):
+        """ETag last seen for an s3 key, None if the key was never cached"""
+        try:
+            with open(self.key_path(s3_bucket_name, key)) as f:
+                return json.load(f)['etag']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _write_atomic(self, directory, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _remember(self, s3_bucket_name, key, etag):
+        body = json.dumps({'bucket': s3_bucket_name, 'key': key, 'etag': etag}).encode('utf-8')
+        self._write_atomic(self.keys_dir, self.key_path(s3_bucket_name, key), lambda f: f.write(body))
+
+    def _hit(self, path, stat):
+        try:
+            # the modification time doubles as the last use time for the LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        self._count(stat)
+        return path
+
+    def put(self, local_file, s3_bucket_name, key, etag):
+        """
+        Adds a local file known to match an s3 object (e.g. one just uploaded) to the cache
+        Args:
+            local_file (str): path of the file
+            s3_bucket_name (str): bucket of the object
+            key (str): key of the object
+            etag (str): ETag of the object
+
+        Returns:
+            path (str): path of the cached copy
+        """
+        path = self.object_path(etag)
+        if not os.path.exists(path):
+            def copy(f):
+                with open(local_file, 'rb') as source:
+                    for block in iter(lambda: source.read(BLOCK_SIZE), b''):
+                        f.write(block)
+            self._write_atomic(self.objects_dir, path, copy)
+        self._remember(s3_bucket_name, key, etag)
+        self.evict()
+        return path
+
+    def get(self, s3_bucket_name, key, etag=None, sha256=None):
+        """
+        Local path of the content of an s3 object, downloading it only if the cache has no copy of it
+        Args:
+            s3_bucket_name (str): bucket of the object
+            key (str): key of the object
+            etag (str): ETag of the wanted content if known; a cached copy is then used without any s3 request
+            sha256 (str): optional sha256 hex digest a downloaded object must match
+
+        Returns:
+            path (str): path of the cached copy (valid for at least min_age_seconds)
+
+        Raises:
+            ValueError: if a downloaded object does not match sha256
+        """
+        if etag is not None and os.path.exists(self.object_path(etag)):
+            path = self._hit(self.object_path(etag), 'hits')
+            if path is not None:
+                return path
+
+        request = {'Bucket': s3_bucket_name, 'Key': key}
+        cached_etag = etag if etag is not None else self.known_etag(s3_bucket_name, key)
+        if cached_etag is not None and os.path.exists(self.object_path(cached_etag)):
+            request['IfNoneMatch'] = cached_etag
+        try:
+            response = self.s3.get_object(**request)
+        except botoexceptions.ClientError as e:
+            if 'IfNoneMatch' in request and e.response['Error']['Code'] in NOT_MODIFIED_CODES:
+                path = self._hit(self.object_path(cached_etag), 'not_modified')
+                if path is not None:
+                    return path
+                response = self.s3.get_object(Bucket=s3_bucket_name, Key=key)
+            else:
+                raise
+        return self._store(s3_bucket_name, key, response, sha256)
+
+    def _store(self, s3_bucket_name, key, response, sha256=None):
+        path = self.object_path(response['ETag'])
+        digest = hashlib.sha256()
+
+        def download(f):
+            for block in iter(lambda: response['Body'].read(BLOCK_SIZE), b''):
+                digest.update(block)
+                f.write(block)
+            if sha256 is not None and digest.hexdigest() != sha256:
+                raise ValueError("Checksum mismatch for s3://{}/{}".format(s3_bucket_name, key))
+
+        self._write_atomic(self.objects_dir, path, download)
+        self._remember(s3_bucket_name, key, response['ETag'])
+        self._count('downloads')
+        logger.debug("Downloaded s3://{}/{} to the artifact cache".format(s3_bucket_name, key))
+        self.evict()
+        return path
+
+    def size(self):
+        """Total bytes of the cached objects"""
+        return sum(entry.stat().st_size for entry in os.scandir(self.objects_dir) if not entry.name.startswith('.'))
+
+    def evict(self):
+        """
+        Removes the least recently used objects until the cache is under max_bytes (objects used within
+        min_age_seconds are kept even if the cache stays over)
+        Returns:
+            evicted (int): number of objects removed
+        """
+        entries = []
+        for entry in os.scandir(self.objects_dir):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        now = time.time()
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes or now - mtime < self.min_age_seconds:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+            self._count('evictions')
+        if evicted > 0:
+            logger.debug("Evicted {} objects from the artifact cache".format(evicted))
+        return evicted
@@ -0,0 +1,96 @@
+import asyncio
+import logging.config
+import os
+import random
+import aiohttp
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+# response codes that are worth retrying: rate limiting and transient server side errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryableStatusError(Exception):
+    """Raised for an HTTP response with a status code in RETRY_STATUSES"""
+    pass
+
+
+class Fetcher:
+    """
+    Asynchronous HTTP client for the pipeline's API pulls. Requests are made concurrently up to max_concurrency at a
+    time, retried with exponential backoff on connection errors/timeouts/retryable status codes, requested with gzip
+    transfer encoding and streamed to disk in chunks rather than being held in memory.
+
+    Use as an async context manager:
+        async with Fetcher(max_concurrency=8) as fetcher:
+            paths = await fetcher.fetch_many(jobs)
+    """
+
+    def __init__(self, max_concurrency=8, max_retries=3, backoff_seconds=1.0, timeout_seconds=60,
+                 chunk_size=1024 * 1024):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout_seconds = timeout_seconds
+        self.chunk_size = chunk_size
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout_seconds),
+                                             headers={'Accept-Encoding': 'gzip'})
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    async def fetch_to_file(self, url, out_path, params=None):
+        """
+        GET a url and stream the (decompressed) response body to out_path
+        Args:
+            url (str): url to request
+            out_path (str): local path (including filename) the response body is written to
+            params (dict): optional query string parameters
+
+        Returns:
+            out_path (str): path the response was written to
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.semaphore:
+                    async with self.session.get(url, params=params) as response:
+                        if response.status in RETRY_STATUSES:
+                            raise RetryableStatusError("{} returned status {}".format(url, response.status))
+                        response.raise_for_status()
+                        # write to a temporary file first so a failed attempt never leaves a truncated file behind
+                        tmp_path = out_path + ".part"
+                        with open(tmp_path, 'wb') as f:
+                            async for chunk in response.content.iter_chunked(self.chunk_size):
+                                f.write(chunk)
+                        os.replace(tmp_path, out_path)
+                logger.debug("Fetched {} to {}".format(url, out_path))
+                return out_path
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError,
+                    RetryableStatusError) as e:
+                if attempt == self.max_retries:
+                    raise
+                # exponential backoff with jitter so concurrent retries do not hit the API at the same moment
+                delay = self.backoff_seconds * (2 ** attempt) * (0.5 + random.random())
+                logger.warning("Request to {} failed ({}: {}), retrying in {:.1f}s".format(url, type(e).__name__, e,
+                                                                                            delay))
+                await asyncio.sleep(delay)
+
+    async def fetch_many(self, jobs):
+        """
+        Fetch several urls concurrently
+        Args:
+            jobs (list of dict): each with 'url', 'out_path' and optionally 'params'
+
+        Returns:
+            results (list): out_path for each successful job, or the exception raised for a failed one, in job order
+        """
+        tasks = [self.fetch_to_file(job['url'], job['out_path'], job.get('params')) for job in jobs]
+        return await asyncio.gather(*tasks, return_exceptions=True)
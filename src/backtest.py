@@ -0,0 +1,249 @@
+import argparse
+import logging.config
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import yaml
+import helper
+import instrumentation
+import forecast_metrics
+import train_models as tm
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Backtest of the country models: the prepared country table is cut off at n_cutoffs historical dates, and for every
+cut-off each country's model is chosen and trained on the data up to it (train_models.choose_models, with the baselines
+configs of train_models.py) and scored on the horizon days after it, as if train_models.py had been run that day. The
+model that won at each cut-off is reported with its scores. Countries are backtested in parallel on a process pool.
+Within a country the cut-offs are replayed oldest first so the training windows overlap, and each ARIMA fit starts from
+the parameters of the previous cut-off's ARIMA model (warm start), usually a few iterations from the optimum instead of
+hundreds.
+
+Each cut-off trains on all the history before it, or on its last window_days days only. Backtesting several windows in
+one run (--window_days) reports the accuracy and the fit time of each, to choose train_models->training_window_days.
+
+The scored results are appended to the backtest_results table under a run label, so two configurations are compared
+with two runs of this script.
+"""
+
+# columns of the results table, besides the forecast_metrics.METRICS
+RESULT_COLUMNS = ['window_days', 'cutoff', 'country', 'model_type', 'warm_start', 'fit_seconds', 'iterations', 'fit_status']
+
+
+def cutoff_dates(dates, n_cutoffs, horizon, step_days=7):
+    """
+    The most recent cut-off dates that leave horizon days of actuals after them
+    Args:
+        dates (array-like): dates of the prepared data
+        n_cutoffs (int): number of cut-offs
+        horizon (int): days forecast and scored after each cut-off
+        step_days (int): days between consecutive cut-offs
+
+    Returns:
+        cutoffs (list): pandas Timestamps, oldest first (fewer than n_cutoffs if the data does not go back far enough)
+
+    Raises:
+        ValueError: if the data does not cover more than horizon days
+    """
+    dates = pd.to_datetime(pd.Series(dates)).dt.normalize()
+    first, last = dates.min(), dates.max()
+    if pd.isna(last) or (last - first).days <= horizon:
+        raise ValueError("The data needs to cover more than the {} day horizon to be backtested".format(horizon))
+    cutoffs = [last - pd.Timedelta(days=horizon + step_days * i) for i in range(n_cutoffs)]
+    return sorted(cutoff for cutoff in cutoffs if cutoff >= first)
+
+
+def backtest_country(country, dates, confirmed, cutoffs, horizon, model_params, optional_fit_args, fit_budget=None,
+                     warm_start=True, baselines=None, window_days=0):
+    """
+    Trains and forecasts one country at every cut-off. Runs in the worker processes of backtest
+    Args:
+        country (str): name of the country
+        dates (array-like): dates of the country's rows
+        confirmed (array-like): confirmed cases of the country's rows
+        cutoffs (list): cut-off dates, oldest first
+        horizon (int): days forecast after each cut-off
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        fit_budget (dict): optional 'max_seconds'/'max_iterations' limits per fit
+        warm_start (bool): start each ARIMA fit from the parameters of the previous cut-off's ARIMA model
+        baselines (dict): baselines configs of the country models (min_days, arima_above_mape, options)
+        window_days (int): days before each cut-off trained on, all of them if 0
+
+    Returns:
+        folds (list of dicts): one per cut-off the country could be trained at, with the RESULT_COLUMNS (model_type:
+            the model chosen there) and the y_train, y_test and y_pred arrays
+    """
+    series = pd.Series(np.asarray(confirmed, dtype=float), index=pd.to_datetime(dates).normalize()).sort_index()
+    folds = []
+    start_params = None
+    for cutoff in cutoffs:
+        in_window = series.index > cutoff - pd.Timedelta(days=window_days) if window_days else True
+        y_train = series[(series.index <= cutoff) & in_window].reset_index(drop=True)
+        y_test = series[(series.index > cutoff) & (series.index <= cutoff + pd.Timedelta(days=horizon))]
+        if not tm.has_enough_data(y_train, baselines) or len(y_test) == 0:
+            continue
+        fold = {'window_days': window_days, 'cutoff': cutoff.date(), 'country': country}
+
+        warm = warm_start and start_params is not None
+        fit_args = dict(optional_fit_args, start_params=start_params) if warm else optional_fit_args
+        models, model_types, _, diagnostics = tm.choose_models([y_train], model_params, fit_args, fit_budget, baselines,
+                                                               names=['{} at {}'.format(country, cutoff.date())])
+        if warm and diagnostics[0]['Fit_Status'] in ('failed', 'time_budget_exceeded'):
+            # the previous optimum can be a poor start when the series changed course, try again from scratch
+            seconds = diagnostics[0]['Fit_Seconds']
+            models, model_types, _, diagnostics = tm.choose_models([y_train], model_params, optional_fit_args,
+                                                                   fit_budget, baselines)
+            diagnostics[0]['Fit_Seconds'] += seconds
+            warm = False
+        model, diagnostics = models[0], diagnostics[0]
+        fold['warm_start'] = warm and diagnostics['Fit_Status'] != 'not_fit'
+        fold['fit_seconds'], fold['iterations'] = diagnostics['Fit_Seconds'], diagnostics['Iterations']
+        fold['fit_status'], fold['model_type'] = diagnostics['Fit_Status'], model_types[0]
+        if fold['model_type'] == 'arima':
+            start_params = np.asarray(model.params)
+
+        fold['y_train'] = y_train.values
+        fold['y_test'] = y_test.values
+        fold['y_pred'] = np.asarray(model.forecast(len(y_test))[0], dtype=float)
+        folds.append(fold)
+    return folds
+
+
+def score(folds):
+    """
+    Scores the folds of every country and cut-off at once
+    Args:
+        folds (list of dicts): output of backtest_country for any number of countries
+
+    Returns:
+        results_df (pandas DataFrame): RESULT_COLUMNS and forecast_metrics.METRICS, one row per country and cut-off
+    """
+    metrics = forecast_metrics.evaluate(forecast_metrics.stack([fold['y_test'] for fold in folds]),
+                                        forecast_metrics.stack([fold['y_pred'] for fold in folds]),
+                                        forecast_metrics.stack([fold['y_train'] for fold in folds], align='right'))
+    results_df = pd.DataFrame([{column: fold[column] for column in RESULT_COLUMNS} for fold in folds],
+                              columns=RESULT_COLUMNS)
+    for name, values in metrics.items():
+        results_df[name] = values
+    return results_df.sort_values(['window_days', 'cutoff', 'country'], ignore_index=True)
+
+
+def backtest(country_df, model_params, optional_fit_args, fit_budget=None, n_cutoffs=4, horizon=7, step_days=7,
+             baselines=None, warm_start=True, workers=None, window_days=0):
+    """
+    Backtests the country models over the most recent cut-offs, every country on a process pool
+    Args:
+        country_df (pandas DataFrame): Country, Date and Confirmed of every country by day
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        fit_budget (dict): optional 'max_seconds'/'max_iterations' limits per fit
+        n_cutoffs (int): number of cut-offs
+        horizon (int): days forecast and scored after each cut-off
+        step_days (int): days between consecutive cut-offs
+        baselines (dict): baselines configs of the country models (min_days, arima_above_mape, options), see
+            train_models.choose_models
+        warm_start (bool): start each ARIMA fit from the parameters of the previous cut-off's ARIMA model
+        workers (int): number of processes, defaults to the number of cpus
+        window_days (int): days before each cut-off trained on, all of them if 0
+
+    Returns:
+        results_df (pandas DataFrame): output of score for every country and cut-off
+    """
+    cutoffs = cutoff_dates(country_df['Date'], n_cutoffs, horizon, step_days)
+    logger.info("Backtesting {} countries at {} cut-offs: {}".format(
+        country_df['Country'].nunique(), len(cutoffs), ", ".join(str(cutoff.date()) for cutoff in cutoffs)))
+    folds, failed = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(backtest_country, country, group['Date'].values, group['Confirmed'].values, cutoffs,
+                               horizon, model_params, optional_fit_args, fit_budget, warm_start, baselines,
+                               window_days): country
+                   for country, group in country_df.groupby('Country', sort=False)}
+        for future in as_completed(futures):
+            try:
+                folds.extend(future.result())
+            except Exception as e:
+                logger.error("Backtest of {} failed: {}:{}".format(futures[future], type(e).__name__, e))
+                failed.append(futures[future])
+    if len(failed) > 0:
+        logger.warning("{} countries could not be backtested: {}".format(len(failed), ", ".join(sorted(failed))))
+    return score(folds)
+
+
+def summarize_backtest(results_df):
+    """
+    Average of each metric by cut-off and over the whole backtest, for each training window
+    Args:
+        results_df (pandas DataFrame): output of backtest, or of several backtests with different windows
+
+    Returns:
+        summary_df (pandas DataFrame): window_days, cutoff ('all' for the whole backtest), countries, models (number of
+            countries each model type won), fit_seconds, warm_starts and the forecast_metrics.METRICS
+    """
+    groups = []
+    for window_days, window_df in results_df.groupby('window_days'):
+        groups += [(window_days, cutoff, df) for cutoff, df in window_df.groupby('cutoff')] + [(window_days, 'all', window_df)]
+    return pd.DataFrame([dict(window_days=window_days, cutoff=cutoff, countries=len(df),
+                              models=", ".join("{}: {}".format(model_type, count) for model_type, count
+                                               in sorted(df['model_type'].value_counts().items())),
+                              fit_seconds=round(df['fit_seconds'].sum(), 2), warm_starts=int(df['warm_start'].sum()),
+                              **forecast_metrics.summarize(df))
+                         for window_days, cutoff, df in groups])
+
+
+@instrumentation.timed('run_backtest')
+def run_backtest(args):
+    """
+    Wrapper function to backtest the country model configuration of a config file
+    Args:
+        args: from argparse
+           - config (str): Path to yaml file with train_models and backtest as top level keys
+           - engine_string (str): sqlalchemy engine string argument can be entered
+           - label (str): name of the run in the backtest_results table, defaults to the config file name
+           - window_days (list): training windows to backtest (0: all history), defaults to the training window of
+             the config file
+
+    Returns:
+        None -- wrapper function
+    """
+    try:
+        with open(args.config, "r") as f:
+            config = yaml.load(f,Loader=yaml.FullLoader)
+    except IOError:
+        logger.error("Could not read in the config file--verify correct filename/path.")
+        sys.exit(1)
+
+    country_data = tm.reduce_and_reshape_data('country',tm.read_data_from_db('country',args.engine_string))
+    instrumentation.add_rows(len(country_data))
+    model_configs = config['train_models']['country_model_configs']
+    windows = args.window_days or [config['train_models'].get('training_window_days') or 0]
+    try:
+        results_df = pd.concat([backtest(country_data,model_configs['model_params'],model_configs['optional_fit_args'],
+                                         model_configs.get('fit_budget'),baselines=model_configs.get('baselines'),
+                                         window_days=window_days,**config['backtest'])
+                                for window_days in windows], ignore_index=True)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+
+    summary_df = summarize_backtest(results_df)
+    logger.info("Backtest results by training window and cut-off:\n{}".format(summary_df.to_string(index=False)))
+    results_df.insert(0, 'run_label', args.label or os.path.basename(args.config))
+    results_df.insert(1, 'run_date', datetime.now())
+    helper.add_to_database(results_df, "backtest_results", 'append', args.engine_string)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backtest the country forecasting models over historical cut-off dates')
+    parser.add_argument('--config', '-c', default='config.yml', help='path to yaml file with configurations')
+    parser.add_argument("--engine_string", default=None, help="Optional engine string for db to read data from and add results to")
+    parser.add_argument("--label", default=None, help="Name of the run in the backtest_results table (default: the config file name)")
+    parser.add_argument("--window_days", type=int, nargs='+', default=None,
+                        help="Training windows in days to compare, 0 for all history (default: train_models->training_window_days)")
+    args = parser.parse_args()
+    run_backtest(args)
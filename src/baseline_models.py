@@ -0,0 +1,231 @@
+import abc
+import numpy as np
+import pickle
+import logging.config
+import forecast_metrics
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Cheap baseline forecasters for the country models. Every model is fit to all countries at once: the series are stacked
+into a 2-D array with one row per country (forecast_metrics.stack(..., align='right'), so the last values line up and
+shorter series are NaN padded at the start) and fit_many/forecast_many are a few array operations over the whole stack.
+A single fitted row is wrapped in a model object that mirrors the parts of the ARIMAResults interface the pipeline uses
+(forecast and save), so it is saved, loaded and forecast with like any other country model.
+
+    naive_drift    last + k * average daily change over the whole series
+    damped_trend   last + trend * (phi + phi^2 + ... + phi^k), trend = average daily change over the last window days
+    log_linear     exp(log(1 + last) + k * growth) - 1, growth = least squares slope of log(1 + y) over the last window
+"""
+
+
+def _last(Y):
+    """Last value of each row of a right aligned stack"""
+    return Y[:, -1] if Y.shape[1] > 0 else np.full(len(Y), np.nan)
+
+
+class BaselineModel(abc.ABC):
+    """
+    Base class of the baseline models. Subclasses list their fitted parameters in PARAMS and implement fit_many and
+    forecast_many over arrays of those parameters (one value per row).
+    """
+    PARAMS = ()
+
+    @classmethod
+    @abc.abstractmethod
+    def fit_many(cls, Y, **options):
+        """
+        Fit the model to every row
+        Args:
+            Y (numpy array): series, one right aligned row per country
+            **options: model options
+
+        Returns:
+            params (dict): name (PARAMS) -> array of that parameter for every row
+        """
+
+    @classmethod
+    @abc.abstractmethod
+    def forecast_many(cls, params, steps):
+        """
+        Forecast every row
+        Args:
+            params (dict): output of fit_many
+            steps (int): number of days to forecast
+
+        Returns:
+            forecasts (numpy array): one row of steps forecasts per row of the parameters
+        """
+
+    @classmethod
+    def from_params(cls, params, row):
+        """
+        Model object of one row of fit_many's parameters
+        Args:
+            params (dict): output of fit_many
+            row (int): row of the series to build the model of
+
+        Returns:
+            model (BaselineModel): fitted model of that row
+        """
+        return cls(**{name: params[name][row] for name in cls.PARAMS})
+
+    @classmethod
+    def fit(cls, y, **options):
+        """
+        Fit the model to a series
+        Args:
+            y (pandas Series or array-like): confirmed cases by day, oldest first
+            **options: model options, see fit_many
+
+        Returns:
+            model (BaselineModel): fitted model
+        """
+        y = np.asarray(y, dtype=float).ravel()
+        if len(y) == 0:
+            raise ValueError("Cannot fit a {} model to an empty series".format(cls.__name__))
+        return cls.from_params(cls.fit_many(y[None, :], **options), 0)
+
+    def forecast(self, steps):
+        """
+        Forecast the next steps days
+        Args:
+            steps (int): number of days to forecast
+
+        Returns:
+            (forecast, stderr, conf_int) tuple like ARIMAResults.forecast -- only the forecast is provided
+        """
+        params = {name: np.array([getattr(self, name)]) for name in self.PARAMS}
+        return type(self).forecast_many(params, steps)[0], None, None
+
+    def save(self, fname):
+        """
+        Pickle the model to fname. ARIMAResults.load is a plain unpickle so get_model can load these files as well
+        Args:
+            fname (str): path (including filename) to save to
+
+        Returns:
+            None -- saves the model
+        """
+        with open(fname, 'wb') as f:
+            pickle.dump(self, f)
+
+
+class NaiveDriftModel(BaselineModel):
+    """
+    Random walk with drift: forecasts continue the average daily change seen over the training series. Also the
+    fallback when an ARIMA fit fails or runs past its budget.
+    """
+    PARAMS = ('last_value', 'drift')
+
+    def __init__(self, last_value, drift):
+        self.last_value = float(last_value)
+        self.drift = float(drift)
+
+    @classmethod
+    def fit_many(cls, Y):
+        counts = np.sum(~np.isnan(Y), axis=1)
+        # first value of each row, i.e. after the NaN padding
+        first = Y[np.arange(len(Y)), np.argmax(~np.isnan(Y), axis=1)] if Y.shape[1] > 0 else np.full(len(Y), np.nan)
+        last = _last(Y)
+        drift = np.divide(last - first, counts - 1, out=np.zeros(len(Y)), where=counts > 1)
+        return {'last_value': last, 'drift': drift}
+
+    @classmethod
+    def forecast_many(cls, params, steps):
+        return params['last_value'][:, None] + params['drift'][:, None] * np.arange(1, steps + 1)
+
+
+class DampedTrendModel(BaselineModel):
+    """Recent average daily change, fading by a factor phi per day ahead (a slowing outbreak)"""
+    PARAMS = ('last_value', 'trend', 'phi')
+
+    def __init__(self, last_value, trend, phi):
+        self.last_value = float(last_value)
+        self.trend = float(trend)
+        self.phi = float(phi)
+
+    @classmethod
+    def fit_many(cls, Y, phi=0.9, window=7):
+        trend = forecast_metrics.row_nanmean(np.diff(Y[:, -(window + 1):], axis=1))
+        return {'last_value': _last(Y), 'trend': np.nan_to_num(trend), 'phi': np.full(len(Y), float(phi))}
+
+    @classmethod
+    def forecast_many(cls, params, steps):
+        # phi + phi^2 + ... + phi^k for k = 1..steps
+        damping = np.cumsum(params['phi'][:, None] ** np.arange(1, steps + 1), axis=1)
+        return params['last_value'][:, None] + params['trend'][:, None] * damping
+
+
+class LogLinearModel(BaselineModel):
+    """Constant daily growth rate fitted to the last window days (an outbreak growing exponentially)"""
+    PARAMS = ('last_value', 'growth')
+
+    def __init__(self, last_value, growth):
+        self.last_value = float(last_value)
+        self.growth = float(growth)
+
+    @classmethod
+    def fit_many(cls, Y, window=14):
+        L = np.log1p(np.clip(Y[:, -window:], 0, None))
+        x = np.broadcast_to(np.arange(L.shape[1], dtype=float), L.shape)
+        mask = ~np.isnan(L)
+        counts = mask.sum(axis=1)
+        # least squares slope of each row over its non NaN values
+        x_mean = np.divide(np.where(mask, x, 0).sum(axis=1), counts, out=np.zeros(len(L)), where=counts > 0)
+        L_mean = np.divide(np.where(mask, L, 0).sum(axis=1), counts, out=np.zeros(len(L)), where=counts > 0)
+        dx = np.where(mask, x - x_mean[:, None], 0)
+        sxx = (dx ** 2).sum(axis=1)
+        sxy = (dx * np.where(mask, L - L_mean[:, None], 0)).sum(axis=1)
+        growth = np.divide(sxy, sxx, out=np.zeros(len(L)), where=sxx > 0)
+        return {'last_value': _last(Y), 'growth': growth}
+
+    @classmethod
+    def forecast_many(cls, params, steps):
+        return np.expm1(np.log1p(np.clip(params['last_value'], 0, None))[:, None]
+                        + params['growth'][:, None] * np.arange(1, steps + 1))
+
+
+# model family, by the Model_Type recorded for a country
+MODELS = {'naive_drift': NaiveDriftModel, 'damped_trend': DampedTrendModel, 'log_linear': LogLinearModel}
+
+
+def fit_all(Y, options=None):
+    """
+    Fits every baseline model to every row
+    Args:
+        Y (numpy array): series, one right aligned row per country
+        options (dict): optional model name -> options of its fit_many, e.g. {'damped_trend': {'phi': 0.8}}
+
+    Returns:
+        fitted (dict): model name -> parameters of every row
+    """
+    options = options or {}
+    return {name: model.fit_many(Y, **options.get(name, {})) for name, model in MODELS.items()}
+
+
+def select(Y_train, Y_test, options=None):
+    """
+    Fits every baseline model to each row of Y_train and picks the one with the lowest MAPE on Y_test
+    Args:
+        Y_train (numpy array): training series, one right aligned row per country
+        Y_test (numpy array): the days that follow, one row per country
+        options (dict): optional model name -> options of its fit_many
+
+    Returns:
+        names (numpy array): best model of each row (naive_drift where no model has a MAPE, e.g. actuals of 0)
+        mapes (numpy array): its holdout MAPE
+        forecasts (numpy array): its holdout forecasts, same shape as Y_test
+    """
+    names = list(MODELS)
+    if len(Y_train) == 0:
+        return np.array([], dtype=object), np.array([]), np.empty(Y_test.shape)
+    fitted = fit_all(Y_train, options)
+    # models x rows x days
+    forecasts = np.stack([MODELS[name].forecast_many(fitted[name], Y_test.shape[1]) for name in names])
+    mapes = np.stack([forecast_metrics.mape(Y_test, forecast) for forecast in forecasts], axis=1)
+    best = np.argmin(np.where(np.isnan(mapes), np.inf, mapes), axis=1)
+    rows = np.arange(len(best))
+    return np.array(names, dtype=object)[best], mapes[rows, best], forecasts[best, rows]
@@ -0,0 +1,190 @@
+import itertools
+import json
+import logging.config
+import re
+import numpy as np
+import pandas as pd
+import schema
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Out-of-core mode of data_preparation.py for raw dumps too large to load as one DataFrame. Raw records are streamed in
+fixed-size batches; each batch is parsed (schema.py), reduced to country/date partial sums and added to a
+DailyAggregator, which holds one small int64 array per date. Dates are flushed to the daily tables as soon as they are
+complete (after each partition of the raw archive, or at the end of a single json file), so memory depends on the batch
+size and the number of countries and dates, not on the number of raw (city level) records.
+"""
+
+_WHITESPACE = re.compile(r'[\s,]*')
+
+
+def iter_json_records(fileobj, buffer_size=2 ** 20):
+    """
+    Streams the records of a file holding one json array (the raw API dump) without loading the whole file
+    Args:
+        fileobj (file-like object): text file object positioned at the start of the array
+        buffer_size (int): characters read at a time
+
+    Yields:
+        record (dict): one raw API record
+
+    Raises:
+        ValueError: if the file is not a json array or is truncated
+    """
+    decoder = json.JSONDecoder()
+    buffer = fileobj.read(buffer_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("Expected a json array of records")
+    pos = 1
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if buffer.startswith(']', pos):
+            return
+        try:
+            record, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # the record is cut off at the end of the buffer, read more of the file
+            chunk = fileobj.read(buffer_size)
+            if not chunk:
+                raise ValueError("Truncated json array after {} characters".format(pos))
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield record
+
+
+def iter_json_file(input_file_path, buffer_size=2 ** 20):
+    """Streams the records of a local json array file (see iter_json_records), opening it when iteration starts"""
+    with open(input_file_path) as f:
+        yield from iter_json_records(f, buffer_size)
+
+
+def iter_batches(records, batch_size):
+    """
+    Groups a stream of records into lists of at most batch_size records
+    Args:
+        records (iterable): raw API records
+        batch_size (int): number of records per batch
+
+    Yields:
+        batch (list): the next batch_size records (fewer for the last batch)
+    """
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+class DailyAggregator:
+    """
+    Country/date sums of the counts, accumulated batch by batch. Each date holds an int64 array with a row per country
+    seen so far (country names are stored once and referred to by row), so adding a batch and flushing a date are
+    vectorized and the state stays a few KB per date.
+    """
+
+    def __init__(self):
+        self.countries = []
+        self.country_rows = {}
+        self.dates = {}
+
+    def country_row(self, country):
+        if country not in self.country_rows:
+            self.country_rows[country] = len(self.countries)
+            self.countries.append(country)
+        return self.country_rows[country]
+
+    def date_arrays(self, date):
+        """Sums and seen mask of a date, grown to the current number of countries"""
+        sums, seen = self.dates.get(date, (np.zeros((0, len(schema.COUNT_COLUMNS)), dtype='int64'),
+                                           np.zeros(0, dtype=bool)))
+        missing = len(self.countries) - len(seen)
+        if missing > 0:
+            sums = np.vstack([sums, np.zeros((missing, sums.shape[1]), dtype='int64')])
+            seen = np.concatenate([seen, np.zeros(missing, dtype=bool)])
+            self.dates[date] = (sums, seen)
+        return sums, seen
+
+    def add(self, df):
+        """
+        Adds the partial sums of a batch of raw records
+        Args:
+            df (pandas DataFrame): batch parsed by schema.parse_records
+
+        Returns:
+            None
+        """
+        # same rows as data_preparation.get_country_daily: all of China's provinces, every other country's total
+        rows = df.loc[(df['Country'] == 'China') | (df['Province'] == ''), ['Country', 'Date'] + schema.COUNT_COLUMNS]
+        grouped = rows.groupby(['Country', 'Date'], observed=True).sum()
+        country_rows = np.array([self.country_row(country) for country in grouped.index.get_level_values('Country')],
+                                dtype='int64')
+        dates = grouped.index.get_level_values('Date')
+        values = grouped.to_numpy(dtype='int64')
+        for date in dates.unique():
+            selected = dates == date
+            sums, seen = self.date_arrays(date)
+            # (country, date) pairs are unique within grouped, so a plain fancy-indexed add is safe
+            sums[country_rows[selected]] += values[selected]
+            seen[country_rows[selected]] = True
+
+    def pop(self, dates=None):
+        """
+        Removes dates from the aggregator and returns their rows of the daily tables
+        Args:
+            dates (list): dates to flush, defaults to every date held
+
+        Returns:
+            country_df (pandas DataFrame): country daily rows of the dates, same columns as get_country_daily
+            global_df (pandas DataFrame): global daily rows of the dates, same columns as get_global_daily
+        """
+        dates = sorted(self.dates if dates is None else [date for date in dates if date in self.dates])
+        country_frames, global_rows = [], []
+        for date in dates:
+            sums, seen = self.date_arrays(date)
+            del self.dates[date]
+            frame = pd.DataFrame(sums[seen], columns=schema.COUNT_COLUMNS)
+            frame.insert(0, 'Country', [self.countries[row] for row in np.flatnonzero(seen)])
+            frame.insert(1, 'Date', date)
+            country_frames.append(frame)
+            global_rows.append(dict(zip(schema.COUNT_COLUMNS, sums[seen].sum(axis=0)), Date=date))
+        if len(country_frames) == 0:
+            country_df = pd.DataFrame(columns=['Country', 'Date'] + schema.COUNT_COLUMNS)
+        else:
+            country_df = pd.concat(country_frames, ignore_index=True)
+        global_df = pd.DataFrame(global_rows, columns=['Date', 'Confirmed', 'Recovered', 'Active', 'Deaths'])
+        return schema.apply_schema(country_df), schema.apply_schema(global_df)
+
+    def nbytes(self):
+        """Bytes held by the per-date arrays"""
+        return sum(sums.nbytes + seen.nbytes for sums, seen in self.dates.values())
+
+
+def prepare_in_chunks(record_groups, write, batch_size=20000):
+    """
+    Aggregates streamed raw records to the country and global daily tables, writing them as dates complete
+    Args:
+        record_groups (iterable): iterables of raw records; every date in a group is complete once the group has been
+            read (e.g. one group per partition of the raw archive, or a single group for a json file)
+        write (function): called with (country_df, global_df) for each flush of completed dates
+        batch_size (int): number of records parsed at a time
+
+    Returns:
+        nbr_records (int): number of raw records read
+    """
+    aggregator = DailyAggregator()
+    nbr_records, peak_bytes = 0, 0
+    for records in record_groups:
+        for batch in iter_batches(records, batch_size):
+            aggregator.add(schema.parse_records(batch))
+            nbr_records += len(batch)
+            peak_bytes = max(peak_bytes, aggregator.nbytes())
+        country_df, global_df = aggregator.pop()
+        if len(country_df) > 0:
+            write(country_df, global_df)
+    logger.info("Aggregated {} raw records in batches of {} (aggregation state peaked at {:.2f} MB)".format(
+        nbr_records, batch_size, peak_bytes / 2 ** 20))
+    return nbr_records
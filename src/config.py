@@ -7,6 +7,12 @@ PROJECT_HOME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # NewsAPI KEY
 NEWS_API_KEY = os.environ.get("NEWS_API_KEY")
 
+### PIPELINE METRICS ###
+# JSON lines file that per-stage timings/resource usage are appended to. Set to an empty string to turn off
+METRICS_JSON_PATH = os.environ.get("METRICS_JSON_PATH", os.path.join(PROJECT_HOME, 'data/metrics/pipeline_metrics.jsonl'))
+# Optional directory for prometheus text files (one <stage>.prom per run_* wrapper), e.g. a node_exporter textfile dir
+METRICS_PROM_DIR = os.environ.get("METRICS_PROM_DIR")
+
 ### DATABASES ###
 # FOR RDS
 conn_type = "mysql+pymysql"
@@ -0,0 +1,213 @@
+import logging.config
+import os
+import pickle
+import re
+import threading
+from collections import Counter
+import unidecode
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+# common names and abbreviations for countries whose COVID19API name differs. Only aliases whose target is in the
+# country list are indexed.
+DEFAULT_ALIASES = {
+    'usa': 'United States of America',
+    'us': 'United States of America',
+    'united states': 'United States of America',
+    'america': 'United States of America',
+    'uk': 'United Kingdom',
+    'great britain': 'United Kingdom',
+    'britain': 'United Kingdom',
+    'south korea': 'Korea (South)',
+    'north korea': 'Korea (North)',
+    'russia': 'Russian Federation',
+    'iran': 'Iran, Islamic Republic of',
+    'vietnam': 'Viet Nam',
+    'laos': 'Lao PDR',
+    'czechia': 'Czech Republic',
+    'ivory coast': "Cote d'Ivoire",
+    'drc': 'Congo (Kinshasa)',
+    'democratic republic of the congo': 'Congo (Kinshasa)',
+    'republic of the congo': 'Congo (Brazzaville)',
+    'taiwan': 'Taiwan, Republic of China',
+    'north macedonia': 'Macedonia, Republic of',
+    'tanzania': 'Tanzania, United Republic of',
+    'palestine': 'Palestinian Territory',
+    'vatican': 'Holy See (Vatican City State)',
+    'burma': 'Myanmar',
+    'cape verde': 'Cabo Verde',
+    'eswatini': 'Swaziland',
+}
+
+
+def normalize_country(name):
+    """
+    Normalizes a country name for lookups: accents removed, lower case, '&' spelled out, punctuation dropped and a
+    leading 'the' removed, so 'The Côte d'Ivoire' and 'cote divoire' compare equal
+    Args:
+        name (str): country name as typed or as stored
+
+    Returns:
+        key (str): normalized name
+    """
+    key = unidecode.unidecode(name).lower().replace('&', ' and ')
+    key = re.sub(r"['`]", '', key)
+    key = re.sub(r'[^a-z0-9]+', ' ', key).strip()
+    if key.startswith('the '):
+        key = key[4:]
+    return key
+
+
+def trigrams(key):
+    """Set of character trigrams of a normalized name, padded so the start and end of the name count"""
+    padded = "  {} ".format(key)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CountryIndex:
+    """
+    Lookup of the countries the app has forecasts for. Names are resolved through a hash index of normalized names and
+    aliases in O(1); names that do not resolve get suggestions from a trigram index built up front.
+    """
+
+    def __init__(self, countries, aliases=None):
+        self.countries = sorted(set(countries))
+        self.keys = {}
+        ambiguous = set()
+        by_normalized = {normalize_country(country): country for country in self.countries}
+
+        def add(key, country):
+            if not key or key in ambiguous:
+                return
+            if key in self.keys and self.keys[key] != country:
+                # a derived name shared by two countries (e.g. 'congo') resolves to neither
+                del self.keys[key]
+                ambiguous.add(key)
+                return
+            self.keys[key] = country
+
+        for country in self.countries:
+            # derived names: the name without its parenthetical part and the parenthetical part alone
+            # ('Syrian Arab Republic (Syria)' -> 'syrian arab republic', 'syria'), and 'Iran, Islamic Republic of' -> 'iran'
+            for derived in re.findall(r'\(([^)]*)\)', country) + [re.sub(r'\(.*?\)', '', country),
+                                                                   country.split(',')[0]]:
+                add(normalize_country(derived), country)
+        for alias, target in (DEFAULT_ALIASES if aliases is None else aliases).items():
+            target = by_normalized.get(normalize_country(target))
+            if target is not None:
+                self.keys[normalize_country(alias)] = target
+        # the full names always win over derived names and aliases
+        self.keys.update(by_normalized)
+
+        self.key_trigrams = {key: trigrams(key) for key in self.keys}
+        self.trigram_index = {}
+        for key, key_trigrams in self.key_trigrams.items():
+            for trigram in key_trigrams:
+                self.trigram_index.setdefault(trigram, []).append(key)
+
+    @classmethod
+    def from_file(cls, country_list_file, aliases=None):
+        """
+        Builds the index from the pickled country list written by train_models.py
+        Args:
+            country_list_file (str): path to countries.pkl
+            aliases (dict): optional alias -> country name mapping, defaults to DEFAULT_ALIASES
+
+        Returns:
+            index (CountryIndex): the index
+        """
+        with open(country_list_file, 'rb') as f:
+            return cls(pickle.load(f), aliases)
+
+    def __len__(self):
+        return len(self.countries)
+
+    def __contains__(self, name):
+        return self.resolve(name) is not None
+
+    def resolve(self, name):
+        """
+        Resolves a typed country name
+        Args:
+            name (str): country name as typed by a user
+
+        Returns:
+            country (str or None): the name in the country list, None if the name is not recognized
+        """
+        return self.keys.get(normalize_country(name))
+
+    def suggest(self, name, limit=3, min_score=0.3):
+        """
+        Countries with names similar to a name that did not resolve, ranked by trigram similarity
+        Args:
+            name (str): country name as typed by a user
+            limit (int): maximum number of suggestions
+            min_score (float): minimum similarity (shared trigrams over all trigrams of both names, 0 to 1)
+
+        Returns:
+            suggestions (list of tuple): (country, score) pairs, best first
+        """
+        query_trigrams = trigrams(normalize_country(name))
+        shared = Counter(key for trigram in query_trigrams for key in self.trigram_index.get(trigram, []))
+        best = {}
+        for key, count in shared.items():
+            score = count / (len(query_trigrams) + len(self.key_trigrams[key]) - count)
+            country = self.keys[key]
+            if score >= min_score and score > best.get(country, 0):
+                best[country] = score
+        return sorted(best.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+class CountryIndexService:
+    """
+    Holds the CountryIndex for the webapp. The index is built once and rebuilt when the country list file changes on
+    disk (checked on each access) or when reload is called. A file that cannot be read is not tried again until it
+    changes, and the last good index is kept meanwhile.
+    """
+
+    def __init__(self, country_list_file, aliases=None):
+        self.country_list_file = country_list_file
+        self.aliases = aliases
+        self.lock = threading.Lock()
+        self.mtime = None
+        # modification time of the file version that could not be loaded, so it is not reloaded on every request
+        self.failed_mtime = None
+        self.index = CountryIndex([])
+        self.reload()
+
+    def reload(self):
+        """
+        Rebuilds the index from the country list file. If the file cannot be read the current index is kept.
+        Returns:
+            loaded (bool): True if the index was rebuilt
+        """
+        with self.lock:
+            mtime = None
+            try:
+                mtime = os.stat(self.country_list_file).st_mtime
+                index = CountryIndex.from_file(self.country_list_file, self.aliases)
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                logger.error("Unable to load the country list {}: {}:{}".format(self.country_list_file,
+                                                                                 type(e).__name__, e))
+                self.failed_mtime = mtime
+                return False
+            self.index, self.mtime, self.failed_mtime = index, mtime, None
+        logger.info("Country index loaded with {} countries from {}".format(len(index), self.country_list_file))
+        return True
+
+    def get(self):
+        """
+        Current index, rebuilt first if the country list file has changed
+        Returns:
+            index (CountryIndex): the index
+        """
+        try:
+            mtime = os.stat(self.country_list_file).st_mtime
+            changed = mtime != self.mtime and mtime != self.failed_mtime
+        except OSError:
+            changed = False
+        if changed:
+            self.reload()
+        return self.index
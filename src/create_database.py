@@ -1,5 +1,5 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Date
+from sqlalchemy import Column, Integer, String, Date, DateTime, Float, Boolean
 import logging
 import argparse
 import logging.config
@@ -22,6 +22,18 @@ class Country_Covid_Daily_Cases(Base):
     active = Column(Integer,unique=False, nullable = False)
     deaths = Column(Integer,unique=False, nullable = False)
 
+class Province_Covid_Daily_Cases(Base):
+    """Create a data model for the daily cases of each province (the province level of the hierarchy)"""
+    __tablename__ = 'province_covid_daily_cases'
+    id = Column(Integer, primary_key=True)
+    country = Column(String(100),unique=False, nullable=False)
+    province = Column(String(100),unique=False, nullable=False)
+    date = Column(Date,unique=False, nullable=False)
+    confirmed = Column(Integer,unique=False, nullable = False)
+    recovered = Column(Integer,unique=False, nullable = False)
+    active = Column(Integer,unique=False, nullable = False)
+    deaths = Column(Integer,unique=False, nullable = False)
+
 class Global_Covid_Daily_Cases(Base):
     """Create a data model for the database to be set up for COVID-19 visualizations and forecasting"""
     __tablename__ = 'global_covid_daily_cases'
@@ -47,6 +59,69 @@ class Country_Covid_Forecast(Base):
     date = Column(Date, unique=False, nullable=False)
     confirmed_cases_forecast = Column(Integer,unique=False,nullable=False)
 
+class Province_Covid_Forecast(Base):
+    """Create a data model to store forecasting predictions for confirmed cases of each province"""
+    __tablename__ = 'province_covid_forecast'
+    id = Column(Integer, primary_key=True)
+    country = Column(String(100),unique=False, nullable=False)
+    province = Column(String(100),unique=False, nullable=False)
+    date = Column(Date, unique=False, nullable=False)
+    confirmed_cases_forecast = Column(Integer,unique=False,nullable=False)
+
+class Country_Model_Diagnostics(Base):
+    """Create a data model to store fit diagnostics of the country forecasting models from the latest training run"""
+    __tablename__ = 'country_model_diagnostics'
+    id = Column(Integer, primary_key=True)
+    country = Column(String(100),unique=False, nullable=False)
+    date = Column(Date, unique=False, nullable=False)
+    mape = Column(Float, unique=False, nullable=True)
+    model_type = Column(String(30), unique=False, nullable=False)
+    fit_seconds = Column(Float, unique=False, nullable=False)
+    iterations = Column(Integer, unique=False, nullable=True)
+    converged = Column(Boolean, unique=False, nullable=False)
+    warning_count = Column(Integer, unique=False, nullable=False)
+    fit_status = Column(String(30), unique=False, nullable=False)
+
+class Model_Evaluation(Base):
+    """Create a data model to store the forecast accuracy of the models of every training run"""
+    __tablename__ = 'model_evaluation'
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, unique=False, nullable=False)
+    version = Column(String(50), unique=False, nullable=True)
+    model = Column(String(50), unique=False, nullable=False)
+    series = Column(String(100), unique=False, nullable=False)
+    fold = Column(Integer, unique=False, nullable=False)
+    mape = Column(Float, unique=False, nullable=True)
+    smape = Column(Float, unique=False, nullable=True)
+    mase = Column(Float, unique=False, nullable=True)
+    rmse = Column(Float, unique=False, nullable=True)
+
+class Backtest_Results(Base):
+    """Create a data model to store the scored forecasts of each country at each cut-off of a backtest run"""
+    __tablename__ = 'backtest_results'
+    id = Column(Integer, primary_key=True)
+    run_label = Column(String(100), unique=False, nullable=False)
+    run_date = Column(DateTime, unique=False, nullable=False)
+    window_days = Column(Integer, unique=False, nullable=False)
+    cutoff = Column(Date, unique=False, nullable=False)
+    country = Column(String(100), unique=False, nullable=False)
+    model_type = Column(String(30), unique=False, nullable=False)
+    warm_start = Column(Boolean, unique=False, nullable=False)
+    fit_seconds = Column(Float, unique=False, nullable=False)
+    iterations = Column(Integer, unique=False, nullable=True)
+    fit_status = Column(String(30), unique=False, nullable=False)
+    mape = Column(Float, unique=False, nullable=True)
+    smape = Column(Float, unique=False, nullable=True)
+    mase = Column(Float, unique=False, nullable=True)
+    rmse = Column(Float, unique=False, nullable=True)
+
+class Data_Version(Base):
+    """Create a data model for the version of the case/forecast data, bumped whenever the pipeline rewrites it"""
+    __tablename__ = 'data_version'
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, unique=False, nullable=False)
+    updated = Column(DateTime, unique=False, nullable=False)
+
 class User_App_Inputs(Base):
     __tablename__ = 'covid_app_user_inputs'
     id = Column(Integer,primary_key=True)
@@ -9,6 +9,13 @@ import botocore.exceptions as botoexceptions
 import logging.config
 import helper
 import os
+import asyncio
+import aiohttp
+import async_fetch
+import raw_archive
+import get_news as gn
+import config as cfg
+import instrumentation
 """
 Warning: Running data_acquistion.py may take several minutes to run as API pull is ~100MB. The API date parameters are not functioning at this time to filter down this data.
 """
@@ -58,25 +65,22 @@ def get_latest_date_s3(s3_bucket_name,s3_output_path):
 #                 "Latest date: {}".format(latest_date))
 #     return latest_date
 
-def acquire_data(url,s3_flag,end_date,start_date=None,**kwargs):
+def resolve_start_date(s3_flag,start_date=None,**kwargs):
     """
-    Make GET request to API (COVID19API) to retrieve raw data
+    Get the date the data pull should begin from
     Args:
-        url (str): url for api to pull data from
-        end_date (str): date which will be used as the date up to which data will be pulled.
-        start_date (str or None): date which will be used as the date from which the data pull will begin from.
-        If no argument is specified, arg is set to None and date is automatically retrieved based on latest data in s3 or local
+        s3_flag (bool): Flag used to determine if the latest data is searched for in s3
+        start_date (str or None): user input start date. If None, date is automatically retrieved based on latest data
+        in s3 or set to the beginning of the year when running locally
         **kwargs: Arbitrary keyword arguments
             -s3_output_path (str): s3 bucket file path where data has historically been written to. Only used if running pipeline in s3.
             -bucket_name (str): s3 bucket name to which the data has been historically be saved to. Only used if running pipeline in s3.
+            -raw_format (str): 'ndjson_gz' if raw data is kept in the partitioned archive (see raw_archive.py), else 'json'
+            -archive_dir (str): local directory of the archive. Only used if raw_format is 'ndjson_gz' and running locally.
 
     Returns:
-        api_pull (dict): dict consisting of COVID-19 case information (number of confirmed cases, deaths, recovered) by country and date
+        start_date (str): date from which the data pull will begin
     """
-
-    logger.info("Making GET request to COVID19 API")
-    logger.warning("This request response will contain over 100 MB of data--abort now if you have concerns on "
-                   "storage limitations either on s3 or local depending on where you have chosen to store the data")
     # If no arg was start_date was specified, get date of latest api pull
     if start_date == None :
         # If running pipeline in s3, search s3 for latest data
@@ -90,19 +94,50 @@ def acquire_data(url,s3_flag,end_date,start_date=None,**kwargs):
 
             s3_output_path = kwargs.get('s3_output_path', None)
             bucket_name= kwargs.get('bucket_name', None)
-            start_date = get_latest_date_s3(bucket_name,s3_output_path)
-        # Otherwise running locally. In local flow, just keeping one copy of any given type of file. Set start_date as
-        # beginning of the year
+            if kwargs.get('raw_format') == 'ndjson_gz':
+                # the archive manifest records the latest pull so there is no need to list the bucket
+                manifest = raw_archive.read_manifest_s3(bucket_name,s3_output_path,s3)
+                start_date = manifest['latest_pull'] if manifest is not None else "2020-01-01"
+            else:
+                start_date = get_latest_date_s3(bucket_name,s3_output_path)
+        # Otherwise running locally. With the archive, continue from the latest pull. With the single json file, just
+        # keeping one copy of any given type of file. Set start_date as beginning of the year
+        elif kwargs.get('raw_format') == 'ndjson_gz':
+            manifest = raw_archive.read_manifest_local(kwargs.get('archive_dir'))
+            start_date = manifest['latest_pull'] if manifest is not None else "2020-01-01"
         else:
             #start_date = get_latest_date_local(kwargs.get('local_path', None))
             start_date = "2020-01-01"
+    return start_date
+
+def acquire_data(url,s3_flag,end_date,start_date=None,timeout=None,**kwargs):
+    """
+    Make GET request to API (COVID19API) to retrieve raw data
+    Args:
+        url (str): url for api to pull data from
+        end_date (str): date which will be used as the date up to which data will be pulled.
+        start_date (str or None): date which will be used as the date from which the data pull will begin from.
+        If no argument is specified, arg is set to None and date is automatically retrieved based on latest data in s3 or local
+        timeout (float or None): seconds to wait on the API before giving up. None waits indefinitely
+        **kwargs: Arbitrary keyword arguments
+            -s3_output_path (str): s3 bucket file path where data has historically been written to. Only used if running pipeline in s3.
+            -bucket_name (str): s3 bucket name to which the data has been historically be saved to. Only used if running pipeline in s3.
+
+    Returns:
+        api_pull (dict): dict consisting of COVID-19 case information (number of confirmed cases, deaths, recovered) by country and date
+    """
+
+    logger.info("Making GET request to COVID19 API")
+    logger.warning("This request response will contain over 100 MB of data--abort now if you have concerns on "
+                   "storage limitations either on s3 or local depending on where you have chosen to store the data")
+    start_date = resolve_start_date(s3_flag,start_date,**kwargs)
 
     # Make call to the API with exception handling
     payload = {}
     headers = {}
     params = {'from': start_date, 'to': end_date}
     try:
-        response = requests.request("GET", url, params=params, headers=headers, data=payload)
+        response = requests.request("GET", url, params=params, headers=headers, data=payload, timeout=timeout)
     except requests.exceptions.ConnectionError:
         logger.error("There was a connection error to the API. Please try again or verify the URL and API status.")
         sys.exit(1)
@@ -123,6 +158,99 @@ def acquire_data(url,s3_flag,end_date,start_date=None,**kwargs):
 
     return  api_pull
 
+async def fetch_country_data(fetcher,countries_url,country_url,staging_dir,start_date,end_date):
+    """
+    Fetch the list of countries and then the data for each country concurrently
+    Args:
+        fetcher (async_fetch.Fetcher): open fetcher to make the requests with
+        countries_url (str): url for the api endpoint listing the available countries
+        country_url (str): url for the per country api endpoint, with a {slug} placeholder for the country
+        staging_dir (str): local directory the responses are streamed to
+        start_date (str): date from which the data pull will begin
+        end_date (str): date up to which data will be pulled
+
+    Returns:
+        results (list): path of the response file for each country, or the exception raised for a failed country
+    """
+    countries_path = await fetcher.fetch_to_file(countries_url, os.path.join(staging_dir, "countries.json"))
+    with open(countries_path) as f:
+        countries = json.load(f)
+    logger.info("Fetching data for {} countries concurrently".format(len(countries)))
+    jobs = [{'url': country_url.format(slug=country['Slug']),
+             'params': {'from': start_date, 'to': end_date},
+             'out_path': os.path.join(staging_dir, "covid19_{}.json".format(country['Slug']))} for country in countries]
+    return await fetcher.fetch_many(jobs)
+
+def acquire_data_concurrent(countries_url,country_url,staging_dir,s3_flag,end_date,start_date=None,news_request=None,
+                            fetch_args=None,**kwargs):
+    """
+    Retrieve the raw COVID19API data one country at a time with concurrent requests (and optionally the news headlines
+    from newsAPI alongside them) instead of the single large request made by "acquire_data"
+    Args:
+        countries_url (str): url for the api endpoint listing the available countries
+        country_url (str): url for the per country api endpoint, with a {slug} placeholder for the country
+        staging_dir (str): local directory the responses are streamed to
+        s3_flag (bool): Flag used to determine if the latest data is searched for in s3 when start_date is None
+        end_date (str): date up to which data will be pulled
+        start_date (str or None): date from which the data pull will begin, see "resolve_start_date"
+        news_request (dict or None): if given, 'url' and 'params' of the newsAPI request to make in parallel
+        fetch_args (dict or None): max_concurrency, max_retries, backoff_seconds, timeout_seconds for async_fetch.Fetcher
+        **kwargs: bucket_name and s3_output_path as for "acquire_data"
+
+    Returns:
+        api_pull (list): COVID-19 case records for all countries, same form as the response of "acquire_data"
+        news_path (str or None): path to the raw newsAPI response, None if not requested or the request failed
+    """
+    if fetch_args is None:
+        fetch_args = {}
+    start_date = resolve_start_date(s3_flag,start_date,**kwargs)
+    os.makedirs(staging_dir, exist_ok=True)
+
+    async def fetch_all():
+        async with async_fetch.Fetcher(**fetch_args) as fetcher:
+            news_task = None
+            if news_request is not None:
+                news_task = asyncio.ensure_future(fetcher.fetch_to_file(news_request['url'],
+                                                                        os.path.join(staging_dir, "news.json"),
+                                                                        news_request['params']))
+            country_results = await fetch_country_data(fetcher,countries_url,country_url,staging_dir,start_date,end_date)
+            news_result = None
+            if news_task is not None:
+                news_result = (await asyncio.gather(news_task, return_exceptions=True))[0]
+            return country_results, news_result
+
+    logger.info("Making concurrent GET requests to COVID19 API")
+    try:
+        country_results, news_result = asyncio.run(fetch_all())
+    except (aiohttp.ClientError, asyncio.TimeoutError, async_fetch.RetryableStatusError) as e:
+        logger.error("Could not retrieve the list of countries from the API: {}:{}".format(type(e).__name__, e))
+        sys.exit(1)
+
+    failed = [result for result in country_results if isinstance(result, Exception)]
+    if len(failed) > 0:
+        logger.error("Requests for {} countries failed even after retrying, e.g. {}:{}. Please try again later."
+                     .format(len(failed), type(failed[0]).__name__, failed[0]))
+        sys.exit(1)
+
+    api_pull = []
+    for path in country_results:
+        try:
+            with open(path) as f:
+                api_pull.extend(json.load(f))
+        except ValueError:
+            logger.error("No json returned from response. Response saved at {}".format(path))
+            sys.exit(1)
+    logger.info("Concurrent API calls to COVID19-API were successful.")
+
+    news_path = None
+    if isinstance(news_result, Exception):
+        logger.error("Request to the news API failed: {}:{}. Pipeline will continue but the app will not display "
+                     "updated news headlines".format(type(news_result).__name__, news_result))
+    else:
+        news_path = news_result
+
+    return api_pull, news_path
+
 def write_data_to_s3(s3_bucket_name, api_data, s3_output_path,end_date):
     """
     Write raw data retrieved from API GET request to s3 bucket
@@ -152,6 +280,8 @@ def write_data_to_s3(s3_bucket_name, api_data, s3_output_path,end_date):
     try:
         logger.info("Pushing data to s3, this may take some time due to the large data size.")
         s3.put_object(Bucket=s3_bucket_name,Key=filename,Body=serializedAPIdata)
+        # keep the path's '_latest' manifest pointing at this pull so later stages do not have to list the bucket
+        helper.update_latest_manifest(s3_bucket_name,s3_output_path,filename,s3=s3)
     except botoexceptions.ParamValidationError:
         logger.error("There is an error in the data format. Verify the input to this function is still json format")
         sys.exit(1)
@@ -188,6 +318,7 @@ def write_data_to_local(api_data,local_filepath_out):
 
     logger.info("COVID-19 API Data was successfully saved to local. File is located at {}".format(local_filepath_out))
 
+@instrumentation.timed('run_data_acquistion')
 def run_data_acquistion(args):
     """
     Wrapper function that retrieves data via API call and saves to s3 bucket
@@ -213,15 +344,48 @@ def run_data_acquistion(args):
     s3_bucket_name =config['data_acquisition']['s3_bucket_name']
     output_path = config['data_acquisition']['s3_output_path']
     local_filepath_out = config['data_acquisition']['local_filepath_out']
-
+    timeout = config['data_acquisition'].get('request_timeout')
+    # raw pulls are kept either in the compressed, date partitioned archive (ndjson_gz) or as a single json file (json)
+    raw_format = config['data_acquisition'].get('raw_format', 'json')
+    archive_dir = config['data_acquisition'].get('archive_local_dir')
+    if raw_format == 'ndjson_gz':
+        output_path = config['data_acquisition']['archive_s3_prefix']
+
+    if args.concurrent:
+        # fetch each country concurrently, and the news headlines alongside them if requested
+        news_request = None
+        if args.with_news and cfg.NEWS_API_KEY is not None:
+            news_request = {'url': config['get_news']['acquire_data']['url'],
+                            'params': gn.get_request_params(config['get_news']['acquire_data']['params'])}
+        elif args.with_news:
+            logger.warning("No newsAPI key found--news headlines are not fetched")
+        api_data, news_path = acquire_data_concurrent(s3_flag=args.s3_flag,end_date=args.end_date,start_date=args.start_date,
+                                                      news_request=news_request,
+                                                      bucket_name=s3_bucket_name,s3_output_path=output_path,
+                                                      raw_format=raw_format,archive_dir=archive_dir,
+                                                      **config['data_acquisition']['concurrent_fetch'])
+        if news_path is not None:
+            with open(news_path) as f:
+                news_data = gn.get_articles(f.read())
+            if news_data is not None:
+                if args.s3_flag == True:
+                    gn.write_data_to_s3(news_data, **config['get_news']['write_data_to_s3'])
+                else:
+                    gn.write_data_to_local(news_data, **config['get_news']['write_data_to_local'])
     # call the acquire_data function depending on if start_date is provided in the cmd line args
-    if args.start_date is not None:
-        api_data = acquire_data(url,args.end_date,args.start_date)
+    elif args.start_date is not None:
+        api_data = acquire_data(url,args.s3_flag,args.end_date,args.start_date,timeout=timeout)
     else:
-        api_data = acquire_data(url, args.end_date,args.start_date,bucket_name=s3_bucket_name,s3_output_path=output_path)
+        api_data = acquire_data(url,args.s3_flag,args.end_date,args.start_date,timeout=timeout,bucket_name=s3_bucket_name,
+                                s3_output_path=output_path,raw_format=raw_format,archive_dir=archive_dir)
+    instrumentation.add_rows(len(api_data))
 
     #call function to write data either to s3 or local based on --s3 arg from cmd line
-    if args.s3_flag == True: 
+    if raw_format == 'ndjson_gz' and args.s3_flag == True:
+        raw_archive.write_archive_s3(api_data,s3_bucket_name,output_path,args.end_date)
+    elif raw_format == 'ndjson_gz':
+        raw_archive.write_archive_local(api_data,archive_dir,args.end_date)
+    elif args.s3_flag == True:
         write_data_to_s3(s3_bucket_name,api_data,output_path,args.end_date)
     else:
         write_data_to_local(api_data, local_filepath_out)
@@ -233,6 +397,8 @@ if __name__ == '__main__':
     parser.add_argument('--start_date', '-sd', help='optional start date for data pull')
     parser.add_argument('--end_date', '-ed',default=datetime.now().strftime("%Y-%m-%d"), help='optional end date for data pull')
     parser.add_argument("--s3", dest='s3_flag', action='store_true', help="Use arg if you want to save s3 rather than locally.")
+    parser.add_argument("--concurrent", action='store_true', help="Use arg to fetch each country concurrently rather than in one large request.")
+    parser.add_argument("--with_news", action='store_true', help="With --concurrent, also fetch the news headlines in parallel.")
 
     args = parser.parse_args()
 
@@ -8,22 +8,69 @@ import logging.config
 import boto3
 import yaml
 import argparse
+import codecs
 import glob
+import raw_archive
+import instrumentation
+import chunked_preparation
+import query_cache
+import schema
+import hierarchy
 
 #set-up logging
 logging.config.fileConfig(fname="local.conf")
 logger = logging.getLogger(__name__)
 
-def get_s3_data(s3_bucket_name,bucket_dir_path,input_filename = None):
+def records_to_dataframe(covid_data):
+    """
+    Converts raw records from the covid-19 API to a DataFrame
+    Args:
+        covid_data (list): raw API records, one dict per country/province/city and date
+
+    Returns:
+        covid_df (pandas DataFrame): typed DataFrame representation of the covid-19 data pulled from API
+    """
+    # only the columns used downstream are kept, with compact types (see schema.py)
+    covid_df = schema.parse_records(covid_data)
+    return covid_df
+
+def get_s3_archive_data(s3_bucket_name,s3_prefix):
+    """
+    Read covid 19 cases data from the compressed, date partitioned archive in s3 (see raw_archive.py)
+    Args:
+        s3_bucket_name (str): the name of S3 bucket containing the archive
+        s3_prefix (str): s3 path of the archive
+
+    Returns:
+        covid_df (pandas DataFrame): DataFrame representation of the covid-19 data pulled from API
+    """
+    covid_df = records_to_dataframe(raw_archive.read_archive_s3(s3_bucket_name,s3_prefix))
+    logger.info("Successfully retrieved data from the s3 archive")
+    return covid_df
+
+def get_local_archive_data(archive_dir):
+    """
+    Read covid 19 cases data from the compressed, date partitioned archive on local machine (see raw_archive.py)
+    Args:
+        archive_dir (str): local directory of the archive
+
+    Returns:
+        covid_df (pandas DataFrame): DataFrame representation of the covid-19 data pulled from API
+    """
+    covid_df = records_to_dataframe(raw_archive.read_archive_local(archive_dir))
+    logger.info("Successfully retrieved data from the local archive")
+    return covid_df
+
+def get_s3_object(s3_bucket_name,bucket_dir_path,input_filename = None):
     '''
-    Read covud 19 cases data from s3 bucket
+    Get the s3 object of the raw covid 19 cases data (its body is read by get_s3_data, or streamed in chunked mode)
     Args:
         s3_bucket_name: the name of S3 bucket containing data of interest
         bucket_dir_path: s3 bucket file path where data is located
         input_filename: optional argument for filename containing data of interest
 
     Returns:
-        covid_df (pandas DataFrame): DataFrame representation of the covid-19 data pulled from API
+        s3_obj (dict): response of the s3 get_object call
     '''
     ## try to connect to s3 prior to starting up any processing
     try:
@@ -50,6 +97,20 @@ def get_s3_data(s3_bucket_name,bucket_dir_path,input_filename = None):
                     "This may take a minute.")
         s3_obj_key = helper.get_latest_s3_data(s3_bucket_name, bucket_dir_path)['Key']
         s3_obj = s3.get_object(Bucket=s3_bucket_name,Key=s3_obj_key)
+    return s3_obj
+
+def get_s3_data(s3_bucket_name,bucket_dir_path,input_filename = None):
+    '''
+    Read covud 19 cases data from s3 bucket
+    Args:
+        s3_bucket_name: the name of S3 bucket containing data of interest
+        bucket_dir_path: s3 bucket file path where data is located
+        input_filename: optional argument for filename containing data of interest
+
+    Returns:
+        covid_df (pandas DataFrame): DataFrame representation of the covid-19 data pulled from API
+    '''
+    s3_obj = get_s3_object(s3_bucket_name,bucket_dir_path,input_filename)
 
     # the raw data should be in a json form, thus try to parse the s3 object accordingly otherwise throw exception
     try:
@@ -65,12 +126,7 @@ def get_s3_data(s3_bucket_name,bucket_dir_path,input_filename = None):
         logger.error("Unexpected error in parsing s3 data: {}:{}".format(type(error).__name__, error))
         sys.exit(1)
 
-    # convert data to a DataFrame
-    covid_df = pd.DataFrame(covid_data)
-    # Active cases data is just 0 throughout dataframe, thus replace with manual computation
-    covid_df['Active'] = covid_df['Confirmed'] - covid_df['Deaths'] - covid_df['Recovered']
-    # Convert date from string representation to datetime
-    covid_df['Date'] = pd.to_datetime(covid_df['Date'])
+    covid_df = records_to_dataframe(covid_data)
     return covid_df
 
 def get_local_data(input_file_path):
@@ -95,12 +151,7 @@ def get_local_data(input_file_path):
         logger.error("Unexpected error with trying to read in raw data locally: {}:{}".format(type(e).__name__, e))
         sys.exit(1)
 
-    # convert data to a DataFrame
-    covid_df = pd.DataFrame(covid_data)
-    # Active cases data is just 0 throughout dataframe, thus replace with manual computation
-    covid_df['Active'] = covid_df['Confirmed'] - covid_df['Deaths'] - covid_df['Recovered']
-    # Convert date from string representation to datetime
-    covid_df['Date'] = pd.to_datetime(covid_df['Date'])
+    covid_df = records_to_dataframe(covid_data)
 
     logger.info("Successfully retrieved data from local")
 
@@ -117,14 +168,14 @@ def get_country_daily(df):
     '''
     try:
         # china has to be processed differently than all other countries
-        china_df = df.loc[df['Country'] == 'China']
-        china_df = china_df.drop(columns=["Province","City","CityCode","Lat","Lon"])
-        china_df = china_df.groupby(['Country','Date']).sum().reset_index()
+        columns = ['Country','Date'] + schema.COUNT_COLUMNS
+        china_df = df.loc[df['Country'] == 'China', columns]
+        # observed=True: only group by the countries present, not every category of the categorical column
+        china_df = china_df.groupby(['Country','Date'], observed=True).sum().reset_index()
         # rest of the world
-        rest_of_the_world_df = df.loc[df['Province'] == '']
-        rest_of_the_world_df = rest_of_the_world_df.drop(columns=["Province","City","CityCode","Lat","Lon"])
-        rest_of_the_world_df = rest_of_the_world_df.groupby(['Country','Date']).sum().reset_index()
-        country_df = pd.concat([rest_of_the_world_df,china_df])
+        rest_of_the_world_df = df.loc[df['Province'] == '', columns]
+        rest_of_the_world_df = rest_of_the_world_df.groupby(['Country','Date'], observed=True).sum().reset_index()
+        country_df = schema.apply_schema(pd.concat([rest_of_the_world_df,china_df]))
     except AttributeError:
         logger.error("Your input to the function 'get_country_daily' was not a DataFrame and thus the function could not run")
         sys.exit(1)
@@ -147,16 +198,7 @@ def get_global_daily(df):
     """
     try:
         ### STILL REQUIRE PROCESSING AT THE COUNTRY LEVEL FIRST TO GET RID OF DUPLICATE COUNTING
-        china_df = df.loc[df['Country'] == 'China']
-        china_df = china_df.drop(columns=["Province","City","CityCode","Lat","Lon"])
-        china_df = china_df.groupby(['Country','Date']).sum().reset_index()
-        # rest of the world
-        rest_of_the_world_df = df.loc[df['Province'] == '']
-        rest_of_the_world_df = rest_of_the_world_df.drop(columns=["Province","City","CityCode","Lat","Lon"])
-        rest_of_the_world_df = rest_of_the_world_df.groupby(['Country','Date']).sum().reset_index()
-        country_df = pd.concat([rest_of_the_world_df,china_df])
-        # now sum up to global
-        global_df = country_df.groupby('Date').sum()[["Confirmed", "Recovered", "Active", "Deaths"]].reset_index()
+        global_df = aggregate_global_daily(get_country_daily(df))
     except TypeError:
         logger.error("Your input to the function 'get_global_daily' was not a DataFrame and thus the function could not run")
         sys.exit(1)
@@ -166,6 +208,117 @@ def get_global_daily(df):
 
     return global_df
 
+def aggregate_global_daily(country_df):
+    """
+    Sums the country daily cases (output of get_country_daily) to the global daily cases, so the global series is by
+    construction the sum of the country series
+    Args:
+        country_df (pandas DataFrame): country daily cases
+
+    Returns:
+        global_df (pandas DataFrame): global daily cases, same form as get_global_daily
+    """
+    global_df = country_df.groupby('Date')[["Confirmed", "Recovered", "Active", "Deaths"]].sum().reset_index()
+    return schema.apply_schema(global_df)
+
+def report_memory_usage(covid_data):
+    """
+    Logs the memory used by the raw and country DataFrames with pandas' default types (all API fields, python string
+    names, int64 counts) and with the compact types of schema.py
+    Args:
+        covid_data (list): raw API records, one dict per country/province/city and date
+
+    Returns:
+        usage (dict): frame name -> (MB with default types, MB with the compact types)
+    """
+    typed_df = records_to_dataframe(covid_data)
+    typed_country_df = get_country_daily(typed_df)
+
+    default_df = pd.DataFrame(covid_data)
+    default_df['Active'] = default_df['Confirmed'] - default_df['Deaths'] - default_df['Recovered']
+    default_df['Date'] = pd.to_datetime(default_df['Date'])
+    default_country_df = typed_country_df.astype(dict({'Country': object},
+                                                      **{column: 'int64' for column in schema.COUNT_COLUMNS}))
+
+    usage = {'raw': (schema.memory_usage_mb(default_df), schema.memory_usage_mb(typed_df)),
+             'country': (schema.memory_usage_mb(default_country_df), schema.memory_usage_mb(typed_country_df))}
+    for name, (default_mb, typed_mb) in usage.items():
+        logger.info("{} frame ({} rows): {:.2f} MB with default types, {:.2f} MB with compact types ({:.1f}x smaller)"
+                    .format(name, len(typed_df) if name == 'raw' else len(typed_country_df), default_mb, typed_mb,
+                            default_mb / typed_mb))
+    return usage
+
+def prepare_in_chunks(config, engine_string=None, s3_flag=False):
+    """
+    Out-of-core version of the data preparation steps (see chunked_preparation.py): streams the raw data in batches and
+    writes the daily tables and csv files incrementally, so memory does not grow with the size of the raw data
+    Args:
+        config (dict): configurations with data_preparation and hierarchy as top level keys
+        engine_string (str): sqlalchemy string for connection to desired database
+        s3_flag (bool): read the raw data from s3 rather than locally
+
+    Returns:
+        nbr_records (int): number of raw records read
+    """
+    prep_config = config['data_preparation']
+    # the streaming aggregation builds the country and global daily cases only
+    try:
+        levels = hierarchy.get_levels(config)
+    except ValueError as e:
+        logger.error("Invalid hierarchy in the config.yml: {}".format(e))
+        sys.exit(1)
+    country_level, global_level = hierarchy.get_level(levels, 'country'), hierarchy.top_level(levels)
+    if country_level is None or global_level is None:
+        logger.error("Chunked mode needs a 'country' level and a global level (without keys) in the hierarchy")
+        sys.exit(1)
+    other_levels = [level.name for level in levels if level not in (country_level, global_level)]
+    if len(other_levels) > 0:
+        logger.warning("Chunked mode only prepares the country and global levels, not {}".format(", ".join(other_levels)))
+    chunk_config = prep_config.get('chunked', {})
+    buffer_size = chunk_config.get('json_buffer_size', 2 ** 20)
+    raw_format = prep_config.get('raw_format', 'json')
+    # a group of records is flushed once fully read, so each archive partition (one date) is written as soon as it is read
+    if raw_format == 'ndjson_gz' and s3_flag == True:
+        record_groups = raw_archive.iter_archive_s3(**prep_config['get_s3_archive_data'])
+    elif raw_format == 'ndjson_gz':
+        record_groups = raw_archive.iter_archive_local(**prep_config['get_local_archive_data'])
+    elif s3_flag == True:
+        s3_obj = get_s3_object(**prep_config['get_s3_data'])
+        record_groups = [chunked_preparation.iter_json_records(codecs.getreader('utf-8')(s3_obj['Body']), buffer_size)]
+    else:
+        record_groups = [chunked_preparation.iter_json_file(prep_config['get_local_data']['input_file_path'],
+                                                            buffer_size)]
+
+    written = {'country': 0, 'global': 0}
+
+    def write(country_df, global_df):
+        # the first flush replaces the tables and files of the previous run, later flushes append to them
+        first = written['country'] == 0
+        helper.add_to_database(country_df,country_level.table,'replace' if first else 'append',engine_string)
+        helper.add_to_database(global_df,global_level.table,'replace' if first else 'append',engine_string)
+        country_df.index += written['country']
+        global_df.index += written['global']
+        country_df.to_csv(country_level.data_out, mode='w' if first else 'a', header=first)
+        global_df.to_csv(global_level.data_out, mode='w' if first else 'a', header=first)
+        written['country'] += len(country_df)
+        written['global'] += len(global_df)
+
+    try:
+        nbr_records = chunked_preparation.prepare_in_chunks(record_groups, write, chunk_config.get('batch_size', 20000))
+    except FileNotFoundError:
+        logger.error("The file path you've specified does not exist. Verify the path is correct in the config.yml")
+        sys.exit(1)
+    except (ValueError, KeyError) as e:
+        logger.error("The raw data does not seem to be of appropriate json form: {}:{}".format(type(e).__name__, e))
+        sys.exit(1)
+    if nbr_records == 0:
+        logger.error("The raw data contains no records, the daily tables were not written")
+        sys.exit(1)
+    instrumentation.add_rows(nbr_records)
+    logger.info("Wrote {} country and {} global daily rows".format(written['country'], written['global']))
+    return nbr_records
+
+@instrumentation.timed('run_data_preparation')
 def run_data_preparation(args):
     """
     Wrapper function that prepares the raw data for upload to databases and for next steps of plotting and modeling
@@ -174,6 +327,8 @@ def run_data_preparation(args):
            - config (str): Path to yaml file with load_data as a top level key containing relevant configurations
            - engine_string (str): sqlalchemy engine string argument can be entered
            - s3_flag (bool): the flag used to determine if the scripts will read/write via s3 or local
+           - chunked (bool): stream the raw data in batches rather than loading it all at once (for large raw dumps)
+           - memory_report (bool): only report the memory used by the local raw data with and without compact types
 
     Returns:
         None -- this a wrapper function for the data preparation steps
@@ -185,16 +340,43 @@ def run_data_preparation(args):
         logger.error("Could not read in the config file--verify correct filename/path.")
         sys.exit(1)
 
-    if args.s3_flag == True:
+    # raw pulls are read from the compressed, date partitioned archive (ndjson_gz) or the single json file (json)
+    raw_format = config['data_preparation'].get('raw_format', 'json')
+    if args.memory_report:
+        if raw_format == 'ndjson_gz':
+            covid_data = raw_archive.read_archive_local(**config['data_preparation']['get_local_archive_data'])
+        else:
+            with open(config['data_preparation']['get_local_data']['input_file_path']) as f:
+                covid_data = json.load(f)
+        report_memory_usage(covid_data)
+        return
+    if args.chunked:
+        prepare_in_chunks(config, args.engine_string, args.s3_flag)
+        query_cache.bump_data_version(args.engine_string)
+        logger.info("data_preparation.py was run successfully.")
+        return
+    if raw_format == 'ndjson_gz' and args.s3_flag == True:
+        df = get_s3_archive_data(**config['data_preparation']['get_s3_archive_data'])
+    elif raw_format == 'ndjson_gz':
+        df = get_local_archive_data(**config['data_preparation']['get_local_archive_data'])
+    elif args.s3_flag == True:
         df = get_s3_data(**config['data_preparation']['get_s3_data'])
     else:
         df = get_local_data(**config['data_preparation']['get_local_data'])
-    country_df = get_country_daily(df)
-    global_df = get_global_daily(df)
-    helper.add_to_database(country_df,"country_covid_daily_cases",'replace',args.engine_string)
-    helper.add_to_database(global_df, "global_covid_daily_cases",'replace', args.engine_string)
-    country_df.to_csv(config['data_preparation']['country_data_out'])
-    global_df.to_csv(config['data_preparation']['global_data_out'])
+    instrumentation.add_rows(len(df))
+    # daily cases of every level of the hierarchy (country, global, province, ...), see hierarchy.py
+    try:
+        levels = hierarchy.get_levels(config)
+        daily = hierarchy.prepare_levels(df, levels)
+    except ValueError as e:
+        logger.error("Could not prepare the hierarchy levels of the config.yml: {}".format(e))
+        sys.exit(1)
+    for level in levels:
+        helper.add_to_database(daily[level.name],level.table,'replace',args.engine_string)
+        if level.data_out is not None:
+            daily[level.name].to_csv(level.data_out)
+    # cached query results for the old data are no longer valid
+    query_cache.bump_data_version(args.engine_string)
 
     logger.info("data_preparation.py was run successfully.")
 
@@ -203,6 +385,10 @@ if __name__ == '__main__':
     parser.add_argument('--config', '-c', default='config.yml', help='path to yaml file with configurations')
     parser.add_argument("--engine_string", default=None, help="Optional engine string for db to add data to ")
     parser.add_argument("--s3", dest='s3_flag', action='store_true', help="Use arg if you want to save s3 rather than locally.")
+    parser.add_argument("--chunked", action='store_true',
+                        help="Use arg to stream the raw data in batches, for raw dumps too large to load into memory")
+    parser.add_argument("--memory_report", action='store_true',
+                        help="Use arg to only log the memory used by the local raw data with and without compact types")
     args = parser.parse_args()
     run_data_preparation(args)
 
@@ -0,0 +1,167 @@
+import logging.config
+import numpy as np
+import pandas as pd
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Forecast accuracy metrics computed for many series (countries, folds) at once. Actuals, forecasts and training series
+are stacked into 2-D arrays with one row per series, padded with NaN where the series are of different lengths, and
+every metric is a handful of array operations over the whole stack:
+
+    mape   mean(|y - f| / |y|) * 100          actuals of 0 are left out (no division by zero infinities)
+    smape  mean(2 |y - f| / (|y| + |f|)) * 100  0 where both are 0
+    mase   mean(|y - f|) / mean(|y_t - y_t-m|)  scaled by the in-sample naive (lag m) forecast error
+    rmse   sqrt(mean((y - f)^2))
+
+A row with no usable values gets NaN for that metric rather than an error or a warning.
+"""
+
+METRICS = ['mape', 'smape', 'mase', 'rmse']
+
+
+def stack(arrays, align='left'):
+    """
+    Stacks 1-D arrays of different lengths into a 2-D float array padded with NaN
+    Args:
+        arrays (list): array-likes (lists, numpy arrays, pandas Series), one per row
+        align (str): 'left' pads the end of shorter rows (forecast windows), 'right' pads the start so the last values
+            line up (training series)
+
+    Returns:
+        stacked (numpy array): len(arrays) x longest length
+    """
+    arrays = [np.asarray(a, dtype=float).ravel() for a in arrays]
+    width = max([len(a) for a in arrays] + [0])
+    stacked = np.full((len(arrays), width), np.nan)
+    for row, a in enumerate(arrays):
+        if len(a) == 0:
+            continue
+        if align == 'right':
+            stacked[row, width - len(a):] = a
+        else:
+            stacked[row, :len(a)] = a
+    return stacked
+
+
+def row_nanmean(values):
+    """Mean of each row ignoring NaN, NaN for rows without any value (and no 'mean of empty slice' warning)"""
+    values = np.atleast_2d(values)
+    counts = np.sum(~np.isnan(values), axis=1)
+    sums = np.nansum(values, axis=1)
+    return np.divide(sums, counts, out=np.full(len(values), np.nan), where=counts > 0)
+
+
+def _errors(y_true, y_pred):
+    y_true = np.atleast_2d(np.asarray(y_true, dtype=float))
+    y_pred = np.atleast_2d(np.asarray(y_pred, dtype=float))
+    if y_true.shape != y_pred.shape:
+        raise ValueError("Actuals {} and forecasts {} must have the same shape".format(y_true.shape, y_pred.shape))
+    return y_true, y_pred, y_pred - y_true
+
+
+def mape(y_true, y_pred):
+    """Mean absolute percentage error of each row, leaving out actuals of 0"""
+    y_true, y_pred, errors = _errors(y_true, y_pred)
+    denominator = np.abs(y_true)
+    ape = np.divide(np.abs(errors), denominator, out=np.full(errors.shape, np.nan), where=denominator > 0)
+    return row_nanmean(ape) * 100
+
+
+def smape(y_true, y_pred):
+    """Symmetric mean absolute percentage error of each row (0 to 200)"""
+    y_true, y_pred, errors = _errors(y_true, y_pred)
+    denominator = np.abs(y_true) + np.abs(y_pred)
+    # a forecast of 0 for an actual of 0 is exact; NaN errors (padding) stay NaN
+    sape = np.where(denominator > 0, 2 * np.abs(errors) / np.where(denominator > 0, denominator, 1), 0.)
+    sape[np.isnan(errors)] = np.nan
+    return row_nanmean(sape) * 100
+
+
+def mase(y_true, y_pred, y_train, season=1):
+    """
+    Mean absolute scaled error of each row
+    Args:
+        y_true (array-like): actuals, n x h
+        y_pred (array-like): forecasts, n x h
+        y_train (array-like): training series, n x t (e.g. stack(..., align='right'))
+        season (int): lag of the naive forecast used for the scale
+
+    Returns:
+        mase (numpy array): length n, NaN where the training series is too short or constant
+    """
+    y_true, y_pred, errors = _errors(y_true, y_pred)
+    y_train = np.atleast_2d(np.asarray(y_train, dtype=float))
+    if len(y_train) != len(y_true):
+        raise ValueError("Expected a training series for each of the {} rows".format(len(y_true)))
+    if y_train.shape[1] <= season:
+        return np.full(len(y_true), np.nan)
+    scale = row_nanmean(np.abs(y_train[:, season:] - y_train[:, :-season]))
+    mae = row_nanmean(np.abs(errors))
+    return np.divide(mae, scale, out=np.full(len(mae), np.nan), where=scale > 0)
+
+
+def rmse(y_true, y_pred):
+    """Root mean squared error of each row"""
+    y_true, y_pred, errors = _errors(y_true, y_pred)
+    return np.sqrt(row_nanmean(errors ** 2))
+
+
+def evaluate(y_true, y_pred, y_train=None, season=1):
+    """
+    Every metric for every row
+    Args:
+        y_true (array-like): actuals, n x h
+        y_pred (array-like): forecasts, n x h
+        y_train (array-like): optional training series, n x t, needed for mase (NaN without it)
+        season (int): lag of the naive forecast used to scale mase
+
+    Returns:
+        metrics (dict): metric name (METRICS) -> numpy array of length n
+    """
+    y_true, y_pred, errors = _errors(y_true, y_pred)
+    return {'mape': mape(y_true, y_pred), 'smape': smape(y_true, y_pred),
+            'mase': mase(y_true, y_pred, y_train, season) if y_train is not None else np.full(len(y_true), np.nan),
+            'rmse': rmse(y_true, y_pred)}
+
+
+def evaluation_frame(series, y_true, y_pred, y_train=None, season=1, **columns):
+    """
+    Metrics of stacked forecasts as a DataFrame, one row per series (the form of the model_evaluation table)
+    Args:
+        series (list): name of each row, e.g. the country
+        y_true (array-like): actuals, n x h
+        y_pred (array-like): forecasts, n x h
+        y_train (array-like): optional training series, n x t
+        season (int): lag of the naive forecast used to scale mase
+        **columns: constant or per-row columns added to the frame, e.g. model='country' or fold=[0, 1, 2]
+
+    Returns:
+        evaluation_df (pandas DataFrame): the extra columns, series and each metric
+    """
+    evaluation_df = pd.DataFrame(columns, index=range(len(series)))
+    evaluation_df['series'] = list(series)
+    for name, values in evaluate(y_true, y_pred, y_train, season).items():
+        evaluation_df[name] = values
+    return evaluation_df
+
+
+def finite_mean(values):
+    """Mean of the finite values (NaN and inf left out), None when there are none"""
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    return float(values.mean()) if len(values) > 0 else None
+
+
+def summarize(evaluation_df):
+    """
+    Average of each metric over the rows that have one
+    Args:
+        evaluation_df (pandas DataFrame): output of evaluation_frame
+
+    Returns:
+        summary (dict): metric name -> mean (None when no row has a value)
+    """
+    return {name: finite_mean(evaluation_df[name]) for name in METRICS}
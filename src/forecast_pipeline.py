@@ -0,0 +1,216 @@
+import logging.config
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Producer/consumer pipeline used by generate_forecasts.py for the country forecasts, so that s3, CPU and database latency
+overlap instead of adding up country after country:
+
+    fetch (thread pool)  ->  forecast (process pool)  ->  bounded queue  ->  writer thread (batched inserts)
+
+At most max_in_flight items are being fetched or forecast at once, and the writer queue holds at most write_queue_size
+forecasts, so a slow database blocks the producer instead of letting results pile up in memory (backpressure). Every
+stage counts its items, failures and busy time for the throughput report.
+"""
+
+# put on the writer queue by close() to tell the writer thread to flush and stop
+_STOP = object()
+
+
+def timed_call(func, *args):
+    """
+    Calls func(*args) and times it. Runs in the pool workers, so func must be picklable for the process pool
+    Returns:
+        result: return value of func
+        seconds (float): wall seconds of the call
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class PipelineCounters:
+    """Thread safe per-stage counters (items, failures, busy seconds and any stage specific counter)"""
+
+    def __init__(self, stages):
+        self.lock = threading.Lock()
+        self.counters = {name: {'items': 0, 'failed': 0, 'busy_seconds': 0.} for name in stages}
+
+    def add(self, stage, **increments):
+        with self.lock:
+            for name, n in increments.items():
+                self.counters[stage][name] = self.counters[stage].get(name, 0) + n
+
+    def maximum(self, stage, name, value):
+        with self.lock:
+            self.counters[stage][name] = max(self.counters[stage].get(name, 0), value)
+
+    def snapshot(self, wall_seconds=None):
+        """
+        Copy of the counters
+        Args:
+            wall_seconds (float): optional wall time of the run, adds items_per_second to every stage
+
+        Returns:
+            counters (dict): stage -> counter name -> value
+        """
+        with self.lock:
+            counters = {stage: dict(values) for stage, values in self.counters.items()}
+        if wall_seconds:
+            for values in counters.values():
+                values['items_per_second'] = round(values['items'] / wall_seconds, 2)
+        return counters
+
+
+class BatchWriter:
+    """
+    Single writer thread draining a bounded queue of DataFrames into batched writes of at least batch_rows rows (the
+    last batch may be smaller). put() blocks while the queue is full. A failed write is recorded and the rest of the
+    queue is drained without writing, so the producer never blocks on a dead writer.
+
+        writer = BatchWriter(lambda df: helper.add_to_database(df, table, 'append', engine_string), counters)
+        writer.put(forecast_df)
+        writer.close()
+    """
+
+    def __init__(self, write, counters, max_queue_size=8, batch_rows=500):
+        self.write = write
+        self.counters = counters
+        self.batch_rows = batch_rows
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.error = None
+        self.counters.add('write', rows=0, batches=0, blocked_seconds=0., max_queue_depth=0)
+        self.thread = threading.Thread(target=self._run, name="forecast-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, df):
+        """Queues a DataFrame for writing, blocking while the queue is full"""
+        start = time.perf_counter()
+        self.queue.put(df)
+        self.counters.add('write', blocked_seconds=time.perf_counter() - start)
+        self.counters.maximum('write', 'max_queue_depth', self.queue.qsize())
+
+    def _flush(self, pending):
+        if len(pending) == 0:
+            return
+        if self.error is not None:
+            self.counters.add('write', failed=len(pending))
+            return
+        df = pd.concat(pending, ignore_index=True)
+        start = time.perf_counter()
+        try:
+            self.write(df)
+        except BaseException as e:
+            # helper.add_to_database reports database errors with sys.exit, which would only end this thread
+            self.error = e
+            self.counters.add('write', failed=len(pending))
+            logger.error("Writing a batch of {} forecast rows failed: {}:{}".format(len(df), type(e).__name__, e))
+            return
+        self.counters.add('write', items=len(pending), rows=len(df), batches=1,
+                          busy_seconds=time.perf_counter() - start)
+
+    def _run(self):
+        pending, pending_rows = [], 0
+        while True:
+            df = self.queue.get()
+            if df is _STOP:
+                break
+            pending.append(df)
+            pending_rows += len(df)
+            if pending_rows >= self.batch_rows:
+                self._flush(pending)
+                pending, pending_rows = [], 0
+        self._flush(pending)
+
+    def close(self):
+        """
+        Flushes the queued DataFrames and stops the writer thread
+        Returns:
+            error (BaseException): the exception of a failed write, None if every write succeeded
+        """
+        self.queue.put(_STOP)
+        self.thread.join()
+        return self.error
+
+
+def run_pipeline(items, fetch, forecast, write, fetch_workers=8, forecast_workers=None, max_in_flight=32,
+                 write_queue_size=8, write_batch_rows=500):
+    """
+    Fetches, forecasts and writes every item through the pipeline
+    Args:
+        items (iterable): items to process, e.g. country names
+        fetch (function): fetch(item) -> local path of the item's artifact, run on a thread pool
+        forecast (function): forecast(item, path) -> DataFrame, run on a process pool (so it must be picklable, e.g. a
+            module level function or a functools.partial of one)
+        write (function): write(df) for a batch of concatenated forecasts, run on the writer thread
+        fetch_workers (int): number of fetch threads
+        forecast_workers (int): number of forecast processes, defaults to the number of cpus
+        max_in_flight (int): most items being fetched or forecast at once
+        write_queue_size (int): most forecasts waiting for the writer
+        write_batch_rows (int): rows per batched write
+
+    Returns:
+        counters (dict): stage -> counters (items, failed, busy_seconds, items_per_second, ...) plus wall_seconds
+        failed (list): items that could not be fetched or forecast (failed writes are counted in counters['write'])
+    """
+    counters = PipelineCounters(['fetch', 'forecast', 'write'])
+    failed = []
+    items = iter(items)
+    exhausted = False
+    in_flight = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=forecast_workers) as forecast_pool:
+        # the first task starts the worker processes; do it before the writer and fetch threads exist so no process
+        # is forked while another thread holds a lock (e.g. a logging handler's)
+        forecast_pool.submit(int).result()
+        writer = BatchWriter(write, counters, write_queue_size, write_batch_rows)
+        fetch_pool = ThreadPoolExecutor(max_workers=fetch_workers)
+        while True:
+            while not exhausted and len(in_flight) < max_in_flight:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight[fetch_pool.submit(timed_call, fetch, item)] = ('fetch', item)
+            if len(in_flight) == 0:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, item = in_flight.pop(future)
+                try:
+                    result, seconds = future.result()
+                except Exception as e:
+                    logger.error("{} of {} failed: {}:{}".format(stage.capitalize(), item, type(e).__name__, e))
+                    counters.add(stage, failed=1)
+                    failed.append(item)
+                    continue
+                counters.add(stage, items=1, busy_seconds=seconds)
+                if stage == 'fetch':
+                    in_flight[forecast_pool.submit(timed_call, forecast, item, result)] = ('forecast', item)
+                else:
+                    # blocks while the writer is behind, which holds back new fetches as well
+                    writer.put(result)
+        fetch_pool.shutdown()
+        writer.close()
+    wall_seconds = time.perf_counter() - start
+    counters = counters.snapshot(wall_seconds)
+    counters['wall_seconds'] = round(wall_seconds, 3)
+    return counters, failed
+
+
+def log_counters(counters):
+    """Logs the throughput of every stage of a pipeline run"""
+    for stage in ['fetch', 'forecast', 'write']:
+        values = counters[stage]
+        logger.info("Pipeline stage {:<8} {:>5} items {:>3} failed {:>8.2f} items/s {:>8.2f}s busy{}".format(
+            stage, values['items'], values['failed'], values['items_per_second'], values['busy_seconds'],
+            "" if stage != 'write' else ", {} rows in {} batches, {:.2f}s blocked on a full queue (max depth {})".format(
+                values['rows'], values['batches'], values['blocked_seconds'], values['max_queue_depth'])))
@@ -1,14 +1,17 @@
 import sys
-import helper
 import botocore.exceptions as botoexceptions
 import boto3
 import logging.config
 import yaml
 import argparse
 import plotly
+import plotly.io
 import plotly.graph_objects as go
 from datetime import datetime
 import os
+import instrumentation
+import static_assets
+import query_cache
 
 #set-up logging
 logging.config.fileConfig(fname="local.conf")
@@ -25,7 +28,7 @@ def get_global_forecasted_data(engine_string):
     """
 
     query =  """SELECT * FROM global_covid_forecast"""
-    forecast_df = helper.get_data_from_database(query,engine_string)
+    forecast_df = query_cache.cached_query(query,engine_string)
     logger.info("Retrieved global forecast data")
     return forecast_df
 
@@ -40,8 +43,8 @@ def get_country_forecasted_data(country,engine_string):
         forecast_df (pandas DataFrame): DataFrame consisting of forecasted confirmed case numbers for covid-19 for given country
     """
 
-    query =  """SELECT * FROM  country_covid_forecast WHERE country = '{}'""".format(country)
-    forecast_df = helper.get_data_from_database(query,engine_string)
+    query =  """SELECT * FROM  country_covid_forecast WHERE country = :country"""
+    forecast_df = query_cache.cached_query(query,engine_string,{'country': country})
     if len(forecast_df) == 0:
         logger.warning("Forecast not available for {}. No data retrieved".format(country))
     else:
@@ -58,7 +61,7 @@ def get_recent_global_confirmed_data(engine_string):
         global_df_plot (pandas DataFrame): DataFrame of covid-19 case numbers globally over the last two weeks
     """
     query = """SELECT * FROM global_covid_daily_cases order by Date desc limit 14"""
-    global_df_plot = helper.get_data_from_database(query,engine_string)
+    global_df_plot = query_cache.cached_query(query,engine_string)
     global_df_plot = global_df_plot.sort_values(by='Date').reset_index(drop=True)
     logger.info("Retrieved recent global confirmed cases data")
     return global_df_plot
@@ -74,8 +77,8 @@ def get_recent_country_confirmed_data(country,engine_string):
         country_df_plot (pandas DataFrame): DataFrame of covid-19 case numbers over the last two weeks for input country
     """
 
-    query = """SELECT * FROM country_covid_daily_cases WHERE country = '{}'""".format(country)
-    country_df = helper.get_data_from_database(query,engine_string)
+    query = """SELECT * FROM country_covid_daily_cases WHERE country = :country"""
+    country_df = query_cache.cached_query(query,engine_string,{'country': country})
     country_df_plot = country_df.groupby('Date').sum()[["Confirmed", "Recovered", "Active", "Deaths"]].reset_index()
     country_df_plot = country_df_plot.tail(14).sort_values(by='Date', ).reset_index(drop=True)
     logger.info("Retrieved recent confirmed cases data for {}".format(country))
@@ -110,6 +113,22 @@ def generate_forecast_plot(forecast_df,cases_df_plot):
     return fig
 
 
+def get_html(fig,div_id):
+    """
+    Converts plotly figure into html that loads the plotly js plugin from its cdn, with a fixed div id so the html is the
+    same every time the same figure is converted
+    Args:
+        fig: Plotly figure of interest
+        div_id (str): id for the plot's div
+
+    Returns:
+        htmlout (str): html of the plot
+    """
+    convToHtml = plotly.io.to_html(fig, include_plotlyjs=False, full_html=False, div_id=div_id)
+    # add plotly js plugin to output
+    return '<script src="https://cdn.plot.ly/plotly-latest.min.js"></script>' + "\n" + convToHtml
+
+
 def get_html_and_save(fig,s3_flag,filename,local_path,s3_bucket_name=None,s3_output_path=None):
     """
     Converts plotly figure into html and saves it out to file
@@ -140,6 +159,7 @@ def get_html_and_save(fig,s3_flag,filename,local_path,s3_bucket_name=None,s3_out
             f.write(htmlout)
             f.close()
         logger.info("Html file saved to local. File is located at {}".format(local_file))
+        static_assets.publish_assets(local_path, {"{}.html".format(filename): htmlout})
 
 
 def save_html_to_s3(s3_bucket_name,s3_output_path,file_content,filename):
@@ -175,6 +195,7 @@ def save_html_to_s3(s3_bucket_name,s3_output_path,file_content,filename):
 
     logger.info("Html file was successfully saved to s3 bucket. File is located at {}".format(s3_filename))
 
+@instrumentation.timed('run_generate_forecast_plots')
 def run_generate_forecast_plots(args):
     """
     Wrapper function for generating forecast plots
@@ -198,6 +219,7 @@ def run_generate_forecast_plots(args):
 
     global_forecast_df = get_global_forecasted_data(args.engine_string)
     global_plot_df = get_recent_global_confirmed_data(args.engine_string)
+    instrumentation.add_rows(len(global_forecast_df) + len(global_plot_df))
     fig = generate_forecast_plot(global_forecast_df,global_plot_df)
     get_html_and_save(fig,args.s3_flag,'global_cases_forecast',**config['generate_forecast_plots'])
 
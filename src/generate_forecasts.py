@@ -4,48 +4,51 @@ import yaml
 import helper
 from statsmodels.tsa.arima_model import ARIMAResults
 import logging.config
-import boto3
 import sys
-import botocore.exceptions as botoexceptions
 import datetime
-import os
+import functools
 import numpy as np
 import pickle
+import arima_serializer
+import instrumentation
+import query_cache
+import model_registry
+import forecast_pipeline
+import hierarchy
+import reconciliation
 
 #set-up logging
 logging.config.fileConfig(fname="local.conf")
 logger = logging.getLogger(__name__)
 
 
-def get_model(s3_flag,local_model_path,input_filename,s3_bucket_name=None,bucket_dir_path=None):
+def load_model(model_path):
     """
-    Retrieve ARIMA trained model object from s3 or local location
+    Load a trained model file: compact ARIMA models (see arima_serializer.py), or pickled models of older registry
+    versions and baseline models
     Args:
-        s3_flag (bool): Flag used to determine if the scripts will save to s3 or local
-        local_model_path (str): path to directory in local machine where trained model object is located
-        input_filename (str): name of the model object file
-        s3_bucket_name (str): the name of S3 bucket where models are saved (only needed if s3_flag is True)
-        bucket_dir_path (str): s3 bucket file path (without filename) where the objects are located (only needed if s3_flag is True)
+        model_path (str): path of the model file
 
     Returns:
-        model: ARIMA trained model object
+        model: trained model object with a forecast method like ARIMAResults.forecast
     """
+    if arima_serializer.is_compact_file(model_path):
+        return arima_serializer.load(model_path)
+    return ARIMAResults.load(model_path)
 
-    if s3_flag == True:
-        try:
-            s3 = boto3.client("s3")
-        except botoexceptions.NoCredentialsError:
-            logger.error(
-                "Your AWS credentials were not found. Verify that they have been made available as detailed in readme instructions")
-            sys.exit(1)
-
-        s3_file_path = os.path.join(bucket_dir_path, input_filename)
-        s3.download_file(s3_bucket_name, s3_file_path, 'model_file')
-        model = ARIMAResults.load('model_file')
-        logger.debug("Model loaded from s3")
-    else:
-        model = ARIMAResults.load(os.path.join(local_model_path,input_filename))
+def get_model(registry,input_filename,version='latest'):
+    """
+    Retrieve ARIMA trained model object from the model registry (local or s3)
+    Args:
+        registry (model_registry.ModelRegistry): registry the model was published to
+        input_filename (str): name of the model artifact
+        version (str): 'latest' or a pinned registry version
 
+    Returns:
+        model: ARIMA trained model object
+    """
+    model = load_model(registry.fetch(input_filename,version))
+    logger.debug("Model {} loaded from the registry at {}".format(input_filename, registry.location()))
     return model
 
 def get_global_forecast(model,n_days):
@@ -69,68 +72,49 @@ def get_global_forecast(model,n_days):
     logger.info("Global forecasts made for {} days.".format(str(n_days)))
     return global_forecast_df
 
-def get_country_list(s3_flag,local_model_path,input_filename,s3_bucket_name=None,bucket_dir_path=None):
+def get_country_list(registry,input_filename,version='latest'):
     """
     Retrieves list of countries for which a trained model exists
     Args:
-        s3_flag (bool): Flag used to determine if the scripts will save to s3 or local
-        local_model_path (str): path to directory in local machine where the object is located
-        input_filename (str): name of the object file
-        s3_bucket_name (str): the name of S3 bucket where the object is saved (only needed if s3_flag is True)
-        bucket_dir_path (str): s3 bucket file path (without filename) where the object is located (only needed if s3_flag is True)
+        registry (model_registry.ModelRegistry): registry the country models were published to
+        input_filename (str): name of the country list artifact
+        version (str): 'latest' or a pinned registry version
 
     Returns:
         countries (list): list of countries for which a trained model exists
     """
-    # If retrieving from s3
-    if s3_flag == True:
-        try:
-            s3 = boto3.client("s3")
-        except botoexceptions.NoCredentialsError:
-            logger.error(
-                "Your AWS credentials were not found. Verify that they have been made available as detailed in readme instructions")
-            sys.exit(1)
-
-        s3_file_path = os.path.join(bucket_dir_path,input_filename)
-        s3.download_file(s3_bucket_name, s3_file_path, 'countries.pkl')
-        with open("countries.pkl", 'rb') as f:
-            countries = pickle.load(f)
-
-    # else retrieving locally
-    else:
-        with open(os.path.join(local_model_path,input_filename), 'rb') as f:
-            countries = pickle.load(f)
+    with open(registry.fetch(input_filename,version), 'rb') as f:
+        countries = pickle.load(f)
     return countries
 
 
-def get_country_forecast(s3_flag,country,local_model_path,n_days,s3_bucket_name=None,bucket_dir_path=None):
+def get_country_forecast(registry,country,n_days,version='latest'):
     """
     Make forecasts for the number of confirmed covid19 cases for a given country
     Args:
-        s3_flag (bool): Flag used to determine if the scripts will save to s3 or local
+        registry (model_registry.ModelRegistry): registry the country models were published to
         country (str): Country to make the forecast for
-        local_model_path (str): path to directory in local machine where trained model object is located
         n_days: number of days to forecast
-        s3_bucket_name (str): the name of S3 bucket where models are saved (only needed if s3_flag is True)
-        bucket_dir_path (str): s3 bucket file path (without filename) where the objects are located (only needed if s3_flag is True)\
-
+        version (str): 'latest' or a pinned registry version
 
     Returns:
         country_forecast_df (pandas DataFrame): DataFrame consisting of Date and Forecasted Value pairs
     """
-    # If retrieving from s3
-    if s3_flag == True:
-        datestr_use = bucket_dir_path[-10:]
-        input_filename = "ARIMA_{}_{}".format(country, datestr_use)
-        model = get_model(s3_flag,local_model_path,input_filename,s3_bucket_name,bucket_dir_path)
-        logger.debug("Model retrieved for {} from s3".format(country))
+    model = get_model(registry,"ARIMA_{}".format(country),version)
+    logger.debug("Model retrieved for {}".format(country))
+    return forecast_country_model(model,country,n_days)
 
-    # else retrieving local
-    else:
-        input_filename = "ARIMA_{}".format(country)
-        model = get_model(s3_flag, local_model_path,input_filename,s3_bucket_name, bucket_dir_path)
-        logger.debug("Model retrieved for {} from local".format(country))
+def forecast_country_model(model,country,n_days):
+    """
+    Make forecasts for the number of confirmed covid19 cases for a given country from its loaded model
+    Args:
+        model: ARIMA trained model object (or a baseline model) of the country
+        country (str): Country to make the forecast for
+        n_days: number of days to forecast
 
+    Returns:
+        country_forecast_df (pandas DataFrame): DataFrame consisting of Date and Forecasted Value pairs
+    """
     # Make forecast
     country_forecast = np.round(model.forecast(n_days)[0])
     # create dates from today to the next n_days
@@ -143,6 +127,70 @@ def get_country_forecast(s3_flag,country,local_model_path,n_days,s3_bucket_name=
 
     return country_forecast_df
 
+def forecast_country_file(country,model_path,n_days):
+    """
+    Loads a country model from a local file and forecasts with it. Runs in the worker processes of the forecast pipeline
+    Args:
+        country (str): Country to make the forecast for
+        model_path (str): local path of the country's model artifact
+        n_days: number of days to forecast
+
+    Returns:
+        country_forecast_df (pandas DataFrame): DataFrame consisting of Date and Forecasted Value pairs
+    """
+    # timed per country, like the rest of the pipeline's stages (see instrumentation.py)
+    with instrumentation.stage('generate_country_forecast', country=country) as stage_metrics:
+        country_forecast_df = forecast_country_model(load_model(model_path),country,n_days)
+        stage_metrics.add_rows(len(country_forecast_df))
+    return country_forecast_df
+
+def generate_country_forecasts(registry,country_list,n_days,engine_string=None,version='latest',write=None,
+                               **pipeline_config):
+    """
+    Forecasts every country and appends the forecasts to the database through the forecast pipeline (models fetched
+    on a thread pool, forecast on a process pool, written in batches by a single writer)
+    Args:
+        registry (model_registry.ModelRegistry): registry the country models were published to
+        country_list (list): countries to forecast
+        n_days: number of days to forecast
+        engine_string (str): sqlalchemy string for connection to desired database (optional input)
+        version (str): 'latest' or a pinned registry version
+        write (function): optional function the writer calls with each batch of forecasts instead of appending it to
+            the country_covid_forecast table
+        **pipeline_config: fetch_workers, forecast_workers, max_in_flight, write_queue_size and write_batch_rows of
+            forecast_pipeline.run_pipeline
+
+    Returns:
+        counters (dict): per stage counters of the pipeline run
+    """
+    counters, failed = forecast_pipeline.run_pipeline(
+        country_list,
+        fetch=lambda country: registry.fetch("ARIMA_{}".format(country),version),
+        forecast=functools.partial(forecast_country_file,n_days=n_days),
+        write=write or (lambda df: helper.add_to_database(df,"country_covid_forecast",'append',engine_string)),
+        **pipeline_config)
+    forecast_pipeline.log_counters(counters)
+    instrumentation.add_rows(counters['write']['rows'])
+    if len(failed) > 0 or counters['write']['failed'] > 0:
+        logger.error("Forecasts could not be made for {} countries ({}) and {} forecasts could not be written to the "
+                     "database".format(len(failed), ", ".join(sorted(failed)), counters['write']['failed']))
+        sys.exit(1)
+    return counters
+
+def write_level_forecasts(level,engine_string,df):
+    """
+    Appends forecasts of a level of the hierarchy to its forecast table, the series name split into the level's keys
+    Args:
+        level (hierarchy.Level): level the forecasts are of
+        engine_string (str): sqlalchemy string for the connection.
+        df (pandas DataFrame): country (series name), Date and confirmed_cases_forecast
+
+    Returns:
+        None -- adds to the database
+    """
+    helper.add_to_database(level.forecast_frame(df),level.forecast_table,'append',engine_string)
+
+@instrumentation.timed('run_generate_forecasts')
 def run_generate_forecasts(args):
     """
     Wrapper function to run steps for making covid19 confirmed cases forecasts
@@ -163,18 +211,86 @@ def run_generate_forecasts(args):
         logger.error("Could not read in the config file--verify correct filename/path.")
         sys.exit(1)
 
-    model = get_model(args.s3_flag,**config['generate_forecasts']['get_model'])
-    logger.info("Global model loaded")
-    global_forecast_df = get_global_forecast(model,**config['generate_forecasts']['get_global_forecast'])
-    helper.add_to_database(global_forecast_df, "global_covid_forecast",'replace', args.engine_string)
+    method = config['reconciliation']['method']
+    if method not in reconciliation.METHODS:
+        logger.error("Unknown reconciliation method '{}' in the config.yml, expected one of {}".format(
+            method, reconciliation.METHODS))
+        sys.exit(1)
+
+    try:
+        levels = hierarchy.get_levels(config)
+    except ValueError as e:
+        logger.error("Invalid hierarchy in the config.yml: {}".format(e))
+        sys.exit(1)
+    # the global forecast is reconciled with the forecasts of the level it is the sum of (the countries)
+    global_level = hierarchy.top_level(levels)
+    country_level = hierarchy.get_level(levels, global_level.sum_of) if global_level is not None else None
+    if country_level is None:
+        logger.error("The hierarchy in the config.yml needs a global level that is the sum of another level")
+        sys.exit(1)
+
+    # 'latest' or pinned versions are resolved with one read of each registry's index, then every artifact is taken
+    # from that version (from the local artifact cache when it is unchanged)
+    country_registry = model_registry.get_registry(config['model_registry'],country_level.name,args.s3_flag)
+    country_version, country_entry = country_registry.resolve(config['generate_forecasts'].get('country_model_version','latest'))
+    logger.info("Forecasting with country model version {} (average MAPE {})".format(
+        country_version, country_entry['metrics'].get('avg_mape')))
+
+    # the global model only provides the base global forecast that the country forecasts are reconciled with; bottom up
+    # reconciliation does without it
+    global_forecast_df, global_entry = None, {'metrics': {}}
+    if method != 'bottom_up':
+        global_registry = model_registry.get_registry(config['model_registry'],global_level.name,args.s3_flag)
+        global_version, global_entry = global_registry.resolve(config['generate_forecasts'].get('global_model_version','latest'))
+        logger.info("Reconciling with global model version {} (MAPE {})".format(
+            global_version, global_entry['metrics'].get('mape')))
+        model = get_model(global_registry,version=global_version,**config['generate_forecasts']['get_model'])
+        logger.info("Global model loaded")
+        global_forecast_df = get_global_forecast(model,**config['generate_forecasts']['get_global_forecast'])
+
+    country_list = get_country_list(country_registry,version=country_version,**config['generate_forecasts']['get_country_list'])
+    logger.info("Making forecasts for each country in the dataset.")
+
+    # bottom up leaves the country forecasts as they are, so they are written as they come out of the pipeline; any
+    # other method has to see every country forecast before they can be written
+    country_forecasts = []
+    def write(df):
+        if method == 'bottom_up':
+            helper.add_to_database(df,country_level.forecast_table,'append',args.engine_string)
+        country_forecasts.append(df)
+
+    with instrumentation.stage('generate_country_forecasts'):
+        generate_country_forecasts(country_registry,country_list,engine_string=args.engine_string,version=country_version,
+                                   write=write,**config['generate_forecasts']['get_country_forecast'],
+                                   **config['generate_forecasts']['pipeline'])
+
+    global_forecast_df, country_forecast_df = reconciliation.reconcile(
+        pd.concat(country_forecasts,ignore_index=True),method,global_forecast_df,
+        global_entry['metrics'].get('mse'),country_entry['metrics'].get('mse'))
+    if method != 'bottom_up':
+        helper.add_to_database(country_forecast_df,country_level.forecast_table,'append',args.engine_string)
+    helper.add_to_database(global_forecast_df,"global_covid_forecast",'replace',args.engine_string)
+    instrumentation.add_rows(len(global_forecast_df))
+    logger.debug("Model registry stats: country {}".format(country_registry.stats))
 
-    country_list = get_country_list(args.s3_flag,**config['generate_forecasts']['get_country_list'])
-    logger.info("Making forecasts for each country in the dataset. This will take some time if you are using RDS.")
+    # the other levels (e.g. provinces) are forecast through the same pipeline, their series names split back into
+    # the level's key columns; they are not reconciled with the countries
+    for level in hierarchy.series_levels(levels):
+        if level is country_level:
+            continue
+        registry = model_registry.get_registry(config['model_registry'],level.name,args.s3_flag)
+        version, entry = registry.resolve(config['generate_forecasts'].get('{}_model_version'.format(level.name),'latest'))
+        logger.info("Forecasting the {} level with model version {} (average MAPE {})".format(
+            level.name, version, entry['metrics'].get('avg_mape')))
+        series_list = get_country_list(registry,version=version,**config['generate_forecasts']['get_country_list'])
+        with instrumentation.stage('generate_{}_forecasts'.format(level.name)):
+            generate_country_forecasts(registry,series_list,engine_string=args.engine_string,version=version,
+                                       write=functools.partial(write_level_forecasts,level,args.engine_string),
+                                       **config['generate_forecasts']['get_country_forecast'],
+                                       **config['generate_forecasts']['pipeline'])
 
-    for country in country_list:
-        country_forecast_df = get_country_forecast(args.s3_flag,country,**config['generate_forecasts']['get_country_forecast'])
-        helper.add_to_database(country_forecast_df, "country_covid_forecast",'append', args.engine_string)
-        logger.debug("Forecasts for {} added to database".format(country))
+    # cached query results for the old forecasts are no longer valid
+    query_cache.bump_data_version(args.engine_string)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Get covid data from s3 and prep for modeling')
@@ -6,12 +6,15 @@ import helper
 import logging.config
 import yaml
 import argparse
-import plotly.express as px
 import plotly
 import plotly.graph_objects as go
+import plotly.io
+import json
 from datetime import datetime
 import numpy as np
 import os
+import instrumentation
+import static_assets
 
 #set-up logging
 logging.config.fileConfig(fname="local.conf")
@@ -29,11 +32,12 @@ def generate_global_line_plot(engine_string):
     # query the necessary data from database
     query = """SELECT * FROM global_covid_daily_cases"""
     global_df = helper.get_data_from_database(query,engine_string)
+    instrumentation.add_rows(len(global_df))
 
     # group data by date
     global_df_date = global_df.groupby('Date')['Recovered', 'Deaths', 'Confirmed'].sum().reset_index()
 
-    # create figure using plotly express
+    # create figure using plotly graph objects
 
     fig = go.Figure()
     fig.add_trace(
@@ -44,50 +48,230 @@ def generate_global_line_plot(engine_string):
     fig.update_layout(xaxis_rangeslider_visible=True)
 
     # convert figure to html and save it out to s3 or local depending on the option specified
-    convToHtml = plotly.offline.plot(fig, include_plotlyjs=False, output_type='div')
+    # (a fixed div id keeps the html the same from run to run when the data has not changed)
+    convToHtml = plotly.io.to_html(fig, include_plotlyjs=False, full_html=False, div_id='global-cases')
     htmlout = '<script src="https://cdn.plot.ly/plotly-latest.min.js"></script>' + "\n" + convToHtml
 
     return htmlout
 
-def generate_world_time_lapse(engine_string):
+# frames older than this are kept on a fixed weekly (or older_frame_days) grid anchored here, so the set of older frames
+# stays the same from run to run and only grows
+FRAME_GRID_ANCHOR = datetime(2020, 1, 1)
+TIME_LAPSE_CACHE_VERSION = 1
+
+def get_country_frame_data(engine_string, since_date=None):
     """
-    Creates a 'plotly' figure that shows the number of confirmed cases across the globe (at the country level)
-     over time with an animation
+    Queries the confirmed cases by country and date used for the time-lapse frames. The grouping is done by the database
+    and only dates on or after since_date are returned so an incremental render only reads the new days.
     Args:
         engine_string (str): sqlalchemy string for the connection.
+        since_date (str): optional YYYY-MM-DD date, only rows from this date onwards are returned
 
     Returns:
-        None -- saves out plotly figure
+        frame_df (pandas DataFrame): Date, Country and Confirmed columns
     """
-    # query the necessary data from database
-    query = """SELECT * FROM country_covid_daily_cases"""
-    country_df = helper.get_data_from_database(query,engine_string)
-
-    # manipulate the data to the desired form
-    country_plot_df = country_df.groupby(['Date', 'Country'])['Confirmed', 'Deaths'].max().reset_index()
-    country_plot_df["Date"] = pd.to_datetime(country_plot_df["Date"]).dt.strftime('%m/%d/%Y')
-    # generate figure using plotly express
-    fig = px.scatter_geo(country_plot_df, locations="Country", locationmode='country names',
-                         color=np.power(country_plot_df["Confirmed"], 0.3) - 2,
-                         size=np.power(country_plot_df["Confirmed"] + 1, 0.25) - 1, hover_name="Country",
-                         hover_data=["Confirmed"],
-                         range_color=[0, max(np.power(country_plot_df["Confirmed"], 0.25))],
-                         projection="natural earth", animation_frame="Date",
-                         color_continuous_scale=px.colors.sequential.Plasma,
-                         title='COVID-19: Progression of spread'
-                         )
-    fig.update_coloraxes(colorscale="YlOrRd")
-    fig.update(layout_coloraxis_showscale=False)
+    query = """SELECT Date, Country, MAX(Confirmed) AS Confirmed FROM country_covid_daily_cases"""
+    if since_date is not None:
+        # since_date comes from the frame cache (always formatted by strftime), never from user input
+        query += """ WHERE Date >= '{}'""".format(since_date)
+    query += """ GROUP BY Date, Country"""
+    frame_df = helper.get_data_from_database(query, engine_string)
+    instrumentation.add_rows(len(frame_df))
+    frame_df["Date"] = pd.to_datetime(frame_df["Date"])
+    return frame_df
 
-    # convert figure to html and save it out to s3 or local depending on the option specified
-    convToHtml = plotly.offline.plot(fig, include_plotlyjs=False, output_type='div')
-    # starts the animation as paused
-    convToHtml = convToHtml.replace(", null", ', {"play-state":"paused"}')
+def keep_frame_date(frame_date, latest_date, full_resolution_days=None, older_frame_days=7):
+    """
+    Decides whether a date gets a frame in the time-lapse. Every day within full_resolution_days of the latest date is
+    kept; older history is thinned to one frame every older_frame_days days.
+    Args:
+        frame_date (datetime): date of the frame
+        latest_date (datetime): most recent date in the data
+        full_resolution_days (int): number of recent days shown at daily resolution, None keeps every day
+        older_frame_days (int): spacing in days between frames older than full_resolution_days
+
+    Returns:
+        keep (bool): True if the date gets a frame
+    """
+    if full_resolution_days is None or (latest_date - frame_date).days < full_resolution_days:
+        return True
+    return (frame_date - FRAME_GRID_ANCHOR).days % older_frame_days == 0
+
+def build_frame(frame_date, date_df):
+    """
+    Builds the serialized plotly animation frame for one date
+    Args:
+        frame_date (datetime): date of the frame
+        date_df (pandas DataFrame): Country and Confirmed rows for that date
+
+    Returns:
+        frame (str): json for the plotly frame
+    """
+    confirmed = date_df["Confirmed"].astype(float).values
+    frame = {'name': frame_date.strftime('%m/%d/%Y'),
+             'data': [{'type': 'scattergeo', 'locations': date_df["Country"].tolist(), 'locationmode': 'country names',
+                       'hovertext': date_df["Country"].tolist(), 'customdata': date_df["Confirmed"].astype(int).tolist(),
+                       'marker': {'color': (np.power(confirmed, 0.3) - 2).round(3).tolist(),
+                                  'size': (np.power(confirmed + 1, 0.25) - 1).round(3).tolist()}}]}
+    return json.dumps(frame)
+
+def read_frame_cache(frame_cache_path):
+    """
+    Reads the time-lapse frame cache
+    Args:
+        frame_cache_path (str): local path of the cache file
+
+    Returns:
+        cache (dict or None): the cache, None if there is no usable cache
+    """
+    try:
+        with open(frame_cache_path) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logger.warning("Time-lapse frame cache at {} could not be read, rebuilding it".format(frame_cache_path))
+        return None
+    if cache.get('version') != TIME_LAPSE_CACHE_VERSION:
+        return None
+    return cache
+
+def write_frame_cache(cache, frame_cache_path):
+    """
+    Writes the time-lapse frame cache
+    Args:
+        cache (dict): the cache
+        frame_cache_path (str): local path of the cache file
+
+    Returns:
+        None -- writes the cache file
+    """
+    try:
+        os.makedirs(os.path.dirname(frame_cache_path) or '.', exist_ok=True)
+        # write to a temporary file and rename so an interrupted run never leaves a truncated cache
+        with open(frame_cache_path + ".tmp", 'w') as f:
+            json.dump(cache, f)
+        os.replace(frame_cache_path + ".tmp", frame_cache_path)
+    except OSError as e:
+        # the cache only saves work for the next run, so failing to write it is not fatal
+        logger.warning("Unable to write the time-lapse frame cache to {}: {}".format(frame_cache_path, e))
+
+def update_frame_cache(cache, frame_df, full_resolution_days=None, older_frame_days=7):
+    """
+    Adds (or replaces) the frames for the dates in frame_df and thins out frames that have aged past the full
+    resolution window
+    Args:
+        cache (dict or None): existing cache, None to start a new one
+        frame_df (pandas DataFrame): Date, Country and Confirmed rows for the new dates
+        full_resolution_days (int): number of recent days shown at daily resolution, None keeps every day
+        older_frame_days (int): spacing in days between frames older than full_resolution_days
+
+    Returns:
+        cache (dict): the updated cache
+    """
+    if cache is None:
+        cache = {'version': TIME_LAPSE_CACHE_VERSION, 'frames': {}, 'latest_date': None, 'max_confirmed': 0}
+    if len(frame_df) == 0:
+        return cache
+
+    latest_date = max(frame_df["Date"].max(), pd.to_datetime(cache['latest_date'] or frame_df["Date"].max()))
+    for frame_date, date_df in frame_df.groupby("Date"):
+        if keep_frame_date(frame_date, latest_date, full_resolution_days, older_frame_days):
+            cache['frames'][frame_date.strftime('%Y-%m-%d')] = build_frame(frame_date, date_df)
+    for date_str in list(cache['frames']):
+        if not keep_frame_date(pd.to_datetime(date_str), latest_date, full_resolution_days, older_frame_days):
+            del cache['frames'][date_str]
+
+    cache['latest_date'] = latest_date.strftime('%Y-%m-%d')
+    cache['max_confirmed'] = max(cache['max_confirmed'], int(frame_df["Confirmed"].max()))
+    return cache
+
+def render_world_time_lapse(cache):
+    """
+    Renders the time-lapse html from the cached frames. Only the first frame is decoded; the rest are passed through to
+    the page as already serialized json.
+    Args:
+        cache (dict): frame cache from update_frame_cache
+
+    Returns:
+        htmlout (str): html for the time-lapse plot
+    """
+    dates = sorted(cache['frames'])
+    first_frame = json.loads(cache['frames'][dates[0]])
+    frame_names = [datetime.strptime(date_str, '%Y-%m-%d').strftime('%m/%d/%Y') for date_str in dates]
+
+    # same scaling as plotly express uses for the size argument, based on the largest size across all frames
+    max_size = np.power(cache['max_confirmed'] + 1, 0.25) - 1
+    trace = first_frame['data'][0]
+    trace['marker'].update({'coloraxis': 'coloraxis', 'sizemode': 'area', 'sizeref': 2. * max_size / (20 ** 2)})
+    trace['hovertemplate'] = '<b>%{hovertext}</b><br>Confirmed=%{customdata}<extra></extra>'
+
+    frame_args = {'frame': {'duration': 500, 'redraw': True}, 'mode': 'immediate', 'fromcurrent': True,
+                  'transition': {'duration': 500, 'easing': 'linear'}}
+    fig = go.Figure(data=[trace])
+    fig.update_layout(title='COVID-19: Progression of spread', geo={'projection': {'type': 'natural earth'}},
+                      coloraxis={'colorscale': 'YlOrRd', 'cmin': 0, 'cmax': np.power(cache['max_confirmed'], 0.25),
+                                 'showscale': False},
+                      updatemenus=[{'type': 'buttons', 'direction': 'left', 'showactive': False, 'x': 0.1, 'y': 0,
+                                    'xanchor': 'right', 'yanchor': 'top', 'pad': {'r': 10, 't': 70},
+                                    'buttons': [{'label': '&#9654;', 'method': 'animate', 'args': [None, frame_args]},
+                                                {'label': '&#9724;', 'method': 'animate',
+                                                 'args': [[None], {'frame': {'duration': 0, 'redraw': False},
+                                                                   'mode': 'immediate',
+                                                                   'transition': {'duration': 0}}]}]}],
+                      sliders=[{'active': 0, 'x': 0.1, 'y': 0, 'len': 0.9, 'xanchor': 'left', 'yanchor': 'top',
+                                'pad': {'b': 10, 't': 60}, 'currentvalue': {'prefix': 'Date='},
+                                'steps': [{'label': name, 'method': 'animate',
+                                           'args': [[name], {'frame': {'duration': 0, 'redraw': True},
+                                                             'mode': 'immediate', 'transition': {'duration': 0}}]}
+                                          for name in frame_names]}])
+
+    # frames are added once the plot exists; the animation is not started so it loads paused
+    frames_js = "[" + ",".join(cache['frames'][date_str] for date_str in dates) + "]"
+    convToHtml = plotly.io.to_html(fig, include_plotlyjs=False, full_html=False, auto_play=False,
+                                   div_id='world-time-lapse',
+                                   post_script="Plotly.addFrames('{plot_id}', " + frames_js + ");")
     # add a link back to homepage
     link_to_home_page = '<h3><a href = "http://localhost:5000/">COVID-19 Forecasting Dashboard</a></h3>'
     htmlout = '<script src="https://cdn.plot.ly/plotly-latest.min.js"></script>' + "\n" + link_to_home_page + "\n" + convToHtml
     return htmlout
 
+def generate_world_time_lapse(engine_string, frame_cache_path=None, full_resolution_days=None, older_frame_days=7,
+                              refresh_days=3, rebuild=False):
+    """
+    Creates a 'plotly' figure that shows the number of confirmed cases across the globe (at the country level)
+     over time with an animation. Frames from previous runs are kept in a cache so only the dates added since the last
+     run (plus the last refresh_days days, to pick up revised counts) are queried and built.
+    Args:
+        engine_string (str): sqlalchemy string for the connection.
+        frame_cache_path (str): local path of the frame cache, None renders from the full history without a cache
+        full_resolution_days (int): number of recent days shown at daily resolution, None keeps every day
+        older_frame_days (int): spacing in days between frames older than full_resolution_days
+        refresh_days (int): number of most recent cached days that are rebuilt on each run
+        rebuild (bool): ignore any existing cache and rebuild every frame
+
+    Returns:
+        htmlout (str): html for the time-lapse plot
+    """
+    cache = None
+    if frame_cache_path is not None and not rebuild:
+        cache = read_frame_cache(frame_cache_path)
+
+    since_date = None
+    if cache is not None and cache['latest_date'] is not None:
+        since_date = (pd.to_datetime(cache['latest_date']) - pd.Timedelta(days=refresh_days)).strftime('%Y-%m-%d')
+        logger.info("Building time-lapse frames for dates from {} onwards, {} frames cached".format(since_date,
+                                                                                                 len(cache['frames'])))
+    frame_df = get_country_frame_data(engine_string, since_date)
+    cache = update_frame_cache(cache, frame_df, full_resolution_days, older_frame_days)
+    if len(cache['frames']) == 0:
+        logger.error("There is no country level data to build the time-lapse from. Run data_preparation.py first")
+        sys.exit(1)
+    if frame_cache_path is not None:
+        write_frame_cache(cache, frame_cache_path)
+
+    return render_world_time_lapse(cache)
+
 def save_html_to_s3(file_content,filename,s3_bucket_name,s3_output_path):
     """
     Saves html representation of a plotly plot to s3
@@ -140,10 +324,12 @@ def save_html_to_local(file_content,filename,local_path):
             f.write(file_content)
             f.close()
             logger.info("Html file was successfully saved to local machine. File is located at {}".format(local_file))
+        static_assets.publish_assets(local_path, {"{}.html".format(filename): file_content})
     except FileNotFoundError:
         logger.error("The local file path you've specified does not exist. Verify the path is correct in the config.yml")
 
 
+@instrumentation.timed('run_generate_trend_plots')
 def run_generate_trend_plots(args):
     """
     Wrapper function to run steps to generate trends plots for COVID-19 webapp
@@ -152,6 +338,7 @@ def run_generate_trend_plots(args):
            - config (str): Path to yaml file with load_data as a top level key containing relevant configurations
            - engine_string (str): sqlalchemy engine string argument can be entered
            - s3_flag (bool): the flag used to determine if the scripts will read/write via s3 or local
+           - rebuild_time_lapse (bool): rebuild every time-lapse frame instead of appending to the frame cache
 
     Returns:
         None -- wrapper function
@@ -165,7 +352,8 @@ def run_generate_trend_plots(args):
         sys.exit(1)
 
     global_trend_plot_html = generate_global_line_plot(args.engine_string)
-    global_animation_plot_html = generate_world_time_lapse(args.engine_string)
+    global_animation_plot_html = generate_world_time_lapse(args.engine_string, rebuild=args.rebuild_time_lapse,
+                                                           **config['generate_trend_plots']['generate_world_time_lapse'])
 
     if args.s3_flag == True:
         save_html_to_s3(global_trend_plot_html,'global_cases',**config['generate_trend_plots']['save_html_to_s3'])
@@ -179,6 +367,8 @@ if __name__ == '__main__':
     parser.add_argument('--config', '-c', default = 'config.yml', help='path to yaml file with configurations')
     parser.add_argument("--engine_string", default=None, help="Optional engine string for db to add data to ")
     parser.add_argument("--s3", dest='s3_flag', action='store_true', help="Use arg if you want to save s3 rather than locally.")
+    parser.add_argument("--rebuild_time_lapse", action='store_true',
+                        help="Use arg to rebuild every time-lapse frame rather than only the new dates.")
 
     args = parser.parse_args()
 
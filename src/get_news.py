@@ -10,53 +10,85 @@ import logging.config
 import os
 import ast
 import config as cfg
+import instrumentation
+import static_assets
 
 logging.config.fileConfig(fname="local.conf")
 logger = logging.getLogger(__name__)
 
 
-def acquire_data(url,params):
+def get_request_params(params):
+    '''
+    Build the query parameters for the newsAPI request
+    Args:
+        params (str): string representation of a dict of params from the config file
+
+    Returns:
+        params (dict): params to be applied for api call, including the apiKey from the environment
+    '''
+    # convert string rep of dict to dict for params
+    params = ast.literal_eval(params)
+    # get apiKey from environment variable
+    params['apiKey'] = cfg.NEWS_API_KEY
+    return params
+
+def get_articles(response_text):
+    '''
+    Parse the article headlines out of a raw newsAPI response
+    Args:
+        response_text (str): body of the newsAPI response
+
+    Returns:
+        api_pull (list or None): the articles in the response, None if the response could not be parsed
+    '''
+    # Handle error in the case that deserialization fails
+    try:
+        api_response = json.loads(response_text)
+    except ValueError:
+        logger.error("Call to the newsAPI was okay, but did not return a json parsable response. There may be some issue"
+                     "with the API itself.")
+        return None
+
+    # get just the article headlines from the response
+    try:
+        api_pull = api_response['articles']
+    except KeyError:
+        logger.error("It is likely you have not set your newsAPI key--please see the readme for instructions on this")
+        return None
+    return api_pull
+
+def acquire_data(url,params,timeout=None):
     '''
     Make GET request to API (newsAPI) to retrieve raw data
     Args:
         url (str): url for api to pull data from
         params (dict): params to be applied for api call
+        timeout (float or None): seconds to wait on the API before giving up. None waits indefinitely
 
     Returns:
         api_pull (dict):  raw data (in dict) consisting of news information pulled from the aPI
     '''
 
     ##Make API request
-    # convert string rep of dict to dict for params
-    params = ast.literal_eval(params)
-    # get apiKey from environment variable
-    params['apiKey'] = cfg.NEWS_API_KEY
+    params = get_request_params(params)
     try:
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, timeout=timeout)
     except requests.exceptions.ConnectionError:
         logger.error("There was a connection error to the news API. Please try again or verify the URL and API status. "
                      "Pipeline will continue but the app will not display updated news headlines")
+        return None
     except requests.exceptions.Timeout:
         logger.error("Timeout error to the news API, please try again. If problem persists, wait to try again until later. "
                      "Pipeline will continue but the app will not display updated news headlines")
+        return None
     except requests.exceptions.RequestException as e:
         logger.error("Unexpected error with the request to the news API: {}:{}. Pipeline will continue but the app will "
                      "not display updated news headlines".format(type(e).__name__, e))
+        return None
 
-    # Handle error in the case that deserialization fails
-    try:
-        api_response = response.json()
+    api_pull = get_articles(response.text)
+    if api_pull is not None:
         logger.info("Request to newsAPI was successful.")
-    except ValueError:
-        logger.error("Call to the newsAPI was okay, but did not return a json parsable response. There may be some issue"
-                     "with the API itself.")
-
-    # get just the article headlines from the response
-    try:
-        api_pull = api_response['articles']
-    except KeyError:
-        logger.error("It is likely you have not set your newsAPI key--please see the readme for instructions on this")
-
     return api_pull
 
 def write_data_to_s3(api_data,s3_bucket_name,s3_output_path):
@@ -105,12 +137,15 @@ def write_data_to_local(api_data,local_filename):
         with open(local_filename, 'w') as f:
             json.dump(api_data, f)
         logger.info("News API Data was successfully saved to local. File is located at {}".format(local_filename))
+        static_assets.publish_assets(os.path.dirname(local_filename),
+                                     {os.path.basename(local_filename): json.dumps(api_data)})
     except FileNotFoundError:
         logger.error("It seems that the path you've provided does not exist. Please create the path or update the path in the config.yml file")
     except Exception as e:
         logger.error("Unexpected error in trying to write data to s3: {}:{}".format(type(e).__name__, e))
         logger.warning("new newsAPI data could not be saved thus the app will not displayed an updated feed")
 
+@instrumentation.timed('run_get_news')
 def run_get_news(args):
     """
     Wrapper function, retrieves data via API call and saves to s3 bucket
@@ -134,6 +169,10 @@ def run_get_news(args):
     if cfg.NEWS_API_KEY is not None:
         # call function to get data
         api_data = acquire_data(**config['get_news']['acquire_data'])
+        if api_data is None:
+            logger.warning("No news headlines retrieved--the app will not display an updated feed")
+            return
+        instrumentation.add_rows(len(api_data))
 
         # call function to write data to s3
         if args.s3_flag == True:
@@ -7,20 +7,86 @@ import os
 import sqlalchemy as sql
 from sqlalchemy import exc
 import pandas as pd
+import json
+from datetime import datetime, timezone
 import config
+import instrumentation
 
 logging.config.fileConfig(fname="local.conf")
 logger = logging.getLogger()
 
+# name of the small object kept in an s3 path that points at the most recent object written to that path
+LATEST_MANIFEST_NAME = "_latest"
+
+def list_s3_objects(s3,bucket_name,s3_file_path):
+    """
+    Lists every object in an s3 bucket path, following list_objects_v2 pagination past the first 1000 keys
+    Args:
+        s3: boto3 s3 client
+        bucket_name (str): the name of S3 bucket of interest
+        s3_file_path (str): s3 bucket file path of interest
+
+    Yields:
+        s3_object (dict): list_objects_v2 entry (Key, LastModified, Size, ...) for each object in the path
+    """
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=s3_file_path):
+        for s3_object in page.get('Contents', []):
+            yield s3_object
+
+def read_latest_manifest(s3,bucket_name,s3_file_path):
+    """
+    Reads the '_latest' manifest object of an s3 bucket path
+    Args:
+        s3: boto3 s3 client
+        bucket_name (str): the name of S3 bucket of interest
+        s3_file_path (str): s3 bucket file path of interest
+
+    Returns:
+        latest_object (dict or None): Key and LastModified of the latest object, None if there is no manifest
+    """
+    try:
+        s3_obj = s3.get_object(Bucket=bucket_name, Key=os.path.join(s3_file_path, LATEST_MANIFEST_NAME))
+    except botoexceptions.ClientError as error:
+        if error.response['Error']['Code'] in ("NoSuchKey", "404"):
+            return None
+        raise
+    manifest = json.loads(s3_obj['Body'].read().decode('utf-8'))
+    return {'Key': manifest['Key'], 'LastModified': datetime.fromisoformat(manifest['LastModified'])}
+
+def update_latest_manifest(bucket_name,s3_file_path,key,last_modified=None,s3=None):
+    """
+    Points the '_latest' manifest of an s3 bucket path at a newly written object. Every stage that writes to a path read
+    with "get_latest_s3_data" should call this after its write.
+    Args:
+        bucket_name (str): the name of S3 bucket of interest
+        s3_file_path (str): s3 bucket file path the object was written to
+        key (str): key of the newly written object
+        last_modified (datetime): time the object was written, defaults to now
+        s3: optional boto3 s3 client
+
+    Returns:
+        None -- writes the manifest object to s3
+    """
+    if s3 is None:
+        s3 = boto3.client("s3")
+    if last_modified is None:
+        last_modified = datetime.now(timezone.utc)
+    manifest = {'Key': key, 'LastModified': last_modified.isoformat()}
+    s3.put_object(Bucket=bucket_name, Key=os.path.join(s3_file_path, LATEST_MANIFEST_NAME), Body=json.dumps(manifest),
+                  ContentType="application/json")
+    logger.debug("Latest object manifest for {} updated to {}".format(s3_file_path, key))
+
 def get_latest_s3_data(bucket_name,s3_file_path):
     '''
-    Retrieves the latest object saved to the specified path s3 bucket path.
+    Retrieves the latest object saved to the specified path s3 bucket path. Reads the path's '_latest' manifest when it
+    exists; otherwise lists the whole path (across all pages) once and writes the manifest for the next lookup.
     Args:
         bucket_name (str): the name of S3 bucket of interest
         s3_file_path (str): s3 bucket file path of interest
 
     Returns:
-        most_recent_object: the most recently modified object in the s3 file path specified
+        most_recent_object: the most recently modified object in the s3 file path specified (at least Key and LastModified)
     '''
     ## try to connect to s3 prior to starting up any processing
     try:
@@ -28,9 +94,14 @@ def get_latest_s3_data(bucket_name,s3_file_path):
     except botoexceptions.NoCredentialsError:
         logger.error("Your AWS credentials were not found. Verify that they have been made available as detailed in readme instructions")
         sys.exit(1)
-    ## try to access s3 file path of interest
+    ## try to read the manifest, falling back to listing the s3 file path of interest
     try:
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=s3_file_path)
+        most_recent_object = read_latest_manifest(s3, bucket_name, s3_file_path)
+        if most_recent_object is not None:
+            logger.debug("Latest object retrieved from the manifest")
+            return most_recent_object
+        s3_objects = [s3_object for s3_object in list_s3_objects(s3, bucket_name, s3_file_path)
+                      if os.path.basename(s3_object['Key']) != LATEST_MANIFEST_NAME]
         logger.debug("Successfully reached s3 bucket")
     except botoexceptions.ParamValidationError as error:
         logger.error('The parameters you provided are incorrect: {}'.format(error))
@@ -41,17 +112,33 @@ def get_latest_s3_data(bucket_name,s3_file_path):
     except Exception as error:
         logger.error('Unexpected error: {}'.format(error))
         sys.exit(1)
-    ## try to pull objects from the s3 file path
-    try:
-        s3_objects = response['Contents']
-        logger.debug("Successfully retrieved s3 objects")
-    except KeyError as e:
+    if len(s3_objects) == 0:
         logger.error('There is no previous data from this acquisition pipeline in your s3 bucket. Please run again with an additional cmd line arg --start_date')
         sys.exit(1)
-    ## get most recent object
+    ## get most recent object and remember it so later lookups are a single read
     most_recent_object = max(s3_objects, key=lambda x: x['LastModified'])
+    update_latest_manifest(bucket_name, s3_file_path, most_recent_object['Key'], most_recent_object['LastModified'], s3)
     return most_recent_object
 
+def resolve_latest_s3_dir(bucket_name,s3_dir_path):
+    """
+    Resolves an s3 directory path ending in 'latest' (e.g. 'MSiA_423/models/country/latest') to the directory of the
+    most recent object written under its parent path. Any other path is returned unchanged.
+    Args:
+        bucket_name (str): the name of S3 bucket of interest
+        s3_dir_path (str): s3 directory path, possibly ending in 'latest'
+
+    Returns:
+        s3_dir_path (str): the resolved directory path
+    """
+    if os.path.basename(s3_dir_path.rstrip('/')) != 'latest':
+        return s3_dir_path
+    parent_path = os.path.dirname(s3_dir_path.rstrip('/'))
+    latest_key = get_latest_s3_data(bucket_name, parent_path)['Key']
+    resolved = os.path.dirname(latest_key)
+    logger.info("Resolved {} to {}".format(s3_dir_path, resolved))
+    return resolved
+
 def get_engine_string():
     """
     Get the engine string for the database connection.
@@ -103,6 +190,7 @@ def add_to_database(df,table_name,if_exists_condition,engine_string=None):
     engine = get_engine(engine_string)
 
     try:
+        instrumentation.increment('db_round_trips')
         df.to_sql(table_name,engine,if_exists=if_exists_condition,index=False)
         logger.debug("Data inserted into {}".format(table_name))
     except exc.IntegrityError:
@@ -119,12 +207,13 @@ def add_to_database(df,table_name,if_exists_condition,engine_string=None):
         logger.error("Unexpected error with the SQLAlchemy: {}:{}".format(type(error).__name__, error))
         sys.exit(1)
 
-def get_data_from_database(query,engine_string=None):
+def get_data_from_database(query,engine_string=None,params=None):
     """
     Retrieve data from a MySQL database on local machine or RDS
     Args:
-        query (str): single string representing the query of interest
+        query (str): single string representing the query of interest, with :name placeholders if params are given
         engine_string (str): sqlalchemy string for connection to desired database (optional input)
+        params (dict): optional values for the :name placeholders in the query, passed separately from the SQL
 
     Returns:
         df (pandas DataFrame): DataFrame containing results from input query
@@ -136,7 +225,11 @@ def get_data_from_database(query,engine_string=None):
     else:
         engine = sql.create_engine(engine_string)
     try:
-        df= pd.read_sql(query,con=engine)
+        instrumentation.increment('db_round_trips')
+        if params is None:
+            df= pd.read_sql(query,con=engine)
+        else:
+            df = pd.read_sql(sql.text(query),con=engine,params=params)
         logger.debug("Data successfully retrieved")
     except exc.OperationalError:
         logger.error("Unable to connect to the database. Verify the connection info provided (in rds_config file) is accurate. "
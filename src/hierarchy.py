@@ -0,0 +1,168 @@
+import logging.config
+import re
+import pandas as pd
+import schema
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Region hierarchy of the pipeline, defined by the hierarchy->levels list of the config.yml. A level is
+
+    name            e.g. 'country' or 'province', also the name of its block in model_registry
+    keys            columns of the raw records a series of the level is grouped by, e.g. [Country, Province]; a level
+                    without keys is a single series (the global level)
+    filter          optional pandas query selecting the raw records of the level, e.g. "Province != ''"
+    sum_of          optional name of another level the level is summed from instead of the raw records
+    table           daily cases table written by data_preparation.py
+    forecast_table  forecasts table written by generate_forecasts.py (levels with keys)
+    data_out        optional csv copy of the daily cases
+
+data_preparation.py writes the daily table of every level, and train_models.py and generate_forecasts.py train and
+forecast every series of each level with keys through the same batched paths as the countries, so a new level only
+takes configuration. A series is named by its key values joined with SERIES_SEPARATOR, e.g. "Canada | Ontario".
+"""
+
+SERIES_SEPARATOR = ' | '
+
+
+class Level:
+    """A level of the region hierarchy"""
+
+    def __init__(self, name, keys, table, filter=None, sum_of=None, forecast_table=None, data_out=None):
+        self.name = name
+        self.keys = list(keys)
+        self.table = table
+        self.filter = filter
+        self.sum_of = sum_of
+        self.forecast_table = forecast_table
+        self.data_out = data_out
+
+    def aggregate(self, df):
+        """
+        Daily cases of every series of the level
+        Args:
+            df (pandas DataFrame): raw records (schema.parse_records), or the daily cases of the level it is the sum of
+
+        Returns:
+            daily_df (pandas DataFrame): keys, Date and schema.COUNT_COLUMNS, one row per series and date
+        """
+        if self.filter:
+            df = df.query(self.filter)
+        # observed=True: only group by the names present, not every category of the categorical columns
+        daily_df = df.groupby(self.keys + ['Date'], observed=True)[schema.COUNT_COLUMNS].sum().reset_index()
+        return schema.apply_schema(daily_df)
+
+    def series_ids(self, df):
+        """Series name of each row of a frame with the level's key columns"""
+        if len(self.keys) == 0:
+            return pd.Series(self.name.capitalize(), index=df.index)
+        names = df[self.keys[0]].astype(str)
+        for key in self.keys[1:]:
+            names = names + SERIES_SEPARATOR + df[key].astype(str)
+        return names
+
+    def series_frame(self, daily_df):
+        """
+        Confirmed cases of every series, in the form train_models.train_country_models takes (a Country column naming the
+        series)
+        Args:
+            daily_df (pandas DataFrame): the level's keys, Date and Confirmed
+
+        Returns:
+            series_df (pandas DataFrame): Country (series name), Date and Confirmed
+        """
+        return pd.DataFrame({'Country': self.series_ids(daily_df), 'Date': daily_df['Date'],
+                             'Confirmed': daily_df['Confirmed']})
+
+    def forecast_frame(self, forecast_df):
+        """
+        Forecasts of the level's series with the series name (country column of generate_forecasts) split back into a
+        lower case column per key, e.g. country and province
+        Args:
+            forecast_df (pandas DataFrame): country, Date and confirmed_cases_forecast
+
+        Returns:
+            forecast_df (pandas DataFrame): the key columns, Date and confirmed_cases_forecast
+        """
+        # a pattern longer than one character is a regular expression for str.split (pandas < 1.4 has no regex
+        # argument to say otherwise), so the separator is escaped
+        parts = forecast_df['country'].str.split(re.escape(SERIES_SEPARATOR), n=len(self.keys) - 1, expand=True)
+        key_df = pd.DataFrame({key.lower(): parts[i] for i, key in enumerate(self.keys)}, index=forecast_df.index)
+        return pd.concat([key_df, forecast_df.drop(columns=['country'])], axis=1)
+
+
+def get_levels(config):
+    """
+    Levels of the hierarchy block of the config
+    Args:
+        config (dict): configurations with hierarchy as a top level key
+
+    Returns:
+        levels (list): Level objects, in config order
+
+    Raises:
+        ValueError: for a level with unknown or missing fields, a duplicate name, or a sum_of that is not another level
+            with (a superset of) its keys
+    """
+    levels = []
+    for spec in config['hierarchy']['levels']:
+        try:
+            levels.append(Level(**spec))
+        except TypeError as e:
+            raise ValueError("Invalid hierarchy level {}: {}".format(spec, e))
+    by_name = {}
+    for level in levels:
+        if level.name in by_name:
+            raise ValueError("Hierarchy level {} is defined twice".format(level.name))
+        by_name[level.name] = level
+    for level in levels:
+        if level.sum_of is not None:
+            parent = by_name.get(level.sum_of)
+            if parent is None or parent is level or not set(level.keys) <= set(parent.keys):
+                raise ValueError("Hierarchy level {} can only be the sum of another level with its keys {}".format(
+                    level.name, level.keys))
+    return levels
+
+
+def get_level(levels, name):
+    """The level called name, None if there is none"""
+    return next((level for level in levels if level.name == name), None)
+
+
+def top_level(levels):
+    """The level without keys (the global series), None if there is none"""
+    return next((level for level in levels if len(level.keys) == 0), None)
+
+
+def series_levels(levels):
+    """The levels with keys, whose series are trained and forecast one model per series"""
+    return [level for level in levels if len(level.keys) > 0]
+
+
+def prepare_levels(raw_df, levels):
+    """
+    Daily cases of every level, each level with a sum_of summed from the daily cases of that level
+    Args:
+        raw_df (pandas DataFrame): raw records (schema.parse_records)
+        levels (list): output of get_levels
+
+    Returns:
+        daily (dict): level name -> daily cases of the level (see Level.aggregate)
+
+    Raises:
+        ValueError: if the sum_of references of the levels form a cycle
+    """
+    daily = {}
+    pending = list(levels)
+    while len(pending) > 0:
+        ready = [level for level in pending if level.sum_of is None or level.sum_of in daily]
+        if len(ready) == 0:
+            raise ValueError("The sum_of references of hierarchy levels {} form a cycle".format(
+                [level.name for level in pending]))
+        for level in ready:
+            daily[level.name] = level.aggregate(raw_df if level.sum_of is None else daily[level.sum_of])
+            logger.info("Prepared {} daily rows of the {} level".format(len(daily[level.name]), level.name))
+            pending.remove(level)
+    return daily
@@ -0,0 +1,260 @@
+import json
+import logging.config
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+import boto3
+import config as cfg
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+# process wide round trip counters. DB trips are counted by helper.py, s3 trips by a boto3 event hook (see below)
+round_trip_counters = {'db_round_trips': 0, 's3_round_trips': 0}
+counter_lock = threading.Lock()
+# stack of stages that are currently open (per thread) so that nested stages and add_rows know where to report to
+stage_stack = threading.local()
+
+# metric name, help text and the StageRecord attribute it is read from for the prometheus text file
+PROMETHEUS_METRICS = [
+    ('pipeline_stage_wall_seconds', 'Wall clock time spent in a pipeline stage', 'wall_seconds'),
+    ('pipeline_stage_cpu_seconds', 'CPU time (user + system) spent in a pipeline stage', 'cpu_seconds'),
+    ('pipeline_stage_peak_rss_bytes', 'Peak resident set size of the process at the end of the stage', 'peak_rss_bytes'),
+    ('pipeline_stage_rows', 'Number of rows processed by a pipeline stage', 'rows'),
+    ('pipeline_stage_db_round_trips', 'Number of database round trips made during a pipeline stage', 'db_round_trips'),
+    ('pipeline_stage_s3_round_trips', 'Number of s3 requests made during a pipeline stage', 's3_round_trips'),
+]
+
+
+class StageRecord:
+    """Measurements for a single run of a pipeline stage (or of one iteration of a per-country loop)"""
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.rows = 0
+        self.status = 'ok'
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_bytes = None
+        self.db_round_trips = 0
+        self.s3_round_trips = 0
+        self.children = []
+
+    def add_rows(self, n):
+        """Add to the number of rows processed by this stage"""
+        self.rows += int(n)
+
+    def to_dict(self):
+        """Flat dict representation of the record used for the JSON lines output"""
+        return {'timestamp': datetime.now().isoformat(), 'stage': self.name, 'labels': self.labels,
+                'status': self.status, 'wall_seconds': self.wall_seconds, 'cpu_seconds': self.cpu_seconds,
+                'peak_rss_bytes': self.peak_rss_bytes, 'rows': self.rows, 'db_round_trips': self.db_round_trips,
+                's3_round_trips': self.s3_round_trips}
+
+
+def increment(counter_name, n=1):
+    """
+    Increment one of the process wide round trip counters
+    Args:
+        counter_name (str): 'db_round_trips' or 's3_round_trips'
+        n (int): amount to increment by
+
+    Returns:
+        None
+    """
+    with counter_lock:
+        round_trip_counters[counter_name] += n
+
+
+def count_s3_call(**kwargs):
+    """boto3 event handler that counts every completed s3 API call"""
+    increment('s3_round_trips')
+
+
+# every boto3.client("s3") in the pipeline is created from the default session, and clients copy the session's event
+# handlers when they are created, so registering here counts s3 calls without touching each call site
+boto3.setup_default_session()
+boto3.DEFAULT_SESSION.events.register('after-call.s3', count_s3_call)
+
+
+def get_peak_rss_bytes():
+    """
+    Get the peak resident set size of the current process
+    Returns:
+        peak_rss (int): high water mark of the process memory in bytes
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS reports bytes
+    if sys.platform != 'darwin':
+        peak_rss = peak_rss * 1024
+    return peak_rss
+
+
+def current_stage():
+    """
+    Get the innermost stage that is open in this thread
+    Returns:
+        record (StageRecord or None): the innermost open stage, None if no stage is open
+    """
+    stack = getattr(stage_stack, 'records', [])
+    if len(stack) == 0:
+        return None
+    return stack[-1]
+
+
+def add_rows(n):
+    """
+    Add to the rows processed count of the innermost open stage. Does nothing when called outside of a stage so
+    functions can report rows whether or not they are being instrumented.
+    Args:
+        n (int): number of rows processed
+
+    Returns:
+        None
+    """
+    record = current_stage()
+    if record is not None:
+        record.add_rows(n)
+
+
+def write_json_line(record, json_path):
+    """
+    Append a stage record to the JSON lines metrics file
+    Args:
+        record (StageRecord): measurements to write out
+        json_path (str): path of the JSON lines file
+
+    Returns:
+        None -- appends a line to the file
+    """
+    try:
+        if os.path.dirname(json_path) != '':
+            os.makedirs(os.path.dirname(json_path), exist_ok=True)
+        with open(json_path, 'a') as f:
+            f.write(json.dumps(record.to_dict()) + "\n")
+    except OSError as e:
+        # metrics should never take down the pipeline
+        logger.warning("Could not write pipeline metrics to {}: {}".format(json_path, e))
+
+
+def format_prometheus_labels(record):
+    """Format the stage name and labels of a record in prometheus label syntax"""
+    labels = dict({'stage': record.name}, **record.labels)
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('{}="{}"'.format(key, value))
+    return '{' + ','.join(pairs) + '}'
+
+
+def write_prometheus_file(record, prom_dir):
+    """
+    Write a stage and all of its nested stages to a prometheus textfile collector file named after the stage
+    Args:
+        record (StageRecord): top level stage record
+        prom_dir (str): directory the .prom file is written to
+
+    Returns:
+        None -- writes <stage>.prom into prom_dir
+    """
+    records = [record]
+    i = 0
+    while i < len(records):
+        records.extend(records[i].children)
+        i += 1
+
+    lines = []
+    for metric_name, help_text, attribute in PROMETHEUS_METRICS:
+        lines.append('# HELP {} {}'.format(metric_name, help_text))
+        lines.append('# TYPE {} gauge'.format(metric_name))
+        for r in records:
+            if getattr(r, attribute) is not None:
+                lines.append('{}{} {}'.format(metric_name, format_prometheus_labels(r), getattr(r, attribute)))
+
+    prom_file = os.path.join(prom_dir, "{}.prom".format(record.name))
+    try:
+        os.makedirs(prom_dir, exist_ok=True)
+        # write to a temporary file and rename so the collector never scrapes a half written file
+        with open(prom_file + ".tmp", 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(prom_file + ".tmp", prom_file)
+    except OSError as e:
+        logger.warning("Could not write prometheus metrics to {}: {}".format(prom_file, e))
+
+
+@contextmanager
+def stage(name, json_path=None, prom_dir=None, **labels):
+    """
+    Context manager that measures wall time, CPU time, peak RSS, rows processed and DB/s3 round trips for a block
+    Args:
+        name (str): name of the stage, e.g. 'run_train_models' or 'train_country_model'
+        json_path (str): JSON lines file to append the record to. Defaults to METRICS_JSON_PATH in config.py
+        prom_dir (str): if given, a prometheus text file is written for the stage (and its nested stages) on exit
+        **labels: Arbitrary keyword arguments used as labels on the record, e.g. country='Spain'
+
+    Yields:
+        record (StageRecord): record for the stage, use record.add_rows(n) to report rows processed
+    """
+    if json_path is None:
+        json_path = cfg.METRICS_JSON_PATH
+    record = StageRecord(name, labels)
+    parent = current_stage()
+    if parent is not None:
+        parent.children.append(record)
+    if not hasattr(stage_stack, 'records'):
+        stage_stack.records = []
+    stage_stack.records.append(record)
+
+    start_counters = dict(round_trip_counters)
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield record
+    except BaseException:
+        # SystemExit from the pipeline's error handling is a BaseException, record those as failures as well
+        record.status = 'error'
+        raise
+    finally:
+        record.wall_seconds = round(time.perf_counter() - start_wall, 6)
+        record.cpu_seconds = round(time.process_time() - start_cpu, 6)
+        record.peak_rss_bytes = get_peak_rss_bytes()
+        record.db_round_trips = round_trip_counters['db_round_trips'] - start_counters['db_round_trips']
+        record.s3_round_trips = round_trip_counters['s3_round_trips'] - start_counters['s3_round_trips']
+        stage_stack.records.pop()
+
+        logger.debug("Stage metrics: {}".format(json.dumps(record.to_dict())))
+        if json_path:
+            write_json_line(record, json_path)
+        if prom_dir:
+            write_prometheus_file(record, prom_dir)
+
+
+def timed(name):
+    """
+    Decorator that runs the wrapped function inside a stage. Used for the run_* wrapper functions of each script; a
+    prometheus text file is written for the stage if METRICS_PROM_DIR is set in config.py.
+    Args:
+        name (str): name of the stage
+
+    Returns:
+        decorator for the function to be timed
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, prom_dir=cfg.METRICS_PROM_DIR) as record:
+                result = func(*args, **kwargs)
+            logger.info("{} finished in {:.1f}s (cpu {:.1f}s, peak rss {:.0f} MB, {} rows, {} db round trips, "
+                        "{} s3 round trips)".format(name, record.wall_seconds, record.cpu_seconds,
+                                                    record.peak_rss_bytes / 1e6, record.rows,
+                                                    record.db_round_trips, record.s3_round_trips))
+            return result
+        return wrapper
+    return decorator
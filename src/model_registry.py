@@ -0,0 +1,235 @@
+import hashlib
+import json
+import logging.config
+import math
+import os
+import shutil
+import sys
+from datetime import datetime
+import boto3
+import botocore.exceptions as botoexceptions
+import artifact_cache
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Registry of trained model versions. Each training run is published as a version directory under the registry root (a
+local directory or an s3 prefix), and the root holds one index file listing every version with its artifacts (key,
+sha256 checksum, size) and metrics, plus which version is the latest:
+
+    <root>/_registry.json
+    <root>/2020-06-04T09-30-12/ARIMA_Spain
+    <root>/2020-06-04T09-30-12/countries.pkl
+
+Resolving 'latest' or a pinned version is a single read of the index. An s3 registry reads through an ETag keyed disk
+cache (artifact_cache.py): the index records each artifact's ETag, so an artifact already in the cache is used without
+any s3 request, and the index itself is revalidated with a conditional GET that downloads nothing when it is unchanged.
+"""
+
+REGISTRY_INDEX_NAME = "_registry.json"
+VERSION_FORMAT = "%Y-%m-%dT%H-%M-%S"
+
+
+def file_sha256(path):
+    """sha256 hex digest of a file, read in 1MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def json_safe(value):
+    """Metric values with NaN/inf replaced by None, as they are not valid json"""
+    if isinstance(value, dict):
+        return {str(key): json_safe(item) for key, item in value.items()}
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+class ModelRegistry:
+    """
+    Versioned store of model artifacts under a local directory or an s3 prefix (when s3_bucket_name is given).
+
+        registry = ModelRegistry("models/country")
+        version = registry.publish({'ARIMA_Spain': 'staging/ARIMA_Spain'}, metrics={'mape': {'Spain': 3.2}})
+        path = registry.fetch('ARIMA_Spain')  # from the latest version
+    """
+
+    def __init__(self, root, s3_bucket_name=None, cache_dir="models/cache", s3=None, cache_max_bytes=2 ** 30):
+        self.root = root
+        self.s3_bucket_name = s3_bucket_name
+        self.index = None
+        self.stats = {'index_reads': 0}
+        self.s3 = s3
+        self.cache = None
+        if s3_bucket_name is not None:
+            if s3 is None:
+                try:
+                    self.s3 = boto3.client("s3")
+                except botoexceptions.NoCredentialsError:
+                    logger.error("Your AWS credentials were not found. Verify that they have been made available as "
+                                 "detailed in readme instructions")
+                    sys.exit(1)
+            self.cache = artifact_cache.ArtifactCache(cache_dir, cache_max_bytes, self.s3)
+
+    def location(self):
+        """Readable location of the registry root for log messages"""
+        return self.root if self.s3_bucket_name is None else "s3://{}/{}".format(self.s3_bucket_name, self.root)
+
+    def read_index(self):
+        """
+        Reads the index file (once; later calls reuse it until publish changes it)
+        Returns:
+            index (dict): 'latest' version (None for an empty registry) and 'versions' -> version -> entry
+        """
+        if self.index is not None:
+            return self.index
+        self.stats['index_reads'] += 1
+        index = None
+        if self.s3_bucket_name is None:
+            try:
+                with open(os.path.join(self.root, REGISTRY_INDEX_NAME)) as f:
+                    index = json.load(f)
+            except FileNotFoundError:
+                pass
+        else:
+            try:
+                # conditional GET: an index unchanged since the last run is read from the cache, not downloaded
+                with open(self.cache.get(self.s3_bucket_name, os.path.join(self.root, REGISTRY_INDEX_NAME))) as f:
+                    index = json.load(f)
+            except botoexceptions.ClientError as e:
+                if e.response['Error']['Code'] not in ("NoSuchKey", "404"):
+                    raise
+        self.index = index if index is not None else {'latest': None, 'versions': {}}
+        return self.index
+
+    def write_index(self, index):
+        """Writes the index file, atomically for a local registry"""
+        body = json.dumps(index, indent=2, sort_keys=True)
+        if self.s3_bucket_name is None:
+            os.makedirs(self.root, exist_ok=True)
+            path = os.path.join(self.root, REGISTRY_INDEX_NAME)
+            with open(path + ".tmp", 'w') as f:
+                f.write(body)
+            os.replace(path + ".tmp", path)
+        else:
+            self.s3.put_object(Bucket=self.s3_bucket_name, Key=os.path.join(self.root, REGISTRY_INDEX_NAME), Body=body,
+                               ContentType="application/json")
+        self.index = index
+
+    def publish(self, artifacts, metrics=None, version=None):
+        """
+        Stores the artifacts of a training run as a new version and makes it the latest. The index is written last, so
+        it only ever lists versions whose artifacts are all stored.
+        Args:
+            artifacts (dict): artifact name -> path of the local file
+            metrics (dict): optional metrics of the run (e.g. MAPE), stored in the index
+            version (str): optional version name, defaults to the current time
+
+        Returns:
+            version (str): the published version
+        """
+        if version is None:
+            version = datetime.now().strftime(VERSION_FORMAT)
+        entries = {}
+        for name, local_file in artifacts.items():
+            key = "{}/{}".format(version, name)
+            sha256 = file_sha256(local_file)
+            if self.s3_bucket_name is None:
+                path = os.path.join(self.root, key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                shutil.copyfile(local_file, path + ".tmp")
+                os.replace(path + ".tmp", path)
+            else:
+                s3_key = os.path.join(self.root, key)
+                self.s3.upload_file(local_file, self.s3_bucket_name, s3_key)
+                etag = self.s3.head_object(Bucket=self.s3_bucket_name, Key=s3_key)['ETag']
+                # the trained files are already here, so this machine never needs to download them
+                self.cache.put(local_file, self.s3_bucket_name, s3_key, etag)
+            entries[name] = {'key': key, 'sha256': sha256, 'size': os.path.getsize(local_file)}
+            if self.s3_bucket_name is not None:
+                entries[name]['etag'] = etag
+
+        # re-read the index right before updating it rather than reusing a copy read earlier
+        self.index = None
+        index = self.read_index()
+        index['versions'][version] = {'created': datetime.now().isoformat(), 'artifacts': entries,
+                                      'metrics': json_safe(metrics or {})}
+        index['latest'] = version
+        self.write_index(index)
+        logger.info("Published version {} with {} artifacts to the model registry at {}".format(
+            version, len(entries), self.location()))
+        return version
+
+    def resolve(self, version='latest'):
+        """
+        Finds a version in the index
+        Args:
+            version (str): 'latest' or a version name from the index
+
+        Returns:
+            version (str): the resolved version name
+            entry (dict): 'created', 'artifacts' and 'metrics' of the version
+        """
+        index = self.read_index()
+        resolved = index['latest'] if version == 'latest' else version
+        if resolved is None or resolved not in index['versions']:
+            logger.error("Model version '{}' was not found in the model registry at {}. Train models first or verify "
+                         "the pinned version in the config.yml".format(version, self.location()))
+            sys.exit(1)
+        return resolved, index['versions'][resolved]
+
+    def fetch(self, name, version='latest'):
+        """
+        Local path of an artifact of a version. Artifacts of an s3 registry are downloaded into the ETag keyed artifact
+        cache unless the cache already holds the same content (no s3 request is made in that case).
+        Args:
+            name (str): artifact name
+            version (str): 'latest' or a version name from the index
+
+        Returns:
+            path (str): local path of the artifact
+
+        Raises:
+            FileNotFoundError: if the version has no artifact with that name
+        """
+        resolved, entry = self.resolve(version)
+        if name not in entry['artifacts']:
+            raise FileNotFoundError("Version {} of the model registry at {} has no artifact {}".format(
+                resolved, self.location(), name))
+        artifact = entry['artifacts'][name]
+        if self.s3_bucket_name is None:
+            return os.path.join(self.root, artifact['key'])
+
+        try:
+            # versions published before the index recorded ETags fall back to a conditional GET by key
+            return self.cache.get(self.s3_bucket_name, os.path.join(self.root, artifact['key']),
+                                  etag=artifact.get('etag'), sha256=artifact['sha256'])
+        except ValueError:
+            logger.error("Checksum mismatch for {} of version {} in the model registry at {}".format(
+                name, resolved, self.location()))
+            sys.exit(1)
+
+
+def get_registry(registry_config, model_kind, s3_flag, s3=None):
+    """
+    Registry of a kind of model from the model_registry block of the config
+    Args:
+        registry_config (dict): model_registry configurations (cache_dir, cache_max_mb plus a block per model kind with
+            local_root, s3_bucket_name and s3_root)
+        model_kind (str): 'global' or 'country'
+        s3_flag (bool): use the s3 registry rather than the local one
+        s3: optional boto3 s3 client
+
+    Returns:
+        registry (ModelRegistry): the registry
+    """
+    kind_config = registry_config[model_kind]
+    if s3_flag == True:
+        return ModelRegistry(kind_config['s3_root'], kind_config['s3_bucket_name'], registry_config['cache_dir'], s3,
+                             int(registry_config.get('cache_max_mb', 1024) * 2 ** 20))
+    return ModelRegistry(kind_config['local_root'], cache_dir=registry_config['cache_dir'])
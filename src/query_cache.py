@@ -0,0 +1,197 @@
+import logging.config
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import sqlalchemy as sql
+from sqlalchemy import exc
+import helper
+import instrumentation
+from create_database import Data_Version
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Read-through cache for the query results the plots are built from. Entries are keyed by the query, its parameters and
+the data version stored in the data_version table. data_preparation.py and generate_forecasts.py bump the version after
+rewriting the tables, which makes every cached result stale at once; entries also expire after ttl_seconds and the least
+recently used entries are evicted past max_entries.
+"""
+
+# name of the data_version row covering the case and forecast tables
+DATA_VERSION_NAME = "covid_data"
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(engine_string=None):
+    """
+    Engine for an engine string, created once per process so its connection pool is reused between calls
+    Args:
+        engine_string (str): sqlalchemy string for the connection, defaults to the one in config.py
+
+    Returns:
+        engine (sqlalchemy.engine.base.Engine): sqlalchemy engine for database of interest
+    """
+    if engine_string is None:
+        engine_string = helper.get_engine_string()
+    with _engines_lock:
+        if engine_string not in _engines:
+            _engines[engine_string] = sql.create_engine(engine_string)
+        return _engines[engine_string]
+
+
+def get_data_version(engine_string=None, name=DATA_VERSION_NAME):
+    """
+    Current version of the data
+    Args:
+        engine_string (str): sqlalchemy string for connection to desired database
+        name (str): name of the data_version row
+
+    Returns:
+        version (int): the version, 0 if it has never been bumped
+    """
+    table = Data_Version.__table__
+    try:
+        instrumentation.increment('db_round_trips')
+        with get_engine(engine_string).connect() as connection:
+            row = connection.execute(table.select().where(table.c.name == name)).fetchone()
+    except (exc.OperationalError, exc.ProgrammingError):
+        # databases created before the data_version table existed have no version yet
+        return 0
+    return 0 if row is None else row.version
+
+
+def bump_data_version(engine_string=None, name=DATA_VERSION_NAME):
+    """
+    Increments the data version so every cached result for the previous version is ignored. Called by the scripts that
+    rewrite the case and forecast tables.
+    Args:
+        engine_string (str): sqlalchemy string for connection to desired database
+        name (str): name of the data_version row
+
+    Returns:
+        version (int): the new version
+    """
+    engine = get_engine(engine_string)
+    table = Data_Version.__table__
+    table.create(engine, checkfirst=True)
+    instrumentation.increment('db_round_trips')
+    with engine.begin() as connection:
+        result = connection.execute(table.update().where(table.c.name == name)
+                                    .values(version=table.c.version + 1, updated=datetime.now()))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(name=name, version=1, updated=datetime.now()))
+        version = connection.execute(table.select().where(table.c.name == name)).fetchone().version
+    default_cache.set_known_version(engine_string, version)
+    logger.info("Data version '{}' bumped to {}".format(name, version))
+    return version
+
+
+class QueryCache:
+    """
+    TTL/LRU cache of DataFrames returned by helper.get_data_from_database. The data version is looked up at most once
+    every version_check_seconds per database, so a cache hit usually costs no database round trip at all.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=300, version_check_seconds=5):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.configure(max_entries, ttl_seconds, version_check_seconds)
+
+    def configure(self, max_entries=None, ttl_seconds=None, version_check_seconds=None):
+        """
+        Changes the cache limits (e.g. from the Flask app config). Arguments left as None are unchanged.
+        Args:
+            max_entries (int): number of results kept before the least recently used is evicted
+            ttl_seconds (float): seconds a result is served for before it is queried again
+            version_check_seconds (float): seconds between looking up the data version
+        """
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if ttl_seconds is not None:
+            self.ttl_seconds = ttl_seconds
+        if version_check_seconds is not None:
+            self.version_check_seconds = version_check_seconds
+
+    def set_known_version(self, engine_string, version):
+        """Records a data version just read or written so it is not looked up again for version_check_seconds"""
+        with self.lock:
+            self.versions[engine_string] = (version, time.monotonic())
+
+    def current_version(self, engine_string):
+        with self.lock:
+            known = self.versions.get(engine_string)
+        if known is not None and time.monotonic() - known[1] < self.version_check_seconds:
+            return known[0]
+        version = get_data_version(engine_string)
+        self.set_known_version(engine_string, version)
+        return version
+
+    def get(self, query, engine_string=None, params=None):
+        """
+        Result of a query, from the cache when there is a fresh entry for the current data version
+        Args:
+            query (str): query with :name placeholders for params
+            engine_string (str): sqlalchemy string for connection to desired database
+            params (dict): values for the placeholders
+
+        Returns:
+            df (pandas DataFrame): query result (a copy, so callers are free to modify it)
+        """
+        key = (engine_string, query, tuple(sorted((params or {}).items())), self.current_version(engine_string))
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[1] < self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[0].copy()
+            self.stats['misses'] += 1
+
+        df = helper.get_data_from_database(query, engine_string, params)
+        with self.lock:
+            self.entries[key] = (df, now)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return df.copy()
+
+    def clear(self):
+        """Drops every cached result and known data version"""
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+    def metrics(self):
+        """
+        Cache counters
+        Returns:
+            metrics (dict): hits, misses, evictions and current number of entries
+        """
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries))
+
+
+# cache shared by everything in the process (batch scripts and the Flask app)
+default_cache = QueryCache()
+
+
+def cached_query(query, engine_string=None, params=None):
+    """
+    Read-through query on the process wide cache
+    Args:
+        query (str): query with :name placeholders for params
+        engine_string (str): sqlalchemy string for connection to desired database
+        params (dict): values for the placeholders
+
+    Returns:
+        df (pandas DataFrame): query result
+    """
+    return default_cache.get(query, engine_string, params)
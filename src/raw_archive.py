@@ -0,0 +1,308 @@
+import boto3
+import botocore.exceptions as botoexceptions
+import gzip
+import json
+import logging.config
+import os
+import sys
+from datetime import datetime
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Raw COVID19API pulls are archived as one gzip compressed NDJSON file per day of data:
+
+    <archive root>/date=2020-04-12/covid19_daily.ndjson.gz
+    <archive root>/_manifest.json
+
+The manifest lists the partition file for each date and the date of the latest pull, so finding the latest data never
+requires listing the archive. A new pull rewrites only the partitions for the dates it contains.
+"""
+
+MANIFEST_NAME = "_manifest.json"
+PARTITION_FILENAME = "covid19_daily.ndjson.gz"
+
+
+def partition_records(api_data):
+    """
+    Splits raw API records into one partition per day
+    Args:
+        api_data (list): raw data pull from COVID-19 API, one dict per country/province/city and date
+
+    Returns:
+        partitions (dict): date string (YYYY-MM-DD) -> list of records for that date
+    """
+    partitions = {}
+    for record in api_data:
+        partitions.setdefault(record['Date'][:10], []).append(record)
+    return partitions
+
+
+def encode_partition(records):
+    """
+    Serializes records as gzip compressed newline delimited json
+    Args:
+        records (list): records to serialize
+
+    Returns:
+        body (bytes): compressed partition content
+    """
+    lines = "\n".join(json.dumps(record) for record in records) + "\n"
+    return gzip.compress(lines.encode('utf-8'))
+
+
+def iter_partition_records(fileobj):
+    """
+    Streams the records of a compressed partition one at a time
+    Args:
+        fileobj (file-like object): binary file object of a partition (local file or s3 streaming body)
+
+    Yields:
+        record (dict): one raw API record
+    """
+    with gzip.GzipFile(fileobj=fileobj) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def partition_key(date_str):
+    """Relative path of the partition file for a date"""
+    return "date={}/{}".format(date_str, PARTITION_FILENAME)
+
+
+def update_manifest(manifest, partitions, pull_date, sizes):
+    """
+    Records newly written partitions in the manifest
+    Args:
+        manifest (dict or None): existing manifest, None if the archive is new
+        partitions (dict): date string -> records written for that date
+        pull_date (str): date of the pull the partitions came from
+        sizes (dict): date string -> compressed size in bytes
+
+    Returns:
+        manifest (dict): updated manifest
+    """
+    if manifest is None:
+        manifest = {'version': 1, 'partitions': {}}
+    for date_str, records in partitions.items():
+        manifest['partitions'][date_str] = {'key': partition_key(date_str), 'records': len(records),
+                                            'bytes': sizes[date_str], 'pulled': pull_date}
+    if len(manifest['partitions']) > 0:
+        manifest['latest_date'] = max(manifest['partitions'])
+    manifest['latest_pull'] = max(pull_date, manifest.get('latest_pull', pull_date))
+    manifest['updated'] = datetime.now().isoformat()
+    return manifest
+
+
+def read_manifest_local(archive_dir):
+    """
+    Reads the manifest of a local archive
+    Args:
+        archive_dir (str): local directory of the archive
+
+    Returns:
+        manifest (dict or None): the manifest, None if the archive does not exist yet
+    """
+    try:
+        with open(os.path.join(archive_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest_s3(s3_bucket_name, s3_prefix, s3=None):
+    """
+    Reads the manifest of an archive in s3
+    Args:
+        s3_bucket_name (str): name of the s3 bucket containing the archive
+        s3_prefix (str): s3 path of the archive
+        s3: optional boto3 s3 client
+
+    Returns:
+        manifest (dict or None): the manifest, None if the archive does not exist yet
+    """
+    if s3 is None:
+        s3 = boto3.client("s3")
+    try:
+        s3_obj = s3.get_object(Bucket=s3_bucket_name, Key=os.path.join(s3_prefix, MANIFEST_NAME))
+    except botoexceptions.ClientError as e:
+        if e.response['Error']['Code'] in ("NoSuchKey", "404"):
+            return None
+        logger.error("Unexpected error trying to read the archive manifest from s3. {}".format(e.response['Error']))
+        sys.exit(1)
+    return json.loads(s3_obj['Body'].read().decode('utf-8'))
+
+
+def log_compression(api_data, sizes):
+    """Logs the size of the compressed partitions against the size of the single json blob they replace"""
+    raw_size = len(json.dumps(api_data))
+    compressed_size = sum(sizes.values())
+    logger.info("Archived {} records in {} daily partitions: {:.1f} MB compressed vs {:.1f} MB as a single json file"
+                .format(len(api_data), len(sizes), compressed_size / 1e6, raw_size / 1e6))
+
+
+def write_archive_local(api_data, archive_dir, pull_date):
+    """
+    Writes a raw API pull to the local archive and updates its manifest
+    Args:
+        api_data (list): raw data pull from COVID-19 API
+        archive_dir (str): local directory of the archive
+        pull_date (str): date of the pull (end_date of the API request)
+
+    Returns:
+        manifest (dict): the updated manifest
+    """
+    partitions = partition_records(api_data)
+    sizes = {}
+    try:
+        for date_str, records in partitions.items():
+            body = encode_partition(records)
+            path = os.path.join(archive_dir, partition_key(date_str))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temporary file and rename so readers never see a half written partition
+            with open(path + ".tmp", 'wb') as f:
+                f.write(body)
+            os.replace(path + ".tmp", path)
+            sizes[date_str] = len(body)
+        manifest = update_manifest(read_manifest_local(archive_dir), partitions, pull_date, sizes)
+        manifest_path = os.path.join(archive_dir, MANIFEST_NAME)
+        with open(manifest_path + ".tmp", 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    except PermissionError:
+        logger.error("You do not have permission to write to the archive path you've specified in the config file")
+        sys.exit(1)
+    except Exception as e:
+        logger.error("Unexpected error in trying to write the raw data archive to local: {}:{}".format(type(e).__name__, e))
+        sys.exit(1)
+
+    log_compression(api_data, sizes)
+    logger.info("COVID-19 API Data was successfully archived to local. Archive is located at {}".format(archive_dir))
+    return manifest
+
+
+def write_archive_s3(api_data, s3_bucket_name, s3_prefix, pull_date):
+    """
+    Writes a raw API pull to the archive in s3 and updates its manifest
+    Args:
+        api_data (list): raw data pull from COVID-19 API
+        s3_bucket_name (str): name of the s3 bucket to write to
+        s3_prefix (str): s3 path of the archive
+        pull_date (str): date of the pull (end_date of the API request)
+
+    Returns:
+        manifest (dict): the updated manifest
+    """
+    try:
+        s3 = boto3.client("s3")
+    except botoexceptions.NoCredentialsError:
+        logger.error("Your AWS credentials were not found. Verify that they have been made available "
+                     "as detailed in readme instructions")
+        sys.exit(1)
+
+    partitions = partition_records(api_data)
+    sizes = {}
+    logger.info("Pushing {} daily partitions to s3".format(len(partitions)))
+    try:
+        for date_str, records in partitions.items():
+            body = encode_partition(records)
+            s3.put_object(Bucket=s3_bucket_name, Key=os.path.join(s3_prefix, partition_key(date_str)), Body=body,
+                          ContentType="application/x-ndjson", ContentEncoding="gzip")
+            sizes[date_str] = len(body)
+        # the manifest is written last so it only ever references partitions that exist
+        manifest = update_manifest(read_manifest_s3(s3_bucket_name, s3_prefix, s3), partitions, pull_date, sizes)
+        s3.put_object(Bucket=s3_bucket_name, Key=os.path.join(s3_prefix, MANIFEST_NAME), Body=json.dumps(manifest),
+                      ContentType="application/json")
+    except botoexceptions.ParamValidationError as e:
+        logger.error("There is an error in the parameters of the s3 write: {}".format(e))
+        sys.exit(1)
+    except Exception as e:
+        logger.error("Unexpected error in trying to write the raw data archive to s3: {}:{}".format(type(e).__name__, e))
+        sys.exit(1)
+
+    log_compression(api_data, sizes)
+    logger.info("COVID-19 API Data was successfully archived to s3 bucket under {}".format(s3_prefix))
+    return manifest
+
+
+def iter_local_partition(path):
+    """Streams the records of a local partition file, opening it only when iteration starts"""
+    with open(path, 'rb') as f:
+        yield from iter_partition_records(f)
+
+
+def iter_archive_local(archive_dir):
+    """
+    Streams the partitions listed in the manifest of a local archive, one at a time
+    Args:
+        archive_dir (str): local directory of the archive
+
+    Returns:
+        partitions (list of generator): one generator of raw API records per partition, oldest date first
+    """
+    manifest = read_manifest_local(archive_dir)
+    if manifest is None:
+        logger.error("No raw data archive found at {}. Run data_acquistion.py first or verify the path in the "
+                     "config.yml".format(archive_dir))
+        sys.exit(1)
+    return [iter_local_partition(os.path.join(archive_dir, manifest['partitions'][date_str]['key']))
+            for date_str in sorted(manifest['partitions'])]
+
+
+def read_archive_local(archive_dir):
+    """
+    Reads every partition listed in the manifest of a local archive
+    Args:
+        archive_dir (str): local directory of the archive
+
+    Returns:
+        records (list): raw API records of all partitions, oldest date first
+    """
+    return [record for partition in iter_archive_local(archive_dir) for record in partition]
+
+
+def iter_s3_partition(s3, s3_bucket_name, key):
+    """Streams the records of a partition in s3, requesting it only when iteration starts"""
+    s3_obj = s3.get_object(Bucket=s3_bucket_name, Key=key)
+    yield from iter_partition_records(s3_obj['Body'])
+
+
+def iter_archive_s3(s3_bucket_name, s3_prefix):
+    """
+    Streams the partitions listed in the manifest of an archive in s3, one at a time
+    Args:
+        s3_bucket_name (str): name of the s3 bucket containing the archive
+        s3_prefix (str): s3 path of the archive
+
+    Returns:
+        partitions (list of generator): one generator of raw API records per partition, oldest date first
+    """
+    try:
+        s3 = boto3.client("s3")
+    except botoexceptions.NoCredentialsError:
+        logger.error("Your AWS credentials were not found. Verify that they have been made available as detailed in "
+                     "readme instructions")
+        sys.exit(1)
+    manifest = read_manifest_s3(s3_bucket_name, s3_prefix, s3)
+    if manifest is None:
+        logger.error("No raw data archive found in s3 under {}. Run data_acquistion.py first or verify the path in the "
+                     "config.yml".format(s3_prefix))
+        sys.exit(1)
+    return [iter_s3_partition(s3, s3_bucket_name, os.path.join(s3_prefix, manifest['partitions'][date_str]['key']))
+            for date_str in sorted(manifest['partitions'])]
+
+
+def read_archive_s3(s3_bucket_name, s3_prefix):
+    """
+    Reads every partition listed in the manifest of an archive in s3
+    Args:
+        s3_bucket_name (str): name of the s3 bucket containing the archive
+        s3_prefix (str): s3 path of the archive
+
+    Returns:
+        records (list): raw API records of all partitions, oldest date first
+    """
+    return [record for partition in iter_archive_s3(s3_bucket_name, s3_prefix) for record in partition]
@@ -0,0 +1,166 @@
+import logging.config
+import numpy as np
+import pandas as pd
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Reconciliation of the country and global forecasts so that the global forecast is the sum of the country forecasts.
+
+The hierarchy is written as a summing matrix S (one row per series, global first, one column per country), the country
+forecasts as a matrix with one row per country and one column per forecast date, and every method is a single matrix
+expression over all countries and dates at once:
+
+    bottom_up:   S b                                  (no global model needed)
+    ols/wls_*:   S (S' W^-1 S)^-1 S' W^-1 y           (MinT with W = I, W = diag(S 1) or W = diag(holdout MSE))
+
+where y stacks the base global and country forecasts. A diagonal W is applied by broadcasting, never as an n x n matrix.
+"""
+
+METHODS = ['bottom_up', 'ols', 'wls_struct', 'wls_var']
+
+
+def summing_matrix(n_bottom):
+    """
+    Summing matrix of a two level hierarchy (global over n_bottom countries)
+    Args:
+        n_bottom (int): number of countries
+
+    Returns:
+        S (numpy array): (n_bottom + 1) x n_bottom, the global row of ones followed by the identity
+    """
+    return np.vstack([np.ones((1, n_bottom)), np.eye(n_bottom)])
+
+
+def forecast_matrix(forecast_df, series_column='country', date_column='Date', value_column='confirmed_cases_forecast'):
+    """
+    Pivots long forecasts to a series x date matrix
+    Args:
+        forecast_df (pandas DataFrame): one row per series and date
+        series_column (str): column naming the series
+        date_column (str): column of the forecast dates
+        value_column (str): column of the forecasts
+
+    Returns:
+        series (list): series names, in row order
+        dates (list): forecast dates, in column order
+        matrix (numpy array): forecasts, len(series) x len(dates)
+
+    Raises:
+        ValueError: if a series is missing a forecast for one of the dates
+    """
+    wide = forecast_df.pivot(index=series_column, columns=date_column, values=value_column)
+    if wide.isna().any().any():
+        raise ValueError("Every series needs a forecast for the same dates to be reconciled")
+    return list(wide.index), list(wide.columns), wide.to_numpy(dtype=float)
+
+
+def bottom_up(bottom, S):
+    """
+    Coherent forecasts of every series from the country forecasts alone
+    Args:
+        bottom (numpy array): country forecasts, n_bottom x h
+        S (numpy array): summing matrix
+
+    Returns:
+        forecasts (numpy array): n x h forecasts of every series (rows of S)
+    """
+    return S @ bottom
+
+
+def mint(base, S, W):
+    """
+    Minimum trace (MinT) reconciliation: the coherent forecasts closest to the base forecasts in the W^-1 norm
+    Args:
+        base (numpy array): base forecasts of every series, n x h (rows of S)
+        S (numpy array): summing matrix, n x n_bottom
+        W (numpy array): covariance of the base forecast errors, n x n, or its diagonal as a vector of length n
+
+    Returns:
+        forecasts (numpy array): n x h reconciled forecasts
+    """
+    W = np.asarray(W, dtype=float)
+    if W.ndim == 1:
+        Winv_S = S / W[:, None]
+    else:
+        Winv_S = np.linalg.solve(W, S)
+    # G = (S' W^-1 S)^-1 S' W^-1 maps the base forecasts of every series to reconciled country forecasts
+    G = np.linalg.solve(S.T @ Winv_S, Winv_S.T)
+    return S @ (G @ base)
+
+
+def error_variances(series, global_variance, bottom_variances):
+    """
+    Diagonal of W for 'wls_var' from the holdout MSEs recorded at training time. Countries without a finite MSE get the
+    median of the others, and a missing global MSE is taken as the sum of the country MSEs.
+    Args:
+        series (list): country names, in row order
+        global_variance (float): holdout MSE of the global model, may be None
+        bottom_variances (dict): country -> holdout MSE
+
+    Returns:
+        variances (numpy array): length len(series) + 1, global first
+    """
+    bottom = np.array([bottom_variances.get(name) if bottom_variances.get(name) is not None else np.nan
+                       for name in series], dtype=float)
+    bottom[~np.isfinite(bottom) | (bottom <= 0)] = np.nan
+    fill = np.nanmedian(bottom) if np.isfinite(bottom).any() else 1.
+    bottom = np.where(np.isnan(bottom), fill, bottom)
+    if global_variance is None or not np.isfinite(global_variance) or global_variance <= 0:
+        global_variance = bottom.sum()
+    return np.concatenate([[global_variance], bottom])
+
+
+def reconcile(country_forecast_df, method='bottom_up', global_forecast_df=None, global_variance=None,
+              country_variances=None):
+    """
+    Reconciles the country forecasts with the global forecast
+    Args:
+        country_forecast_df (pandas DataFrame): country, Date and confirmed_cases_forecast of every country
+        method (str): one of METHODS
+        global_forecast_df (pandas DataFrame): Date and confirmed_cases_forecast of the global model, required for every
+            method but bottom_up
+        global_variance (float): holdout MSE of the global model ('wls_var' only)
+        country_variances (dict): country -> holdout MSE ('wls_var' only)
+
+    Returns:
+        global_forecast_df (pandas DataFrame): Date and confirmed_cases_forecast, the sum of the country forecasts
+        country_forecast_df (pandas DataFrame): country, Date and confirmed_cases_forecast, reconciled
+
+    Raises:
+        ValueError: for an unknown method, or a method other than bottom_up without a global forecast
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown reconciliation method {}, expected one of {}".format(method, METHODS))
+    countries, dates, bottom = forecast_matrix(country_forecast_df)
+    S = summing_matrix(len(countries))
+
+    if method != 'bottom_up':
+        if global_forecast_df is None:
+            raise ValueError("Reconciliation method {} needs the global model's forecast".format(method))
+        global_base = global_forecast_df.set_index('Date')['confirmed_cases_forecast'].reindex(dates)
+        if global_base.isna().any():
+            raise ValueError("The global forecast does not cover the dates of the country forecasts")
+        base = np.vstack([global_base.to_numpy(dtype=float)[None, :], bottom])
+        if method == 'ols':
+            W = np.ones(len(S))
+        elif method == 'wls_struct':
+            # variance proportional to the number of countries a series sums
+            W = S.sum(axis=1)
+        else:
+            W = error_variances(countries, global_variance, country_variances or {})
+        # reconciled cumulative case counts can dip below zero for countries with few cases
+        bottom = np.clip(mint(base, S, W)[1:], 0, None)
+        adjustment = np.abs(bottom.sum(axis=0) - base[0]).max()
+        logger.info("Reconciled {} country forecasts with the global forecast ({}), largest global adjustment {:.0f} "
+                    "cases".format(len(countries), method, adjustment))
+
+    # forecasts are whole cases: round the countries, then sum the rounded values so the hierarchy adds up exactly
+    bottom = np.round(bottom)
+    country_forecast_df = pd.DataFrame({'country': np.repeat(countries, len(dates)),
+                                        'Date': np.tile(np.array(dates, dtype=object), len(countries)),
+                                        'confirmed_cases_forecast': bottom.ravel()})
+    global_forecast_df = pd.DataFrame({'Date': dates, 'confirmed_cases_forecast': bottom_up(bottom, S)[0]})
+    return global_forecast_df, country_forecast_df
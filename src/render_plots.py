@@ -0,0 +1,250 @@
+import sys
+import os
+import re
+import json
+import hashlib
+import argparse
+import logging.config
+import yaml
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import helper
+import instrumentation
+import static_assets
+import generate_trend_plots as gtp
+import generate_forecast_plots as gfp
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Render farm for the webapp's plot artifacts. The data for every plot is queried up front (a handful of queries rather
+than one per country), the plots are rendered on a process pool and each html file is written atomically. A manifest
+(render_manifest.json) records the sha256 of every artifact so unchanged plots are not rewritten and the app can tell
+which files are current. Every artifact is also published as a fingerprinted, precompressed asset (see static_assets.py).
+"""
+
+MANIFEST_NAME = "render_manifest.json"
+
+
+def country_plot_filename(country, country_subdir="country_forecasts"):
+    """
+    Relative filename (without extension) of the pre-rendered forecast plot for a country
+    Args:
+        country (str): country name, any case
+        country_subdir (str): directory under the static path holding the country plots
+
+    Returns:
+        filename (str): e.g. 'country_forecasts/united_states_of_america'
+    """
+    slug = re.sub(r'[^a-z0-9]+', '_', country.lower()).strip('_')
+    return "{}/{}".format(country_subdir, slug)
+
+
+def get_country_plot_data(engine_string, recent_days=14):
+    """
+    Queries the forecasts and recent confirmed cases for every country at once
+    Args:
+        engine_string (str): sqlalchemy string for connection to desired database
+        recent_days (int): number of most recent days of confirmed cases shown before the forecast
+
+    Returns:
+        forecast_df (pandas DataFrame): country_covid_forecast table
+        recent_df (pandas DataFrame): confirmed cases by Country and Date over the recent days
+    """
+    forecast_df = helper.get_data_from_database("""SELECT * FROM country_covid_forecast""", engine_string)
+    # sometimes the 'country' column is capitilized in RDS and other times it isnt
+    forecast_df = forecast_df.rename(columns={'Country': 'country'})
+
+    max_date_df = helper.get_data_from_database("""SELECT MAX(Date) AS Max_Date FROM country_covid_daily_cases""",
+                                                engine_string)
+    # a few days of slack as not every country reports every day
+    since_date = (pd.to_datetime(max_date_df['Max_Date'][0]) - pd.Timedelta(days=recent_days + 7)).strftime('%Y-%m-%d')
+    query = """SELECT Country, Date, SUM(Confirmed) AS Confirmed FROM country_covid_daily_cases WHERE Date >= '{}'
+               GROUP BY Country, Date""".format(since_date)
+    recent_df = helper.get_data_from_database(query, engine_string)
+    recent_df = recent_df.sort_values(['Country', 'Date']).groupby('Country').tail(recent_days)
+    instrumentation.add_rows(len(forecast_df) + len(recent_df))
+    return forecast_df, recent_df
+
+
+def get_country_jobs(forecast_df, recent_df, country_subdir="country_forecasts"):
+    """
+    Builds a render job for each country that has a forecast
+    Args:
+        forecast_df (pandas DataFrame): country forecasts, from get_country_plot_data
+        recent_df (pandas DataFrame): recent confirmed cases by country, from get_country_plot_data
+        country_subdir (str): directory under the static path holding the country plots
+
+    Returns:
+        jobs (list of dict): render jobs for render_artifact
+    """
+    recent_by_country = {country: df for country, df in recent_df.groupby('Country')}
+    jobs = []
+    for country, country_forecast_df in forecast_df.groupby('country'):
+        if country not in recent_by_country:
+            logger.warning("No recent case data for {}, skipping its forecast plot".format(country))
+            continue
+        jobs.append({'name': country_plot_filename(country, country_subdir), 'kind': 'forecast',
+                     'args': {'forecast_df': country_forecast_df.reset_index(drop=True),
+                              'cases_df_plot': recent_by_country[country].reset_index(drop=True),
+                              'title': "Recent Confirmed Cases and Forecast for {}".format(country)}})
+    return jobs
+
+
+def render_html(job):
+    """
+    Renders the html for a job
+    Args:
+        job (dict): render job with 'name', 'kind' and 'args'
+
+    Returns:
+        html (str): html of the plot
+    """
+    if job['kind'] == 'global_cases':
+        return gtp.generate_global_line_plot(**job['args'])
+    if job['kind'] == 'global_animation':
+        return gtp.generate_world_time_lapse(**job['args'])
+    if job['kind'] == 'forecast':
+        fig = gfp.generate_forecast_plot(job['args']['forecast_df'], job['args']['cases_df_plot'])
+        if job['args'].get('title') is not None:
+            fig.update_layout(title=job['args']['title'])
+        # a fixed div id keeps the html (and so its hash) the same when the data has not changed
+        return gfp.get_html(fig, div_id=os.path.basename(job['name']))
+    raise ValueError("Unknown render job kind {}".format(job['kind']))
+
+
+def render_artifact(job, local_path, previous_sha256=None):
+    """
+    Renders one artifact and writes it to local_path unless its content is unchanged. Runs in the worker processes.
+    Args:
+        job (dict): render job with 'name', 'kind' and 'args'
+        local_path (str): directory the html files are written to
+        previous_sha256 (str): hash of the artifact from the last render, if any
+
+    Returns:
+        record (dict): name, path, sha256, bytes, whether the file was written and its asset manifest entry
+    """
+    content = render_html(job).encode('utf-8')
+    sha256 = hashlib.sha256(content).hexdigest()
+    path = os.path.join(local_path, "{}.html".format(job['name']))
+    written = sha256 != previous_sha256 or not os.path.exists(path)
+    if written:
+        static_assets.write_atomic(path, content)
+    asset = static_assets.publish_asset(content, "{}.html".format(job['name']), local_path)
+    return {'name': job['name'], 'path': path, 'sha256': sha256, 'bytes': len(content), 'written': written,
+            'asset': asset}
+
+
+def read_manifest(local_path):
+    """
+    Reads the render manifest in local_path
+    Args:
+        local_path (str): directory the html files are written to
+
+    Returns:
+        manifest (dict): artifact name -> record, empty if there is no manifest yet
+    """
+    try:
+        with open(os.path.join(local_path, MANIFEST_NAME)) as f:
+            return json.load(f)['artifacts']
+    except (FileNotFoundError, ValueError, KeyError):
+        return {}
+
+
+def render_artifacts(jobs, local_path, max_workers=None):
+    """
+    Renders jobs on a process pool, writes the changed artifacts and updates the manifest
+    Args:
+        jobs (list of dict): render jobs
+        local_path (str): directory the html files are written to
+        max_workers (int): number of worker processes, defaults to the number of cpus
+
+    Returns:
+        records (list of dict): one record per successfully rendered artifact
+    """
+    manifest = read_manifest(local_path)
+    records = []
+    failed = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(render_artifact, job, local_path, manifest.get(job['name'], {}).get('sha256')):
+                   job['name'] for job in jobs}
+        for future in as_completed(futures):
+            try:
+                records.append(future.result())
+            except Exception as e:
+                logger.error("Rendering {} failed: {}:{}".format(futures[future], type(e).__name__, e))
+                failed.append(futures[future])
+
+    for record in records:
+        manifest[record['name']] = {k: record[k] for k in ['path', 'sha256', 'bytes']}
+    static_assets.write_atomic(os.path.join(local_path, MANIFEST_NAME),
+                 json.dumps({'generated': pd.Timestamp.now().isoformat(), 'artifacts': manifest}, indent=1,
+                            sort_keys=True).encode('utf-8'))
+    # the asset manifest is only updated here, in the parent process, so concurrent workers never race on it
+    static_assets.update_asset_manifest(local_path, [record['asset'] for record in records])
+    instrumentation.add_rows(len(records))
+    logger.info("Rendered {} plots ({} changed, {} failed)".format(len(records), sum(r['written'] for r in records),
+                                                                  len(failed)))
+    if len(failed) > 0:
+        logger.error("The following plots could not be rendered: {}".format(", ".join(sorted(failed))))
+        sys.exit(1)
+    return records
+
+
+@instrumentation.timed('run_render_plots')
+def run_render_plots(args):
+    """
+    Wrapper function to render every plot artifact of the webapp
+    Args:
+        args: from argparse
+           - config (str): Path to yaml file with render_plots as a top level key containing relevant configurations
+           - engine_string (str): sqlalchemy engine string argument can be entered
+           - s3_flag (bool): the flag used to determine if the plots are also saved to s3
+           - rebuild_time_lapse (bool): rebuild every time-lapse frame instead of appending to the frame cache
+
+    Returns:
+        None -- wrapper function
+    """
+    try:
+        with open(args.config, "r") as f:
+            config = yaml.load(f,Loader=yaml.FullLoader)
+    except IOError:
+        logger.error("Could not read in the config file--verify correct filename/path.")
+        sys.exit(1)
+    render_config = config['render_plots']
+
+    # global plots query the database themselves inside the worker
+    jobs = [{'name': 'global_animation', 'kind': 'global_animation',
+             'args': dict(engine_string=args.engine_string, rebuild=args.rebuild_time_lapse,
+                          **config['generate_trend_plots']['generate_world_time_lapse'])},
+            {'name': 'global_cases', 'kind': 'global_cases', 'args': {'engine_string': args.engine_string}},
+            {'name': 'global_cases_forecast', 'kind': 'forecast',
+             'args': {'forecast_df': gfp.get_global_forecasted_data(args.engine_string),
+                      'cases_df_plot': gfp.get_recent_global_confirmed_data(args.engine_string)}}]
+    forecast_df, recent_df = get_country_plot_data(args.engine_string, render_config['recent_days'])
+    jobs.extend(get_country_jobs(forecast_df, recent_df, render_config['country_subdir']))
+
+    records = render_artifacts(jobs, render_config['local_path'], render_config['max_workers'])
+
+    if args.s3_flag == True:
+        for record in records:
+            with open(record['path']) as f:
+                gfp.save_html_to_s3(render_config['s3_bucket_name'], render_config['s3_output_path'], f.read(),
+                                    record['name'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render every plot used by the webapp on a process pool.')
+    parser.add_argument('--config', '-c', default = 'config.yml', help='path to yaml file with configurations')
+    parser.add_argument("--engine_string", default=None, help="Optional engine string for db to add data to ")
+    parser.add_argument("--s3", dest='s3_flag', action='store_true', help="Use arg if you want to save s3 as well as locally.")
+    parser.add_argument("--rebuild_time_lapse", action='store_true',
+                        help="Use arg to rebuild every time-lapse frame rather than only the new dates.")
+
+    args = parser.parse_args()
+
+    run_render_plots(args)
+
+    logger.info("render_plots.py was run successfully.")
@@ -0,0 +1,77 @@
+import logging.config
+import numpy as np
+import pandas as pd
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Column types of the daily case frames built by data_preparation.py. Only the columns the pipeline uses are kept when the
+raw API records are parsed (CountryCode, City, CityCode, Lat and Lon are dropped), names are stored as categoricals
+(an int code per row instead of a python string) and the counts as int32.
+"""
+
+# raw API fields read into the case frames, every other field is dropped at parse time
+RAW_COLUMNS = ['Country', 'Province', 'Confirmed', 'Deaths', 'Recovered', 'Date']
+CATEGORY_COLUMNS = ['Country', 'Province']
+COUNT_COLUMNS = ['Confirmed', 'Deaths', 'Recovered', 'Active']
+COUNT_DTYPE = 'int32'
+
+
+def parse_records(covid_data):
+    """
+    Builds a typed DataFrame from raw API records, keeping only RAW_COLUMNS
+    Args:
+        covid_data (list): raw API records, one dict per country/province/city and date
+
+    Returns:
+        df (pandas DataFrame): typed DataFrame of the records (see apply_schema)
+    """
+    df = pd.DataFrame.from_records(([record[column] for column in RAW_COLUMNS] for record in covid_data),
+                                   columns=RAW_COLUMNS)
+    # Active cases data is just 0 throughout the API data, thus replace with manual computation
+    df['Active'] = df['Confirmed'] - df['Deaths'] - df['Recovered']
+    return apply_schema(df)
+
+
+def downcast_counts(series):
+    """
+    Casts a count column to COUNT_DTYPE, leaving it as is if its values do not fit
+    Args:
+        series (pandas Series): integer counts
+
+    Returns:
+        series (pandas Series): the counts as COUNT_DTYPE where possible
+    """
+    limits = np.iinfo(COUNT_DTYPE)
+    if len(series) > 0 and (series.min() < limits.min or series.max() > limits.max):
+        logger.warning("Column {} does not fit in {}, keeping it as {}".format(series.name, COUNT_DTYPE, series.dtype))
+        return series
+    return series.astype(COUNT_DTYPE)
+
+
+def apply_schema(df):
+    """
+    Applies the case frame column types to the columns of df that have one: categorical names, COUNT_DTYPE counts and
+    datetime dates
+    Args:
+        df (pandas DataFrame): raw or aggregated case data
+
+    Returns:
+        df (pandas DataFrame): the same DataFrame with its columns converted
+    """
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    for column in COUNT_COLUMNS:
+        if column in df.columns:
+            df[column] = downcast_counts(df[column])
+    if 'Date' in df.columns:
+        df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+
+def memory_usage_mb(df):
+    """Memory used by a DataFrame in MB, including the python strings of object columns"""
+    return df.memory_usage(deep=True).sum() / 2 ** 20
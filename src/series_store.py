@@ -0,0 +1,138 @@
+import json
+import logging.config
+import os
+import shutil
+import tempfile
+import numpy as np
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Shared store of many series (e.g. the confirmed cases of every country) for process pools. The values of all series
+are written once into a single contiguous float64 array in a memory mapped file, with an offsets index:
+
+    <directory>/values.npy    every series, one after the other
+    <directory>/offsets.npy   series i is values[offsets[i]:offsets[i + 1]]
+    <directory>/names.json    name of each series, so a series is read by name or by position
+
+A store pickles as its directory alone, so a task sent to a worker process costs a few bytes whatever the length of
+the series. Each process maps the files once and reads a series as a read-only view of the mapping: no copy, and the
+pages are shared through the OS page cache, so adding workers does not multiply the memory used by the data.
+
+    with SeriesStore.create(names, series) as store:
+        pool.map(fit, [(store, name) for name in names])   # the worker reads store[name]
+"""
+
+# stores mapped in this process, by directory
+_mapped = {}
+
+
+class SeriesStore:
+    """Memory mapped store of named 1-D float series"""
+
+    def __init__(self, directory, owner=False):
+        """
+        Args:
+            directory (str): directory the store was created in (see create)
+            owner (bool): close removes the directory
+        """
+        self.directory = directory
+        self.owner = owner
+
+    @classmethod
+    def create(cls, names, series, directory=None):
+        """
+        Writes series to a new store
+        Args:
+            names (list): name of each series (e.g. the country), unique
+            series (list): array-likes of numbers, one per name
+            directory (str): optional empty directory to write to, a new temporary directory by default
+
+        Returns:
+            store (SeriesStore): the store, owning the directory
+
+        Raises:
+            ValueError: if there is not one series per name or the names are not unique
+        """
+        names = [str(name) for name in names]
+        if len(names) != len(series):
+            raise ValueError("Expected one series per name, got {} names and {} series".format(len(names), len(series)))
+        if len(set(names)) != len(names):
+            raise ValueError("Series names must be unique")
+        series = [np.asarray(y, dtype=np.float64).ravel() for y in series]
+        offsets = np.zeros(len(series) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(y) for y in series])
+
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='series_store_')
+        else:
+            os.makedirs(directory, exist_ok=True)
+        # each series is copied straight into the file, without first concatenating them in memory
+        values = np.lib.format.open_memmap(os.path.join(directory, 'values.npy'), mode='w+', dtype=np.float64,
+                                           shape=(int(offsets[-1]),))
+        for i, y in enumerate(series):
+            values[offsets[i]:offsets[i + 1]] = y
+        values.flush()
+        del values
+        np.save(os.path.join(directory, 'offsets.npy'), offsets)
+        with open(os.path.join(directory, 'names.json'), 'w') as f:
+            json.dump(names, f)
+        logger.debug("Wrote {} series ({} values) to the series store {}".format(len(names), offsets[-1], directory))
+        return cls(directory, owner=True)
+
+    def _map(self):
+        """Memory maps the store in this process once, (values, offsets, index of the names)"""
+        if self.directory not in _mapped:
+            with open(os.path.join(self.directory, 'names.json')) as f:
+                names = json.load(f)
+            _mapped[self.directory] = (np.load(os.path.join(self.directory, 'values.npy'), mmap_mode='r'),
+                                       np.load(os.path.join(self.directory, 'offsets.npy')),
+                                       {name: i for i, name in enumerate(names)})
+        return _mapped[self.directory]
+
+    @property
+    def names(self):
+        """Name of each series, in store order"""
+        return list(self._map()[2])
+
+    def __len__(self):
+        return len(self._map()[2])
+
+    def __getitem__(self, key):
+        """
+        A series of the store, as a read-only view of the memory mapped values
+        Args:
+            key (str or int): name or position of the series
+
+        Returns:
+            y (numpy array): the series
+
+        Raises:
+            KeyError: for a name or position that is not in the store
+        """
+        values, offsets, index = self._map()
+        i = key if isinstance(key, (int, np.integer)) else index.get(key)
+        if i is None or not 0 <= i < len(offsets) - 1:
+            raise KeyError("No series {} in the series store {}".format(key, self.directory))
+        return values[offsets[i]:offsets[i + 1]]
+
+    def __getstate__(self):
+        # only the directory goes to the worker processes, which map the files themselves; a copy never owns them
+        return {'directory': self.directory, 'owner': False}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def close(self):
+        """Unmaps the store in this process, and removes its files if this is the store that created them"""
+        _mapped.pop(self.directory, None)
+        if self.owner:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
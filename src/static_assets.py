@@ -0,0 +1,246 @@
+import gzip
+import hashlib
+import json
+import logging.config
+import os
+try:
+    import brotli
+except ImportError:
+    # brotli is optional: without it only the .gz variants are written
+    brotli = None
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+"""
+Fingerprinted, precompressed copies of the generated files the webapp loads from app/static. Each file is published as
+
+    <static dir>/global_cases.3f2a9c1b07de.html      (name + first 12 characters of the content sha256)
+    <static dir>/global_cases.3f2a9c1b07de.html.gz
+    <static dir>/global_cases.3f2a9c1b07de.html.br   (if brotli is installed)
+
+and asset_manifest.json maps the plain name to the current fingerprinted file. A fingerprinted file never changes, so it
+can be served with a long cache lifetime; a new version gets a new name and the manifest points the page at it.
+"""
+
+ASSET_MANIFEST_NAME = "asset_manifest.json"
+# encodings in order of preference, with the suffix of their precompressed variant
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def write_atomic(path, content):
+    """
+    Writes content to path through a temporary file and a rename so readers never see a partially written file
+    Args:
+        path (str): destination path
+        content (bytes): file content
+
+    Returns:
+        None -- writes the file
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def fingerprint_name(logical_name, content):
+    """
+    Fingerprinted filename for a file's content
+    Args:
+        logical_name (str): plain filename relative to the static dir, e.g. 'global_cases.html'
+        content (bytes): file content
+
+    Returns:
+        filename (str): e.g. 'global_cases.3f2a9c1b07de.html'
+    """
+    root, ext = os.path.splitext(logical_name)
+    return "{}.{}{}".format(root, hashlib.sha256(content).hexdigest()[:12], ext)
+
+
+def publish_asset(content, logical_name, static_dir):
+    """
+    Writes the fingerprinted file for content along with its precompressed variants. Does not touch the manifest, so it
+    is safe to call from several processes at once; pass the returned entries to update_asset_manifest.
+    Args:
+        content (bytes or str): file content
+        logical_name (str): plain filename relative to the static dir, e.g. 'global_cases.html'
+        static_dir (str): directory the webapp serves static files from
+
+    Returns:
+        entry (dict): manifest entry with the fingerprinted filename, sha256 and size of each variant
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    filename = fingerprint_name(logical_name, content)
+    path = os.path.join(static_dir, filename)
+    entry = {'name': logical_name, 'file': filename, 'sha256': hashlib.sha256(content).hexdigest(),
+             'bytes': len(content)}
+
+    variants = {'': content}
+    # mtime=0 keeps the gzip output identical for identical content
+    variants['.gz'] = gzip.compress(content, compresslevel=9, mtime=0)
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    for suffix, body in variants.items():
+        # the name is derived from the content so an existing file is already correct
+        if not os.path.exists(path + suffix):
+            write_atomic(path + suffix, body)
+        if suffix:
+            entry['{}_bytes'.format(suffix[1:])] = len(body)
+    return entry
+
+
+def read_asset_manifest(static_dir):
+    """
+    Reads the asset manifest of a static dir
+    Args:
+        static_dir (str): directory the webapp serves static files from
+
+    Returns:
+        manifest (dict): plain filename -> manifest entry, empty if there is no manifest yet
+    """
+    try:
+        with open(os.path.join(static_dir, ASSET_MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def remove_asset_files(static_dir, filename):
+    """Removes a fingerprinted file and its compressed variants"""
+    for suffix in ['', '.gz', '.br']:
+        try:
+            os.remove(os.path.join(static_dir, filename + suffix))
+        except FileNotFoundError:
+            pass
+
+
+def update_asset_manifest(static_dir, entries):
+    """
+    Points the manifest at newly published files. The version each entry replaces is kept (for pages that are still
+    loading it) and the one before that is deleted.
+    Args:
+        static_dir (str): directory the webapp serves static files from
+        entries (list of dict): entries returned by publish_asset
+
+    Returns:
+        manifest (dict): the updated manifest
+    """
+    manifest = read_asset_manifest(static_dir)
+    for entry in entries:
+        entry = dict(entry)
+        current = manifest.get(entry['name'])
+        if current is not None and current['file'] != entry['file']:
+            if current.get('previous') not in (None, entry['file']):
+                remove_asset_files(static_dir, current['previous'])
+            entry['previous'] = current['file']
+        elif current is not None:
+            entry['previous'] = current.get('previous')
+        manifest[entry['name']] = entry
+    write_atomic(os.path.join(static_dir, ASSET_MANIFEST_NAME),
+                 json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def publish_assets(static_dir, assets):
+    """
+    Publishes files and updates the manifest in one go, for callers that run in a single process
+    Args:
+        static_dir (str): directory the webapp serves static files from
+        assets (dict): plain filename -> content (bytes or str)
+
+    Returns:
+        manifest (dict): the updated manifest
+    """
+    entries = [publish_asset(content, logical_name, static_dir) for logical_name, content in assets.items()]
+    for entry in entries:
+        logger.info("Published {} as {} ({} bytes, {} gzipped)".format(entry['name'], entry['file'], entry['bytes'],
+                                                                         entry['gz_bytes']))
+    return update_asset_manifest(static_dir, entries)
+
+
+def parse_accept_encoding(accept_encoding):
+    """
+    Parses an Accept-Encoding header into the q-value of each content coding
+    Args:
+        accept_encoding (str): Accept-Encoding header of a request, e.g. 'br;q=0, gzip;q=0.8, *'
+
+    Returns:
+        accepted (dict): content coding (lower case, '*' for any other) -> q-value, 0 for a coding that is refused
+    """
+    accepted = {}
+    for value in accept_encoding.lower().split(','):
+        params = [param.strip() for param in value.split(';')]
+        if params[0] == '':
+            continue
+        q = 1.
+        for param in params[1:]:
+            name, _, number = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(number)
+                except ValueError:
+                    # a malformed q-value is treated as a refusal rather than guessed at
+                    q = 0.
+        accepted[params[0]] = q
+    return accepted
+
+
+def choose_variant(static_dir, filename, accept_encoding):
+    """
+    Picks the precompressed variant of a file to serve for a request's Accept-Encoding header
+    Args:
+        static_dir (str): directory the webapp serves static files from
+        filename (str): requested (fingerprinted) filename
+        accept_encoding (str): Accept-Encoding header of the request
+
+    Returns:
+        filename (str): file to send
+        encoding (str or None): Content-Encoding of that file, None for the uncompressed file
+    """
+    accepted = parse_accept_encoding(accept_encoding)
+    candidates = []
+    for preference, (encoding, suffix) in enumerate(ENCODINGS):
+        q = accepted.get(encoding, accepted.get('*', 0.))
+        if q > 0 and os.path.exists(os.path.join(static_dir, filename + suffix)):
+            candidates.append((-q, preference, filename + suffix, encoding))
+    if len(candidates) == 0:
+        return filename, None
+    # the highest q-value wins, ties go to the order of ENCODINGS
+    _, _, variant, encoding = min(candidates)
+    return variant, encoding
+
+
+class AssetManifest:
+    """
+    Asset manifest for the webapp, re-read whenever the pipeline replaces the file so new plots show up without a
+    restart
+    """
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self.path = os.path.join(static_dir, ASSET_MANIFEST_NAME)
+        self.mtime = None
+        self.manifest = {}
+
+    def lookup(self, logical_name):
+        """
+        Fingerprinted filename for a plain filename
+        Args:
+            logical_name (str): plain filename relative to the static dir
+
+        Returns:
+            filename (str or None): the fingerprinted filename, None if the file has not been published
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+        if mtime != self.mtime:
+            self.manifest = read_asset_manifest(self.static_dir)
+            self.mtime = mtime
+        entry = self.manifest.get(logical_name)
+        return None if entry is None else entry['file']
@@ -4,10 +4,35 @@ import logging.config
 import data_acquistion as data_acq
 import data_preparation as data_prep
 import generate_trend_plots as gtp
+import sqlalchemy as sql
 import generate_forecast_plots as gfp
 import generate_forecasts as gf
 import train_models as tm
 import get_news as gn
+import instrumentation
+import baseline_models
+import series_store
+import arima_serializer
+import raw_archive
+import render_plots
+import static_assets
+import country_index
+import write_behind
+import query_cache
+import model_registry
+import artifact_cache
+import forecast_pipeline
+import reconciliation
+import forecast_metrics
+import backtest
+import schema
+import chunked_preparation
+import hierarchy
+from create_database import User_App_Inputs
+import pickle
+import time
+import helper
+import shutil
 import pytest
 import pandas as pd
 import plotly
@@ -15,8 +40,18 @@ import _plotly_utils
 import statsmodels
 import numpy
 import os
+import warnings
+import gzip
+import hashlib
+import threading
+import functools
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import botocore.exceptions as botoexceptions
+import io
 from statsmodels.tsa.arima_model import ARIMAResults
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 
 logging.config.fileConfig(fname="local.conf")
@@ -50,6 +85,75 @@ def test_write_to_local():
         data_acq.write_data_to_local(dict1,"unhappy_test.json")
     logger.info("data_acquistion function write_to_local unhappy path unit test is successful")
 
+class StubCovidAPIHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the COVID19API and newsAPI used to test the concurrent fetch"""
+    # number of requests seen per path, used to fail the first request to some paths
+    request_counts = {}
+    responses = {
+        '/countries': [{'Country': 'Armenia', 'Slug': 'armenia'}, {'Country': 'Belgium', 'Slug': 'belgium'}],
+        '/country/armenia': [{'Country': 'Armenia', 'CountryCode': 'AM', 'Province': '', 'City': '', 'CityCode': '',
+                              'Lat': '40.07', 'Lon': '45.04', 'Confirmed': 1013, 'Deaths': 13, 'Recovered': 197,
+                              'Active': 803, 'Date': '2020-04-12T00:00:00Z'}],
+        '/country/belgium': [{'Country': 'Belgium', 'CountryCode': 'BE', 'Province': '', 'City': '', 'CityCode': '',
+                              'Lat': '50.5', 'Lon': '4.47', 'Confirmed': 29647, 'Deaths': 3600, 'Recovered': 6463,
+                              'Active': 19584, 'Date': '2020-04-12T00:00:00Z'}],
+        '/news': {'status': 'ok', 'articles': [{'title': 'Test headline'}]},
+    }
+    # paths that fail with a 503 on their first request, and paths that always fail
+    flaky_paths = {'/country/belgium'}
+    broken_paths = set()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        self.request_counts[path] = self.request_counts.get(path, 0) + 1
+        if path in self.broken_paths or (path in self.flaky_paths and self.request_counts[path] == 1):
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = json.dumps(self.responses[path]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def test_acquire_data_concurrent():
+    """
+    Test the acquire_data_concurrent function in the data_acquisition.py script against a local stub HTTP server
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubCovidAPIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    fetch_args = {'max_concurrency': 2, 'max_retries': 2, 'backoff_seconds': 0.01, 'timeout_seconds': 5}
+    try:
+        #happy path: both countries are fetched (belgium after a retry) and the news is fetched alongside them
+        StubCovidAPIHandler.request_counts.clear()
+        api_data, news_path = data_acq.acquire_data_concurrent(base_url + '/countries', base_url + '/country/{slug}',
+                                                               'test_staging', False, '2020-04-12', '2020-04-01',
+                                                               news_request={'url': base_url + '/news', 'params': {}},
+                                                               fetch_args=fetch_args)
+        assert sorted(record['Country'] for record in api_data) == ['Armenia', 'Belgium']
+        assert StubCovidAPIHandler.request_counts['/country/belgium'] == 2
+        with open(news_path) as f:
+            assert gn.get_articles(f.read()) == [{'title': 'Test headline'}]
+        logger.info("data_acquistion function acquire_data_concurrent happy path unit test is successful")
+
+        #unhappy path: a country that keeps failing past the retries should trigger a sys.exit(), assert this
+        StubCovidAPIHandler.broken_paths.add('/country/armenia')
+        with pytest.raises(SystemExit):
+            data_acq.acquire_data_concurrent(base_url + '/countries', base_url + '/country/{slug}', 'test_staging',
+                                             False, '2020-04-12', '2020-04-01', fetch_args=fetch_args)
+        StubCovidAPIHandler.broken_paths.clear()
+        logger.info("data_acquistion function acquire_data_concurrent unhappy path unit test is successful")
+    finally:
+        server.shutdown()
+
 ############ TESTS FOR data_preparation.py functions ############
 def test_get_local_data():
     """
@@ -66,10 +170,12 @@ def test_get_local_data():
     # read the data using the function being tested
     data = data_prep.get_local_data(fname)
 
-    # create the expected output
-    test = pd.DataFrame(test_raw_data)
+    # create the expected output: unused columns dropped, names as categoricals and counts as int32
+    test = pd.DataFrame(test_raw_data)[['Country', 'Province', 'Confirmed', 'Deaths', 'Recovered', 'Date']]
     test['Active'] = test['Confirmed'] - test['Deaths'] - test['Recovered']
     test['Date'] = pd.to_datetime(test['Date'])
+    test = test.astype({'Country': 'category', 'Province': 'category', 'Confirmed': 'int32', 'Deaths': 'int32',
+                        'Recovered': 'int32', 'Active': 'int32'})
     # assert the two are equal
     assert(data.equals(test))
     logger.info("data_preparation function get_local_data happy path unit test is successful")
@@ -80,6 +186,39 @@ def test_get_local_data():
         data_prep.get_local_data(fake_path)
     logger.info("data_preparation function get_local_data unhappy path unit test is successful")
 
+def test_get_local_archive_data():
+    """
+    Test writing the raw data archive (raw_archive.py) and reading it back with get_local_archive_data
+    """
+    #happy path: archive two pulls, the second one revising a day of the first. Read back the archive and compare it
+    # against the single json file path for the same records
+    first_pull = [{'Country': 'Armenia','CountryCode': 'AM','Province': '','City': '','CityCode': '','Lat': '40.07',
+                   'Lon': '45.04','Confirmed': 1013,'Deaths': 13,'Recovered': 197,'Active': 803,
+                   'Date': '2020-04-12T00:00:00Z'},
+                  {'Country': 'Armenia','CountryCode': 'AM','Province': '','City': '','CityCode': '','Lat': '40.07',
+                   'Lon': '45.04','Confirmed': 1039,'Deaths': 14,'Recovered': 232,'Active': 793,
+                   'Date': '2020-04-13T00:00:00Z'}]
+    second_pull = [dict(first_pull[1], Confirmed=1040),
+                   dict(first_pull[1], Confirmed=1067, Date='2020-04-14T00:00:00Z')]
+    archive_dir = 'test_raw_archive'
+    shutil.rmtree(archive_dir, ignore_errors=True)
+    raw_archive.write_archive_local(first_pull, archive_dir, '2020-04-13')
+    manifest = raw_archive.write_archive_local(second_pull, archive_dir, '2020-04-14')
+    assert sorted(manifest['partitions']) == ['2020-04-12', '2020-04-13', '2020-04-14']
+    assert manifest['latest_pull'] == '2020-04-14' and manifest['latest_date'] == '2020-04-14'
+    assert raw_archive.read_manifest_local(archive_dir) == manifest
+
+    expected_records = [first_pull[0]] + second_pull
+    data_acq.write_data_to_local(expected_records, 'raw_test_data.json')
+    data = data_prep.get_local_archive_data(archive_dir)
+    assert data.equals(data_prep.get_local_data('raw_test_data.json'))
+    logger.info("data_preparation function get_local_archive_data happy path unit test is successful")
+
+    #unhappy path: a directory without an archive in it, should trigger a sys.exit(), assert this
+    with pytest.raises(SystemExit):
+        data_prep.get_local_archive_data('this/is/not/an/archive')
+    logger.info("data_preparation function get_local_archive_data unhappy path unit test is successful")
+
 def test_get_country_daily():
     """
     Test the get_country_daily function in the data_preparation.py function
@@ -104,13 +243,14 @@ def test_get_country_daily():
     test = pd.DataFrame(test_raw_data)
     test['Active'] = test['Confirmed'] - test['Deaths'] - test['Recovered']
     test['Date'] = pd.to_datetime(test['Date'])
-    china_df = test.loc[test['Country'] == 'China']
-    china_df = china_df.drop(columns=["Province", "City", "CityCode", "Lat", "Lon"])
+    columns = ['Country', 'Date', 'Confirmed', 'Deaths', 'Recovered', 'Active']
+    china_df = test.loc[test['Country'] == 'China', columns]
     china_df = china_df.groupby(['Country', 'Date']).sum().reset_index()
-    rest_of_the_world_df = test.loc[test['Province'] == '']
-    rest_of_the_world_df = rest_of_the_world_df.drop(columns=["Province", "City", "CityCode", "Lat", "Lon"])
+    rest_of_the_world_df = test.loc[test['Province'] == '', columns]
     rest_of_the_world_df = rest_of_the_world_df.groupby(['Country', 'Date']).sum().reset_index()
     test_country_df = pd.concat([rest_of_the_world_df, china_df])
+    test_country_df = test_country_df.astype({'Country': 'category', 'Confirmed': 'int32', 'Deaths': 'int32',
+                                              'Recovered': 'int32', 'Active': 'int32'})
 
     #assert expected output equals function output
     assert(country_df.equals(test_country_df))
@@ -141,7 +281,9 @@ def test_get_global_daily():
     test = pd.DataFrame(test_raw_data)
     test['Active'] = test['Confirmed'] - test['Deaths'] - test['Recovered']
     test['Date'] = pd.to_datetime(test['Date'])
-    test_global_df = test.groupby('Date').sum()[["Confirmed", "Recovered", "Active", "Deaths"]].reset_index()
+    test_global_df = test.groupby('Date')[["Confirmed", "Recovered", "Active", "Deaths"]].sum().reset_index()
+    test_global_df = test_global_df.astype({'Confirmed': 'int32', 'Recovered': 'int32', 'Active': 'int32',
+                                            'Deaths': 'int32'})
     assert(global_df.equals(test_global_df))
     logger.info("data_preparation function get_global_daily happy path unit test is successful")
 
@@ -150,6 +292,162 @@ def test_get_global_daily():
         data_prep.get_global_daily(test_raw_data)
     logger.info("data_preparation function get_global_daily unhappy path unit test is successful")
 
+############ TESTS FOR schema.py functions ############
+def test_parse_records():
+    """
+    Test parsing raw records into the compact typed DataFrame of schema.py and the memory report of data_preparation.py
+    """
+    #happy path: unused fields are dropped, names are categoricals and counts int32, and the country frame of a few
+    # hundred records is several times smaller than with pandas' default types
+    test_raw_data = []
+    for day in range(60):
+        for country in ['Armenia', 'Belgium', 'Cote d\'Ivoire', 'United States of America']:
+            test_raw_data.append({'Country': country, 'CountryCode': country[:2].upper(), 'Province': '', 'City': '',
+                                  'CityCode': '', 'Lat': '40.07', 'Lon': '45.04', 'Confirmed': 1000 + 10 * day,
+                                  'Deaths': day, 'Recovered': 5 * day, 'Active': 0,
+                                  'Date': (datetime(2020, 3, 1) + timedelta(days=day)).strftime('%Y-%m-%dT00:00:00Z')})
+    df = schema.parse_records(test_raw_data)
+    assert list(df.columns) == ['Country', 'Province', 'Confirmed', 'Deaths', 'Recovered', 'Date', 'Active']
+    assert isinstance(df['Country'].dtype, pd.CategoricalDtype) and len(df['Country'].cat.categories) == 4
+    assert all(df[column].dtype == 'int32' for column in schema.COUNT_COLUMNS)
+    assert df['Active'].iloc[-1] == 1590 - 59 - 295
+    usage = data_prep.report_memory_usage(test_raw_data)
+    assert usage['country'][0] > 3 * usage['country'][1]
+    assert usage['raw'][0] > usage['raw'][1]
+    logger.info("schema function parse_records happy path unit test is successful")
+
+    #unhappy path: counts that do not fit in int32 keep their type rather than overflowing, and a record missing a
+    # required field raises a KeyError
+    big = schema.apply_schema(pd.DataFrame({'Confirmed': [3 * 10 ** 9]}))
+    assert big['Confirmed'].dtype == 'int64' and big['Confirmed'].iloc[0] == 3 * 10 ** 9
+    with pytest.raises(KeyError):
+        schema.parse_records([{'Country': 'Armenia', 'Confirmed': 1013}])
+    logger.info("schema function parse_records unhappy path unit test is successful")
+
+############ TESTS FOR chunked_preparation.py functions ############
+def test_prepare_in_chunks():
+    """
+    Test the chunked (out-of-core) preparation mode against get_country_daily/get_global_daily on the same raw data
+    """
+    #happy path: raw data with city level rows, China's provinces and several countries, streamed in small batches
+    # through a small read buffer, gives the same daily tables as the in-memory path
+    test_raw_data = []
+    for day in range(5):
+        date = (datetime(2020, 4, 10) + timedelta(days=day)).strftime('%Y-%m-%dT00:00:00Z')
+        for i, country in enumerate(['Armenia', 'Belgium', 'United States of America']):
+            test_raw_data.append({'Country': country, 'CountryCode': 'XX', 'Province': '', 'City': '', 'CityCode': '',
+                                  'Lat': '0', 'Lon': '0', 'Confirmed': 100 * (i + 1) + day, 'Deaths': day,
+                                  'Recovered': 2 * day, 'Active': 0, 'Date': date})
+        for province in ['Hubei', 'Inner Mongolia']:
+            test_raw_data.append({'Country': 'China', 'CountryCode': 'CN', 'Province': province, 'City': '',
+                                  'CityCode': '', 'Lat': '0', 'Lon': '0', 'Confirmed': 50 + day, 'Deaths': 1,
+                                  'Recovered': day, 'Active': 0, 'Date': date})
+        test_raw_data.append({'Country': 'United States of America', 'CountryCode': 'US', 'Province': 'Illinois',
+                              'City': 'Cook', 'CityCode': '17031', 'Lat': '0', 'Lon': '0', 'Confirmed': 40 + day,
+                              'Deaths': 0, 'Recovered': 0, 'Active': 0, 'Date': date})
+    fname = 'raw_test_data.json'
+    data_acq.write_data_to_local(test_raw_data, fname)
+    expected_country = data_prep.get_country_daily(data_prep.get_local_data(fname))
+    expected_global = data_prep.get_global_daily(data_prep.get_local_data(fname))
+
+    writes = []
+    nbr_records = chunked_preparation.prepare_in_chunks([chunked_preparation.iter_json_file(fname, buffer_size=100)],
+                                                        lambda country_df, global_df: writes.append((country_df,
+                                                                                                     global_df)),
+                                                        batch_size=7)
+    assert nbr_records == len(test_raw_data) and len(writes) == 1
+    country_df = writes[0][0].sort_values(['Country', 'Date']).reset_index(drop=True)
+    expected_country = expected_country.sort_values(['Country', 'Date']).reset_index(drop=True)
+    assert country_df.astype({'Country': str}).equals(expected_country.astype({'Country': str}))
+    assert country_df['Confirmed'].dtype == 'int32'
+    assert writes[0][1].equals(expected_global)
+
+    # the archive is flushed once per partition (date), and the database tables and csv files are built incrementally
+    archive_dir = 'test_chunked_archive'
+    shutil.rmtree(archive_dir, ignore_errors=True)
+    raw_archive.write_archive_local(test_raw_data, archive_dir, '2020-04-14')
+    writes = []
+    chunked_preparation.prepare_in_chunks(raw_archive.iter_archive_local(archive_dir),
+                                          lambda country_df, global_df: writes.append(len(country_df)), batch_size=7)
+    assert writes == [4] * 5
+    engine_string = 'sqlite:///test_chunked.db'
+    config = {'data_preparation': {'raw_format': 'ndjson_gz', 'get_local_archive_data': {'archive_dir': archive_dir},
+                                   'chunked': {'batch_size': 7}},
+              'hierarchy': {'levels': [{'name': 'country', 'keys': ['Country'], 'table': 'country_covid_daily_cases',
+                                        'data_out': 'test_chunked_country.csv'},
+                                       {'name': 'global', 'keys': [], 'sum_of': 'country',
+                                        'table': 'global_covid_daily_cases', 'data_out': 'test_chunked_global.csv'}]}}
+    assert data_prep.prepare_in_chunks(config, engine_string) == len(test_raw_data)
+    db_country_df = helper.get_data_from_database("SELECT * FROM country_covid_daily_cases", engine_string)
+    assert len(db_country_df) == 20 and db_country_df['Confirmed'].sum() == expected_country['Confirmed'].sum()
+    assert len(pd.read_csv('test_chunked_global.csv', index_col=0)) == 5
+    logger.info("chunked_preparation function prepare_in_chunks happy path unit test is successful")
+
+    #unhappy path: a truncated json file raises a ValueError, and a missing raw file triggers a sys.exit()
+    with open('raw_test_data.json') as f:
+        truncated = f.read()[:-40]
+    with open('unhappy_test.json', 'w') as f:
+        f.write(truncated)
+    with pytest.raises(ValueError):
+        list(chunked_preparation.iter_json_file('unhappy_test.json', buffer_size=100))
+    config['data_preparation'].update({'raw_format': 'json',
+                                       'get_local_data': {'input_file_path': 'this/is/afake/path.json'}})
+    with pytest.raises(SystemExit):
+        data_prep.prepare_in_chunks(config, engine_string)
+    logger.info("chunked_preparation function prepare_in_chunks unhappy path unit test is successful")
+
+############ TESTS FOR hierarchy.py functions ############
+def test_hierarchy():
+    """
+    Test building the daily tables of every level of the region hierarchy from the hierarchy block of a config
+    """
+    #happy path: the country level gives the country table of get_country_daily (China summed from its provinces),
+    # the global level is the sum of the countries, and provinces are series named by country and province
+    test_config = {'hierarchy': {'levels': [
+        {'name': 'country', 'keys': ['Country'], 'filter': "Country == 'China' or Province == ''",
+         'table': 'country_covid_daily_cases', 'forecast_table': 'country_covid_forecast'},
+        {'name': 'global', 'keys': [], 'sum_of': 'country', 'table': 'global_covid_daily_cases'},
+        {'name': 'province', 'keys': ['Country', 'Province'], 'filter': "Province != ''",
+         'table': 'province_covid_daily_cases', 'forecast_table': 'province_covid_forecast'}]}}
+    test_raw_data = []
+    for day in range(3):
+        date = (datetime(2020, 4, 1) + timedelta(days=day)).strftime('%Y-%m-%dT00:00:00Z')
+        for country, province, confirmed in [('China', 'Hubei', 100), ('China', 'Beijing', 10), ('Canada', '', 50),
+                                             ('Canada', 'Ontario', 30), ('Canada', 'Quebec', 20), ('Armenia', '', 5)]:
+            test_raw_data.append({'Country': country, 'CountryCode': '', 'Province': province, 'City': '',
+                                  'CityCode': '', 'Lat': '0', 'Lon': '0', 'Confirmed': confirmed + day, 'Deaths': 1,
+                                  'Recovered': 2, 'Active': 0, 'Date': date})
+    raw_df = schema.parse_records(test_raw_data)
+    levels = hierarchy.get_levels(test_config)
+    daily = hierarchy.prepare_levels(raw_df, levels)
+    expected_country = data_prep.get_country_daily(raw_df).sort_values(['Country', 'Date'], ignore_index=True)
+    country_df = daily['country'].sort_values(['Country', 'Date'], ignore_index=True)
+    assert country_df[['Country', 'Date', 'Confirmed']].astype(str).equals(
+        expected_country[['Country', 'Date', 'Confirmed']].astype(str))
+    assert list(daily['global']['Confirmed']) == [165, 169, 173]
+    province_level = hierarchy.get_level(levels, 'province')
+    assert hierarchy.top_level(levels).name == 'global'
+    assert [level.name for level in hierarchy.series_levels(levels)] == ['country', 'province']
+    series_df = province_level.series_frame(daily['province'])
+    assert sorted(series_df['Country'].unique()) == ['Canada | Ontario', 'Canada | Quebec', 'China | Beijing',
+                                                      'China | Hubei']
+    forecast_df = province_level.forecast_frame(pd.DataFrame({'country': ['Canada | Ontario',
+                                                                          'United States of America | New York'],
+                                                              'Date': ['2020-04-04', '2020-04-04'],
+                                                              'confirmed_cases_forecast': [33, 45]}))
+    assert list(forecast_df.columns) == ['country', 'province', 'Date', 'confirmed_cases_forecast']
+    assert forecast_df.iloc[0]['country'] == 'Canada' and forecast_df.iloc[0]['province'] == 'Ontario'
+    assert list(forecast_df.iloc[1][['country', 'province']]) == ['United States of America', 'New York']
+    logger.info("hierarchy functions happy path unit test is successful")
+
+    #unhappy path: a level defined twice, a sum_of that is not another level, or an unknown field raises a ValueError
+    for bad_levels in [test_config['hierarchy']['levels'] + [test_config['hierarchy']['levels'][0]],
+                       [{'name': 'global', 'keys': [], 'sum_of': 'continent', 'table': 'global_covid_daily_cases'}],
+                       [{'name': 'country', 'keys': ['Country'], 'tabel': 'country_covid_daily_cases'}]]:
+        with pytest.raises(ValueError):
+            hierarchy.get_levels({'hierarchy': {'levels': bad_levels}})
+    logger.info("hierarchy functions unhappy path unit test is successful")
+
 ############ TESTS FOR generate_trend_plots.py function ############
 # ONLY 1 FUNCTION DOES NOT INTERACT WITH s3, API or a database
 def test_save_html_to_local():
@@ -171,7 +469,75 @@ def test_save_html_to_local():
     logger.info("generate_trend_plots function save_html_to_local unhappy path unit test is successful")
 
 
+def test_generate_world_time_lapse():
+    """
+    Test the generate_world_time_lapse function in the generate_trend_plots.py script
+    """
+    db_file = 'test_time_lapse.db'
+    cache_file = os.path.join('test_time_lapse_cache', 'frames.json')
+    for path in [db_file, cache_file]:
+        if os.path.exists(path):
+            os.remove(path)
+    engine_string = 'sqlite:///{}'.format(db_file)
+    dates = pd.date_range('2020-03-01', '2020-04-30')
+    test_df = pd.DataFrame({'Country': ['Spain', 'Italy'] * len(dates), 'Date': dates.repeat(2),
+                            'Confirmed': range(2 * len(dates)), 'Recovered': 0, 'Active': 0, 'Deaths': 0})
+    test_df.to_sql('country_covid_daily_cases', sql.create_engine(engine_string), index=False)
+
+    #happy path: the first run builds every frame, older history thinned to weekly frames
+    html = gtp.generate_world_time_lapse(engine_string, cache_file, full_resolution_days=14, older_frame_days=7)
+    cache = gtp.read_frame_cache(cache_file)
+    recent_dates = [d.strftime('%Y-%m-%d') for d in dates[-14:]]
+    assert all(d in cache['frames'] for d in recent_dates)
+    assert len(cache['frames']) < len(dates)
+    assert cache['latest_date'] == '2020-04-30'
+    assert "Plotly.addFrames" in html and '"name": "04/30/2020"' in html
+
+    #happy path: a new day is appended without rebuilding the cached frames
+    new_df = test_df[test_df['Date'] == '2020-04-30'].assign(Date=pd.Timestamp('2020-05-01'), Confirmed=500)
+    new_df.to_sql('country_covid_daily_cases', sql.create_engine(engine_string), index=False, if_exists='append')
+    oldest_frame = cache['frames'][min(cache['frames'])]
+    html = gtp.generate_world_time_lapse(engine_string, cache_file, full_resolution_days=14, older_frame_days=7)
+    cache = gtp.read_frame_cache(cache_file)
+    assert cache['latest_date'] == '2020-05-01' and cache['max_confirmed'] == 500
+    assert '2020-05-01' in cache['frames'] and '2020-04-17' not in cache['frames']
+    assert cache['frames'][min(cache['frames'])] == oldest_frame
+    logger.info("generate_trend_plots function generate_world_time_lapse happy path unit test is successful")
+
+    #unhappy path: there is no data to build frames from
+    test_df.head(0).to_sql('country_covid_daily_cases', sql.create_engine(engine_string), index=False,
+                           if_exists='replace')
+    with pytest.raises(SystemExit):
+        gtp.generate_world_time_lapse(engine_string)
+    logger.info("generate_trend_plots function generate_world_time_lapse unhappy path unit test is successful")
+
 ############ TESTS FOR train_models.py function ############
+def test_read_data_from_db():
+    """
+    Test the training window of the read_data_from_db function in the train_models.py function
+    """
+    db_file = 'test_training_window.db'
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    engine_string = 'sqlite:///{}'.format(db_file)
+    dates = pd.date_range('2020-03-01', '2020-04-30')
+    test_df = pd.DataFrame({'Country': ['Spain', 'Italy'] * len(dates), 'Date': dates.repeat(2),
+                            'Confirmed': range(2 * len(dates)), 'Recovered': 0, 'Active': 0, 'Deaths': 0})
+    test_df.to_sql('country_covid_daily_cases', sql.create_engine(engine_string), index=False)
+
+    #happy path: without a window every day is read, with a 14 day window only the last 14 days of each country, and
+    # only the columns the models use
+    assert len(tm.read_data_from_db('country', engine_string)) == 2 * len(dates)
+    window_df = tm.read_data_from_db('country', engine_string, window_days=14)
+    assert list(window_df.columns) == ['Country', 'Date', 'Confirmed'] and len(window_df) == 28
+    assert pd.to_datetime(window_df['Date']).min() == pd.Timestamp('2020-04-17')
+    logger.info("train_models function read_data_from_db happy path unit test is successful")
+
+    #unhappy path: an unknown model type exits
+    with pytest.raises(SystemExit):
+        tm.read_data_from_db('province', engine_string, window_days=14)
+    logger.info("train_models function read_data_from_db unhappy path unit test is successful")
+
 def test_reduce_and_reshape_data():
     """
     Test the reduce_and_reshape_data function in the train_models.py function
@@ -242,9 +608,11 @@ def test_save_global_model_local():
     model = tm.train_global_model(global_df_series,model_params,{'solver':'lbfgs'})
     fake_config = [{'Empty': ['yaml']}]
     tm.save_global_model_local(model,fake_config,'','testmodel')
-    model_read = ARIMAResults.load('testmodel')
+    # the model is saved in the compact format, and forecasts like the fitted model
+    model_read = arima_serializer.load('testmodel')
     logger.info(model_read)
-    assert type(model_read)==statsmodels.tsa.arima_model.ARIMAResultsWrapper
+    assert isinstance(model_read, arima_serializer.CompactARIMA)
+    assert numpy.allclose(model_read.forecast(7)[0], model.forecast(7)[0])
     logger.info("train_models function test_save_global_model_local happy path unit test is successful")
     #unhappy path: give a wrong type for an arg which should trip a TypeError
     with pytest.raises(TypeError):
@@ -261,14 +629,180 @@ def test_train_country_models():
     model_params = {'p': 1, 'd': 1, 'q': 0}
     models_df = tm.train_country_models(country_df, model_params, {'solver': 'lbfgs'})
     assert(len(models_df)==1)
+    # every trained model has a row of fit diagnostics
+    for col in ['Model_Type', 'Fit_Seconds', 'Iterations', 'Converged', 'Warning_Count', 'Fit_Status']:
+        assert col in models_df.columns
+    # and the holdout metrics of its forecast
+    for col in ['MAPE', 'sMAPE', 'MASE', 'RMSE', 'MSE']:
+        assert col in models_df.columns
     logger.info("train_models function train_country_models happy path unit test is successful")
 
+    # a zero second budget stops every ARIMA fit, the country should still get a (naive drift) model
+    models_df = tm.train_country_models(country_df, model_params, {'solver': 'lbfgs'}, {'max_seconds': 0})
+    assert(len(models_df)==1)
+    assert models_df['Model_Type'][0] in baseline_models.MODELS
+    assert models_df['Fit_Status'][0] == 'time_budget_exceeded'
+    assert len(models_df['Model'][0].forecast(7)[0]) == 7
+
+    # a country with less than two weeks of cases still gets a (baseline) model, without an ARIMA fit
+    new_country_df = country_df.assign(Country='Tuvalu', Confirmed=[0] * (len(country_df) - 6) + [1, 2, 3, 5, 8, 13])
+    models_df = tm.train_country_models(pd.concat([country_df, new_country_df]), model_params, {'solver': 'lbfgs'},
+                                        baselines={'min_days': 5, 'arima_above_mape': 2.0})
+    assert list(models_df['Country']) == ['Spain', 'Tuvalu']
+    assert models_df['Model_Type'][1] in baseline_models.MODELS and models_df['Fit_Status'][1] == 'not_fit'
+
+    # the ARIMA fits on a process pool (reading the series from a series store) give the same models as in process
+    many_df = pd.concat([country_df.assign(Country=name, Confirmed=country_df['Confirmed'] * scale)
+                         for name, scale in [('Spain', 1), ('Portugal', 2), ('Andorra', 3)]])
+    serial_df = tm.train_country_models(many_df, model_params, {'solver': 'lbfgs'})
+    parallel_df = tm.train_country_models(many_df, model_params, {'solver': 'lbfgs'}, workers=2)
+    assert list(parallel_df['Country']) == list(serial_df['Country'])
+    assert list(parallel_df['Model_Type']) == list(serial_df['Model_Type'])
+    assert list(parallel_df['Fit_Status']) == list(serial_df['Fit_Status'])
+    assert numpy.allclose(parallel_df['MAPE'], serial_df['MAPE'], equal_nan=True)
+
     #unhappy path: feed in the wrong (global instead of country) data to the function; should raise an AttributeError
     global_df = pd.read_csv('sample_global_daily_data.csv')
     model_params = {'p': 1, 'd': 1, 'q': 0}
     with pytest.raises(AttributeError):
         models_df = tm.train_country_models(global_df, model_params, {'solver': 'lbfgs'})
     logger.info("train_models function train_country_models unhappy path unit test is successful")
+############ TESTS FOR series_store.py functions ############
+def test_series_store():
+    """
+    Test writing series to a memory mapped series store and reading them back, in this process and from a pickled copy
+    """
+    #happy path: series of different lengths are read back by name or position as read-only views of one mapping, and
+    # a copy of the store (what a worker process receives) pickles to a few bytes and reads the same values
+    series = [numpy.arange(10000, dtype=float), [1, 2, 3], []]
+    with series_store.SeriesStore.create(['Spain', 'Tuvalu', 'Nauru'], series) as store:
+        assert len(store) == 3 and store.names == ['Spain', 'Tuvalu', 'Nauru']
+        assert list(store['Tuvalu']) == [1., 2., 3.] and len(store[2]) == 0
+        assert numpy.array_equal(store['Spain'], series[0])
+        assert not store['Spain'].flags.writeable
+        assert numpy.shares_memory(store['Spain'], store[0])
+        pickled = pickle.dumps(store)
+        assert len(pickled) < 500
+        copy = pickle.loads(pickled)
+        assert numpy.array_equal(copy['Spain'], series[0])
+        copy.close()
+        # only the store that created the files removes them
+        assert os.path.exists(store.directory)
+    assert not os.path.exists(store.directory)
+    logger.info("series_store functions happy path unit test is successful")
+
+    #unhappy path: a name that is not in the store raises a KeyError, and duplicate names or a missing series a
+    # ValueError
+    with series_store.SeriesStore.create(['Spain'], [[1, 2]]) as store:
+        with pytest.raises(KeyError):
+            store['Portugal']
+        with pytest.raises(KeyError):
+            store[1]
+    with pytest.raises(ValueError):
+        series_store.SeriesStore.create(['Spain', 'Spain'], [[1], [2]])
+    with pytest.raises(ValueError):
+        series_store.SeriesStore.create(['Spain', 'Portugal'], [[1]])
+    logger.info("series_store functions unhappy path unit test is successful")
+
+############ TESTS FOR baseline_models.py function ############
+def test_naive_drift_model():
+    """
+    Test the NaiveDriftModel in the baseline_models.py script
+    """
+    #happy path: fit to a linear series, the forecast should continue the line. Save and load it like a country model.
+    model = baseline_models.NaiveDriftModel.fit(pd.Series([10, 12, 14, 16]))
+    assert list(model.forecast(3)[0]) == [18, 20, 22]
+    model.save('testdriftmodel')
+    shutil.rmtree('test_registry_drift', ignore_errors=True)
+    registry = model_registry.ModelRegistry('test_registry_drift')
+    registry.publish({'testdriftmodel': 'testdriftmodel'})
+    model_read = gf.get_model(registry, 'testdriftmodel')
+    assert list(model_read.forecast(2)[0]) == [18, 20]
+    logger.info("baseline_models NaiveDriftModel happy path unit test is successful")
+
+    #unhappy path: an empty series cannot be fit, should raise a ValueError
+    with pytest.raises(ValueError):
+        baseline_models.NaiveDriftModel.fit([])
+    # a model that does not implement forecast_many cannot be used
+    class IncompleteModel(baseline_models.BaselineModel):
+        PARAMS = ('last_value',)
+
+        def __init__(self, last_value):
+            self.last_value = last_value
+
+        @classmethod
+        def fit_many(cls, Y):
+            return {'last_value': Y[:, -1]}
+    with pytest.raises(TypeError):
+        IncompleteModel.fit([1, 2])
+    logger.info("baseline_models NaiveDriftModel unhappy path unit test is successful")
+
+def test_select_baseline_models():
+    """
+    Test the vectorized baseline models and the holdout selection between them in the baseline_models.py script
+    """
+    #happy path: each model continues the series it is made for exactly, fitting many rows at once gives the same
+    # models as fitting each row, and the selection picks the exact model of each row
+    linear = numpy.arange(100., 2100., 100.)
+    exponential = 2. ** numpy.arange(12) - 1
+    assert numpy.allclose(baseline_models.DampedTrendModel.fit(linear, phi=1.).forecast(2)[0], [2100., 2200.])
+    assert numpy.allclose(baseline_models.LogLinearModel.fit(exponential).forecast(2)[0], [4095., 8191.])
+    Y = forecast_metrics.stack([linear, exponential], align='right')
+    for name, model in baseline_models.MODELS.items():
+        params = model.fit_many(Y)
+        assert numpy.allclose(model.from_params(params, 1).forecast(3)[0], model.fit(exponential).forecast(3)[0])
+    Y_test = numpy.array([[2100., 2200.], [4095., 8191.], [0., 0.]])
+    names, mapes, forecasts = baseline_models.select(numpy.vstack([Y, numpy.zeros((1, Y.shape[1]))]), Y_test)
+    assert list(names) == ['naive_drift', 'log_linear', 'naive_drift'] and numpy.isnan(mapes[2])
+    assert numpy.allclose(mapes[:2], 0) and numpy.allclose(forecasts[:2], Y_test[:2])
+    logger.info("baseline_models function select happy path unit test is successful")
+
+    #unhappy path: holdout actuals of a different length than the forecasts raise a ValueError
+    with pytest.raises(ValueError):
+        baseline_models.select(Y, Y_test)
+    logger.info("baseline_models function select unhappy path unit test is successful")
+
+############ TESTS FOR arima_serializer.py functions ############
+def test_arima_serializer():
+    """
+    Test the compact ARIMA model format against the pickled ARIMAResults
+    """
+    #happy path: an ARIMA(1,1,0) with a constant forecasts from its state (intercept 2 * (1 - 0.5) = 1, then
+    # 1 + 0.5 * 4 = 3 and 1 + 0.5 * 3 = 2.5 added to the last value of 100), and a fitted model round trips through the
+    # compact file with the same forecasts, standard errors and intervals in a fraction of the size of its pickle, while
+    # pickled models still load
+    state = arima_serializer.CompactARIMA((1, 1, 0), 1, [2., .5], 1., [100.], [4.], [])
+    assert numpy.allclose(state.forecast(2)[0], [103., 105.5])
+    assert numpy.allclose(arima_serializer.CompactARIMA.from_bytes(state.to_bytes()).forecast(2)[0], [103., 105.5])
+    global_df = pd.read_csv('sample_global_daily_data.csv')
+    global_df_series = tm.reduce_and_reshape_data('global', global_df)
+    model = tm.train_global_model(global_df_series, {'p': 1, 'd': 1, 'q': 0}, {'solver': 'lbfgs'})
+    model.save('test_pickled_model')
+    arima_serializer.save_model(model, 'test_compact_model')
+    assert arima_serializer.is_compact_file('test_compact_model')
+    assert not arima_serializer.is_compact_file('test_pickled_model')
+    assert os.path.getsize('test_compact_model') * 10 < os.path.getsize('test_pickled_model')
+    compact = gf.load_model('test_compact_model')
+    for compact_values, values in zip(compact.forecast(7), model.forecast(7)):
+        assert numpy.allclose(compact_values, values)
+    assert type(gf.load_model('test_pickled_model')) == statsmodels.tsa.arima_model.ARIMAResultsWrapper
+    comparison_df, load_seconds = arima_serializer.compare({'ARIMA_global': 'test_pickled_model'})
+    assert list(comparison_df['model']) == ['ARIMA_global'] and comparison_df['max_forecast_difference'][0] < 1e-6
+    assert set(load_seconds) == {'pickle', 'compact'}
+    logger.info("arima_serializer functions happy path unit test is successful")
+
+    #unhappy path: a file that is not a compact model, of a format version this code does not know, or truncated,
+    # raises a ValueError, as does a state that does not match its order
+    data = state.to_bytes()
+    for bad_data in [b'not a model', data[:4] + b'\x63\x00' + data[6:], data[:-8]]:
+        with pytest.raises(ValueError):
+            arima_serializer.CompactARIMA.from_bytes(bad_data)
+    with pytest.raises(ValueError):
+        arima_serializer.CompactARIMA((2, 1, 0), 1, [2., .5], 1., [100.], [4.], [])
+    for fname in ['test_pickled_model', 'test_compact_model']:
+        os.remove(fname)
+    logger.info("arima_serializer functions unhappy path unit test is successful")
+
 ############ TESTS FOR generate_forecasts.py function ############
 def test_get_model():
     """
@@ -282,13 +816,16 @@ def test_get_model():
     model = tm.train_global_model(global_df_series, model_params, {'solver': 'lbfgs'})
     fake_config = [{'Empty': ['yaml']}]
     tm.save_global_model_local(model, fake_config, '', 'testmodel')
-    model_read = gf.get_model(False,'','testmodel')
-    assert type(model_read)==statsmodels.tsa.arima_model.ARIMAResultsWrapper
+    shutil.rmtree('test_registry_global', ignore_errors=True)
+    registry = model_registry.ModelRegistry('test_registry_global')
+    registry.publish({'testmodel': 'testmodel'})
+    model_read = gf.get_model(registry,'testmodel')
+    assert isinstance(model_read, arima_serializer.CompactARIMA)
     logger.info("generate_forecasts function get_model happy path unit test is successful")
 
     #unhappy path: provide wrong filename, should raise FileNotFoundError
     with pytest.raises(FileNotFoundError):
-        model_read = gf.get_model(False,'','nomodelhere')
+        model_read = gf.get_model(registry,'nomodelhere')
     logger.info("generate_forecasts function get_model unhappy path unit test is successful")
 
 def test_get_global_forecast():
@@ -323,16 +860,320 @@ def test_get_country_forecast():
     models_df = tm.train_country_models(country_df, model_params, {'solver': 'lbfgs'})
     models = models_df['Model'].values
     models[0].save("ARIMA_Spain")
+    shutil.rmtree('test_registry_country', ignore_errors=True)
+    registry = model_registry.ModelRegistry('test_registry_country')
+    registry.publish({'ARIMA_Spain': 'ARIMA_Spain'})
     days =7
-    forecast_df = gf.get_country_forecast(False,country,'',days)
+    forecast_df = gf.get_country_forecast(registry,country,days)
     assert len(forecast_df==days)
     logger.info("generate_forecasts function get_country_forecast happy path unit test is successful")
 
     #unhappy path: provide string instead of numeric as number of days to forecast, should raise TypeError
     with pytest.raises(TypeError):
-        forecast_df = gf.get_country_forecast(False,country,'','ten')
+        forecast_df = gf.get_country_forecast(registry,country,'ten')
     logger.info("generate_forecasts function get_country_forecast unhappy path unit test is successful")
 
+def test_generate_country_forecasts():
+    """
+    Test the generate_country_forecasts function (country forecasts through the pipeline) in generate_forecasts.py
+    """
+    #happy path: publish drift models for a few countries, every forecast ends up in the database
+    countries = ['Spain', 'Italy', 'Peru', 'Chile', 'India']
+    artifacts = {}
+    for i, country in enumerate(countries):
+        baseline_models.NaiveDriftModel.fit(pd.Series([0, i + 1])).save('test_pipeline_ARIMA_{}'.format(country))
+        artifacts['ARIMA_{}'.format(country)] = 'test_pipeline_ARIMA_{}'.format(country)
+    shutil.rmtree('test_registry_pipeline', ignore_errors=True)
+    registry = model_registry.ModelRegistry('test_registry_pipeline')
+    registry.publish(artifacts)
+    if os.path.exists('test_pipeline.db'):
+        os.remove('test_pipeline.db')
+    engine_string = 'sqlite:///test_pipeline.db'
+    pipeline_config = {'fetch_workers': 2, 'forecast_workers': 2, 'max_in_flight': 3, 'write_queue_size': 2,
+                       'write_batch_rows': 6}
+    counters = gf.generate_country_forecasts(registry, countries, 3, engine_string, **pipeline_config)
+    forecast_df = helper.get_data_from_database("SELECT * FROM country_covid_forecast", engine_string)
+    assert len(forecast_df) == 15 and counters['write']['rows'] == 15 and counters['forecast']['items'] == 5
+    # the drift of each country's model is i + 1 a day from a last value of i + 1
+    assert forecast_df.groupby('country')['confirmed_cases_forecast'].max().to_dict() == \
+        {country: 4. * (i + 1) for i, country in enumerate(countries)}
+    # each country's forecast is timed as its own stage in the worker
+    with instrumentation.stage('test_forecast_stage', json_path='test_forecast_metrics.jsonl') as outer:
+        gf.forecast_country_file('Spain', 'test_pipeline_ARIMA_Spain', 3)
+    assert [(child.name, child.labels, child.rows) for child in outer.children] == \
+        [('generate_country_forecast', {'country': 'Spain'}, 3)]
+    os.remove('test_forecast_metrics.jsonl')
+    logger.info("generate_forecasts function generate_country_forecasts happy path unit test is successful")
+
+    #unhappy path: a country without a model is reported and triggers a sys.exit() once the other forecasts are written
+    with pytest.raises(SystemExit):
+        gf.generate_country_forecasts(registry, ['Spain', 'Atlantis'], 3, engine_string, **pipeline_config)
+    assert len(helper.get_data_from_database("SELECT * FROM country_covid_forecast", engine_string)) == 18
+    logger.info("generate_forecasts function generate_country_forecasts unhappy path unit test is successful")
+
+############ TESTS FOR model_registry.py functions ############
+def test_model_registry():
+    """
+    Test publishing model versions to the registry in model_registry.py and resolving/fetching them
+    """
+    #happy path: publish two versions locally, 'latest' and pinned versions resolve with a single index read
+    for fname, content in [('test_model_a', b'model a'), ('test_model_b', b'model b')]:
+        with open(fname, 'wb') as f:
+            f.write(content)
+    shutil.rmtree('test_registry', ignore_errors=True)
+    registry = model_registry.ModelRegistry('test_registry')
+    registry.publish({'ARIMA_Spain': 'test_model_a'}, metrics={'mape': {'Spain': 2.5, 'Peru': float('nan')}},
+                     version='v1')
+    registry.publish({'ARIMA_Spain': 'test_model_b'}, version='v2')
+    registry = model_registry.ModelRegistry('test_registry')
+    assert registry.resolve('latest')[0] == 'v2' and registry.resolve('v1')[1]['metrics']['mape'] == \
+        {'Spain': 2.5, 'Peru': None}
+    with open(registry.fetch('ARIMA_Spain', 'v1'), 'rb') as f:
+        assert f.read() == b'model a'
+    assert registry.stats['index_reads'] == 1
+
+    # in s3, an artifact that is unchanged between versions is downloaded once and then served from the ETag cache
+    s3 = InMemoryS3()
+    shutil.rmtree('test_registry_cache', ignore_errors=True)
+    shutil.rmtree('test_registry_cache_publisher', ignore_errors=True)
+    publisher = model_registry.ModelRegistry('models/country', 'bucket', 'test_registry_cache_publisher', s3)
+    publisher.publish({'ARIMA_Spain': 'test_model_a', 'ARIMA_Peru': 'test_model_b'}, version='v1')
+    publisher.publish({'ARIMA_Spain': 'test_model_a', 'ARIMA_Peru': 'test_model_a'}, version='v2')
+    registry = model_registry.ModelRegistry('models/country', 'bucket', 'test_registry_cache', s3)
+    for version in ['v1', 'v2', 'latest']:
+        registry.fetch('ARIMA_Spain', version)
+    with open(registry.fetch('ARIMA_Peru'), 'rb') as f:
+        assert f.read() == b'model a'
+    assert registry.stats == {'index_reads': 1}
+    # one download for the index and one for the single distinct model file
+    assert registry.cache.stats['downloads'] == 2 and registry.cache.stats['hits'] == 3
+
+    # a repeat run sharing the cache revalidates the index with a conditional GET and downloads nothing
+    registry = model_registry.ModelRegistry('models/country', 'bucket', 'test_registry_cache', s3)
+    get_calls = s3.get_calls
+    registry.fetch('ARIMA_Spain')
+    registry.fetch('ARIMA_Peru', 'v1')
+    assert s3.get_calls - get_calls == 2 and registry.cache.stats['not_modified'] == 1
+    assert registry.cache.stats['downloads'] == 1
+    logger.info("model_registry function ModelRegistry happy path unit test is successful")
+
+    #unhappy path: an unknown version triggers a sys.exit(), so does an artifact whose content does not match its
+    # checksum, and a missing artifact raises a FileNotFoundError
+    with pytest.raises(SystemExit):
+        registry.resolve('2020-01-01T00-00-00')
+    with pytest.raises(FileNotFoundError):
+        registry.fetch('ARIMA_Atlantis')
+    s3.put_object('bucket', 'models/country/v1/ARIMA_Peru', b'corrupted')
+    shutil.rmtree('test_registry_cache_empty', ignore_errors=True)
+    registry = model_registry.ModelRegistry('models/country', 'bucket', 'test_registry_cache_empty', s3)
+    with pytest.raises(SystemExit):
+        registry.fetch('ARIMA_Peru', 'v1')
+    logger.info("model_registry function ModelRegistry unhappy path unit test is successful")
+
+############ TESTS FOR artifact_cache.py functions ############
+def test_artifact_cache():
+    """
+    Test the ETag keyed s3 object cache (conditional reads, concurrent reads, LRU eviction) in artifact_cache.py
+    """
+    #happy path: a known ETag is served without any s3 request, a key alone is revalidated with a conditional GET
+    s3 = InMemoryS3()
+    for name in ['a', 'b', 'c']:
+        s3.put_object('bucket', 'models/' + name, name.encode('utf-8') * 10)
+    shutil.rmtree('test_artifact_cache', ignore_errors=True)
+    cache = artifact_cache.ArtifactCache('test_artifact_cache', max_bytes=25, s3=s3, min_age_seconds=0)
+    etag_a = s3.head_object('bucket', 'models/a')['ETag']
+    with open(cache.get('bucket', 'models/a'), 'rb') as f:
+        assert f.read() == b'a' * 10
+    get_calls = s3.get_calls
+    cache.get('bucket', 'models/a', etag=etag_a)
+    assert s3.get_calls == get_calls
+    cache.get('bucket', 'models/a')
+    assert cache.stats == {'hits': 1, 'not_modified': 1, 'downloads': 1, 'evictions': 0}
+
+    # threads reading the same key concurrently all see the complete file and leave no temporary files behind
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(cache.get('bucket', 'models/b'))) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for path in paths:
+        with open(path, 'rb') as f:
+            assert f.read() == b'b' * 10
+    assert not any(name.startswith('.tmp') for name in os.listdir(cache.objects_dir))
+
+    # the least recently used object is evicted once the cache goes over max_bytes
+    os.utime(cache.object_path(etag_a), (time.time() - 60, time.time() - 60))
+    cache.get('bucket', 'models/c')
+    assert not os.path.exists(cache.object_path(etag_a)) and cache.size() <= 25
+    assert cache.stats['evictions'] == 1
+    logger.info("artifact_cache function ArtifactCache happy path unit test is successful")
+
+    #unhappy path: a missing key raises the ClientError from s3 and a download not matching its checksum a ValueError,
+    # neither leaving anything in the cache
+    with pytest.raises(botoexceptions.ClientError):
+        cache.get('bucket', 'models/missing')
+    with pytest.raises(ValueError):
+        cache.get('bucket', 'models/a', sha256=hashlib.sha256(b'other').hexdigest())
+    assert not os.path.exists(cache.object_path(etag_a))
+    assert not any(name.startswith('.tmp') for name in os.listdir(cache.objects_dir))
+    logger.info("artifact_cache function ArtifactCache unhappy path unit test is successful")
+
+############ TESTS FOR reconciliation.py functions ############
+def test_reconcile():
+    """
+    Test the bottom up and MinT reconciliation of country and global forecasts in reconciliation.py
+    """
+    dates = [datetime(2020, 6, 1).date(), datetime(2020, 6, 2).date()]
+    country_forecast_df = pd.DataFrame({'country': ['Spain', 'Spain', 'Peru', 'Peru', 'Chile', 'Chile'],
+                                        'Date': dates * 3,
+                                        'confirmed_cases_forecast': [100., 110., 40., 45., 10., 12.]})
+    global_forecast_df = pd.DataFrame({'Date': dates, 'confirmed_cases_forecast': [170., 171.]})
+
+    #happy path: bottom up keeps the countries and sums them; every MinT variant returns forecasts that add up, ols
+    # spreading the gap evenly over the 4 series and wls_var mostly onto the country with the largest error variance
+    global_df, country_df = reconciliation.reconcile(country_forecast_df, 'bottom_up')
+    assert list(global_df['confirmed_cases_forecast']) == [150., 167.]
+    assert country_df.sort_values(['country', 'Date'])['confirmed_cases_forecast'].tolist() == [10., 12., 40., 45., 100., 110.]
+    for method in ['ols', 'wls_struct', 'wls_var']:
+        global_df, country_df = reconciliation.reconcile(country_forecast_df, method, global_forecast_df, 100.,
+                                                         {'Spain': 900., 'Peru': 100.})
+        assert (country_df.groupby('Date')['confirmed_cases_forecast'].sum().values ==
+                global_df['confirmed_cases_forecast'].values).all()
+        if method == 'ols':
+            # day 1: gap of 20 over 4 series, every country + 5
+            assert country_df.loc[country_df['Date'] == dates[0]].set_index('country')['confirmed_cases_forecast'] \
+                .to_dict() == {'Chile': 15., 'Peru': 45., 'Spain': 105.}
+        if method == 'wls_var':
+            day1 = country_df.loc[country_df['Date'] == dates[0]].set_index('country')['confirmed_cases_forecast']
+            assert day1['Spain'] - 100 > day1['Peru'] - 40 > 0
+    # the general (full covariance) form gives the same result as the diagonal one
+    S = reconciliation.summing_matrix(3)
+    base = numpy.array([[170.], [100.], [40.], [10.]])
+    W = numpy.array([100., 900., 100., 100.])
+    assert numpy.allclose(reconciliation.mint(base, S, W), reconciliation.mint(base, S, numpy.diag(W)))
+    logger.info("reconciliation function reconcile happy path unit test is successful")
+
+    #unhappy path: an unknown method or a MinT method without the global forecast raise a ValueError, so do countries
+    # forecast over different dates
+    with pytest.raises(ValueError):
+        reconciliation.reconcile(country_forecast_df, 'top_down')
+    with pytest.raises(ValueError):
+        reconciliation.reconcile(country_forecast_df, 'ols')
+    with pytest.raises(ValueError):
+        reconciliation.reconcile(country_forecast_df.iloc[:-1], 'bottom_up')
+    logger.info("reconciliation function reconcile unhappy path unit test is successful")
+
+############ TESTS FOR forecast_metrics.py functions ############
+def test_forecast_metrics():
+    """
+    Test the vectorized forecast accuracy metrics in forecast_metrics.py
+    """
+    #happy path: metrics of two series of different lengths at once, checked against the hand computed values; the
+    # actual of 0 of the second series is left out of its MAPE instead of making it infinite
+    y_true = forecast_metrics.stack([[100, 200], [0, 50, 50]])
+    y_pred = forecast_metrics.stack([[110, 180], [5, 60, 40]])
+    y_train = forecast_metrics.stack([[70, 80, 90], [40, 50]], align='right')
+    assert numpy.isnan(y_true[0, 2]) and numpy.isnan(y_train[1, 0])
+    metrics = forecast_metrics.evaluate(y_true, y_pred, y_train)
+    assert numpy.allclose(metrics['mape'], [10., 20.])
+    assert numpy.allclose(metrics['smape'], [(20 / 210 + 40 / 380) * 100 / 2, (2 + 20 / 110 + 20 / 90) * 100 / 3])
+    assert numpy.allclose(metrics['mase'], [15 / 10, (25 / 3) / 10])
+    assert numpy.allclose(metrics['rmse'], [numpy.sqrt(250), numpy.sqrt(75)])
+    # a series whose actuals are all 0 has no MAPE, and is left out of the average
+    evaluation_df = forecast_metrics.evaluation_frame(['Spain', 'Peru', 'Chile'], forecast_metrics.stack([[100, 200], [0, 50, 50], [0]]),
+                                                      forecast_metrics.stack([[110, 180], [5, 60, 40], [3]]), model='country')
+    assert numpy.isnan(evaluation_df['mape'][2]) and evaluation_df['mase'].isna().all()
+    assert list(evaluation_df['model']) == ['country'] * 3 and list(evaluation_df['series']) == ['Spain', 'Peru', 'Chile']
+    assert forecast_metrics.summarize(evaluation_df)['mape'] == 15. and forecast_metrics.summarize(evaluation_df)['mase'] is None
+    logger.info("forecast_metrics functions happy path unit test is successful")
+
+    #unhappy path: forecasts that do not line up with the actuals, or a missing training series, raise a ValueError
+    with pytest.raises(ValueError):
+        forecast_metrics.mape([[1, 2, 3]], [[1, 2]])
+    with pytest.raises(ValueError):
+        forecast_metrics.mase(y_true, y_pred, y_train[:1])
+    logger.info("forecast_metrics functions unhappy path unit test is successful")
+
+############ TESTS FOR backtest.py functions ############
+def test_backtest():
+    """
+    Test the backtest of the country models over historical cut-offs in backtest.py
+    """
+    #happy path: 40 days of two growing countries and a third with too few cases to be trained; 3 cut-offs a week apart
+    # leave a week of actuals each, the short country is left out and every fold is scored
+    dates = pd.date_range('2020-04-01', periods=40)
+    country_df = pd.DataFrame({'Country': ['Spain'] * 40 + ['Peru'] * 40 + ['Tuvalu'] * 40,
+                               'Date': list(dates) * 3,
+                               'Confirmed': list(range(100, 4100, 100)) + [i ** 2 for i in range(40)] + [0] * 35 + [1] * 5})
+    cutoffs = backtest.cutoff_dates(country_df['Date'], 3, 7, 7)
+    assert [str(cutoff.date()) for cutoff in cutoffs] == ['2020-04-19', '2020-04-26', '2020-05-03']
+    results_df = backtest.backtest(country_df, {'p': 1, 'd': 1, 'q': 0}, {'solver': 'lbfgs'}, n_cutoffs=3, workers=2)
+    assert len(results_df) == 6 and set(results_df['country']) == {'Spain', 'Peru'}
+    assert results_df['rmse'].notna().all() and not results_df.loc[results_df['cutoff'] == cutoffs[0].date(), 'warm_start'].any()
+    assert set(results_df['model_type']) <= set(baseline_models.MODELS) | {'arima'}
+    summary_df = backtest.summarize_backtest(results_df)
+    assert list(summary_df['cutoff'])[-1] == 'all' and list(summary_df['countries']) == [2, 2, 2, 6]
+    assert summary_df['models'].str.len().gt(0).all()
+    # the baselines configs of the country models apply at every cut-off: with a MAPE threshold no baseline reaches,
+    # ARIMA is never fit and each cut-off reports the baseline that won there
+    results_df = backtest.backtest(country_df, {'p': 1, 'd': 1, 'q': 0}, {'solver': 'lbfgs'}, n_cutoffs=3, workers=2,
+                                   baselines={'min_days': 5, 'arima_above_mape': 10 ** 9})
+    assert (results_df['fit_status'] == 'not_fit').all() and set(results_df['model_type']) <= set(baseline_models.MODELS)
+    assert not results_df['warm_start'].any()
+    # a 14 day training window trains at every cut-off on its last 14 days only
+    folds = backtest.backtest_country('Spain', dates, list(range(100, 4100, 100)), cutoffs, 7, {'p': 1, 'd': 1, 'q': 0},
+                                      {'solver': 'lbfgs'}, window_days=14)
+    assert [len(fold['y_train']) for fold in folds] == [14, 14, 14] and folds[0]['y_train'][-1] == 1900
+    # a country that stopped reporting before a cut-off has nothing to be scored on there
+    folds = backtest.backtest_country('Spain', dates[:30], list(range(100, 3100, 100)), cutoffs, 7, {'p': 1, 'd': 1, 'q': 0},
+                                      {'solver': 'lbfgs'})
+    assert [fold['cutoff'] for fold in folds] == [cutoffs[0].date(), cutoffs[1].date()] and len(folds[1]['y_test']) == 4
+    logger.info("backtest function backtest happy path unit test is successful")
+
+    #unhappy path: data that does not cover the horizon cannot be backtested, should raise a ValueError
+    with pytest.raises(ValueError):
+        backtest.backtest(country_df.loc[country_df['Date'] < dates[5]], {'p': 1, 'd': 1, 'q': 0}, {'solver': 'lbfgs'})
+    logger.info("backtest function backtest unhappy path unit test is successful")
+
+############ TESTS FOR forecast_pipeline.py functions ############
+def test_run_pipeline():
+    """
+    Test the fetch/forecast/write pipeline (batching, backpressure, failures) in forecast_pipeline.py
+    """
+    #happy path: a slow writer with a queue of 1 forecast; every forecast is written in batches of at least 4 rows and
+    # the queue never holds more than 1
+    for country in ['Spain', 'Italy', 'Peru']:
+        baseline_models.NaiveDriftModel.fit(pd.Series([1, 2])).save('test_pipeline_{}'.format(country))
+    batches = []
+    def slow_write(df):
+        time.sleep(0.05)
+        batches.append(df)
+    countries = ['Spain', 'Italy', 'Peru'] * 4
+    counters, failed = forecast_pipeline.run_pipeline(
+        countries, fetch=lambda country: 'test_pipeline_{}'.format(country),
+        forecast=functools.partial(gf.forecast_country_file, n_days=2), write=slow_write, fetch_workers=2,
+        forecast_workers=2, max_in_flight=4, write_queue_size=1, write_batch_rows=4)
+    assert failed == [] and sum(len(df) for df in batches) == 24 and all(len(df) >= 4 for df in batches[:-1])
+    assert counters['fetch']['items'] == counters['forecast']['items'] == counters['write']['items'] == 12
+    assert counters['write']['max_queue_depth'] <= 1 and counters['write']['batches'] == len(batches)
+    logger.info("forecast_pipeline function run_pipeline happy path unit test is successful")
+
+    #unhappy path: an item whose fetch fails is reported as failed and the others still go through, a write failure is
+    # counted and does not block the pipeline
+    counters, failed = forecast_pipeline.run_pipeline(
+        ['Spain', 'Atlantis', 'Peru'], fetch=lambda country: 'test_pipeline_{}'.format(country),
+        forecast=functools.partial(gf.forecast_country_file, n_days=2), write=slow_write, forecast_workers=1)
+    assert failed == ['Atlantis'] and counters['forecast']['failed'] == 1 and counters['write']['rows'] == 4
+    def failing_write(df):
+        sys.exit(1)
+    counters, failed = forecast_pipeline.run_pipeline(
+        countries, fetch=lambda country: 'test_pipeline_{}'.format(country),
+        forecast=functools.partial(gf.forecast_country_file, n_days=2), write=failing_write, forecast_workers=1,
+        write_queue_size=1, write_batch_rows=2)
+    assert failed == [] and counters['write']['failed'] == 12 and counters['write']['rows'] == 0
+    logger.info("forecast_pipeline function run_pipeline unhappy path unit test is successful")
+
 ############ TESTS FOR generate_forecast_plots.py function ############
 def test_generate_forecast_plot():
     """
@@ -379,6 +1220,233 @@ def test_get_html_and_save():
         gfp.get_html_and_save(22,False,'figtest','src')
     logger.info("generate_trend_plots function get_html_and_save unhappy path unit test is successful")
 
+############ TESTS FOR render_plots.py functions ############
+def test_render_artifacts():
+    """
+    Test the render_artifacts function (with the country plot jobs) in the render_plots.py script
+    """
+    db_file = 'test_render_plots.db'
+    local_path = 'test_render_plots'
+    shutil.rmtree(local_path, ignore_errors=True)
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    engine_string = 'sqlite:///{}'.format(db_file)
+    dates = pd.date_range('2020-04-01', '2020-04-30')
+    cases_df = pd.DataFrame({'Country': ['Spain', 'Italy', 'Cote d\'Ivoire'] * len(dates), 'Date': dates.repeat(3),
+                             'Confirmed': range(3 * len(dates)), 'Recovered': 0, 'Active': 0, 'Deaths': 0})
+    forecast_df = pd.DataFrame({'country': ['Spain', 'Italy', 'Cote d\'Ivoire'] * 7,
+                                'date': pd.date_range('2020-05-01', '2020-05-07').repeat(3),
+                                'confirmed_cases_forecast': range(21)})
+    engine = sql.create_engine(engine_string)
+    cases_df.to_sql('country_covid_daily_cases', engine, index=False)
+    forecast_df.to_sql('country_covid_forecast', engine, index=False)
+
+    #happy path: a plot per country is written along with its hash in the manifest
+    forecast_df, recent_df = render_plots.get_country_plot_data(engine_string, recent_days=14)
+    assert (recent_df.groupby('Country').size() == 14).all()
+    jobs = render_plots.get_country_jobs(forecast_df, recent_df)
+    records = render_plots.render_artifacts(jobs, local_path, max_workers=2)
+    assert len(records) == 3 and all(r['written'] for r in records)
+    manifest = render_plots.read_manifest(local_path)
+    spain_path = os.path.join(local_path, 'country_forecasts', 'spain.html')
+    with open(spain_path, 'rb') as f:
+        assert manifest['country_forecasts/spain']['sha256'] == hashlib.sha256(f.read()).hexdigest()
+    assert os.path.exists(os.path.join(local_path, 'country_forecasts', 'cote_d_ivoire.html'))
+    # rendering the same data again leaves every file untouched
+    records = render_plots.render_artifacts(jobs, local_path, max_workers=2)
+    assert not any(r['written'] for r in records)
+    logger.info("render_plots function render_artifacts happy path unit test is successful")
+
+    #unhappy path: a job that cannot be rendered exits after the other plots are written
+    bad_job = {'name': 'country_forecasts/bad', 'kind': 'forecast',
+               'args': {'forecast_df': pd.DataFrame(), 'cases_df_plot': pd.DataFrame()}}
+    with pytest.raises(SystemExit):
+        render_plots.render_artifacts(jobs + [bad_job], local_path, max_workers=2)
+    assert 'country_forecasts/bad' not in render_plots.read_manifest(local_path)
+    logger.info("render_plots function render_artifacts unhappy path unit test is successful")
+
+############ TESTS FOR static_assets.py functions ############
+def test_publish_assets():
+    """
+    Test the publish_assets function (and choosing the variant to serve) in the static_assets.py script
+    """
+    static_dir = 'test_static_assets'
+    shutil.rmtree(static_dir, ignore_errors=True)
+    os.makedirs(static_dir)
+
+    #happy path: each version gets its own fingerprinted, precompressed file, the manifest points at the latest and
+    #only the version before it is kept
+    versions = ['<div>{}</div>'.format(i) * 100 for i in range(3)]
+    files = []
+    for content in versions:
+        manifest = static_assets.publish_assets(static_dir, {'global_cases.html': content})
+        files.append(manifest['global_cases.html']['file'])
+    assert len(set(files)) == 3 and all(f.startswith('global_cases.') and f.endswith('.html') for f in files)
+    assert manifest['global_cases.html']['previous'] == files[1]
+    assert not os.path.exists(os.path.join(static_dir, files[0]))
+    assert os.path.exists(os.path.join(static_dir, files[1]))
+    with gzip.open(os.path.join(static_dir, files[2] + '.gz'), 'rt') as f:
+        assert f.read() == versions[2]
+    assert manifest['global_cases.html']['gz_bytes'] < manifest['global_cases.html']['bytes']
+    # publishing the same content again does not change the file or drop the previous version
+    manifest = static_assets.publish_assets(static_dir, {'global_cases.html': versions[2]})
+    assert manifest['global_cases.html']['file'] == files[2] and manifest['global_cases.html']['previous'] == files[1]
+    assert static_assets.AssetManifest(static_dir).lookup('global_cases.html') == files[2]
+    assert static_assets.choose_variant(static_dir, files[2], 'gzip, deflate') == (files[2] + '.gz', 'gzip')
+    logger.info("static_assets function publish_assets happy path unit test is successful")
+
+    #unhappy path: unpublished files are not in the manifest and clients without compression get the plain file
+    assert static_assets.AssetManifest(static_dir).lookup('news.txt') is None
+    assert static_assets.choose_variant(static_dir, files[2], '') == (files[2], None)
+    assert static_assets.choose_variant(static_dir, files[2], 'identity') == (files[2], None)
+    # a coding with q=0 is refused, even when the server would prefer it, and the highest q-value wins
+    with open(os.path.join(static_dir, files[2] + '.br'), 'wb') as f:
+        f.write(b'br')
+    assert static_assets.choose_variant(static_dir, files[2], 'br;q=0, gzip') == (files[2] + '.gz', 'gzip')
+    assert static_assets.choose_variant(static_dir, files[2], 'br;q=0.5, gzip;q=0.9') == (files[2] + '.gz', 'gzip')
+    assert static_assets.choose_variant(static_dir, files[2], 'gzip, br') == (files[2] + '.br', 'br')
+    assert static_assets.choose_variant(static_dir, files[2], 'br;q=0, gzip;q=0') == (files[2], None)
+    assert static_assets.choose_variant(static_dir, files[2], 'gzip;q=0, *') == (files[2] + '.br', 'br')
+    assert static_assets.choose_variant(static_dir, files[2], 'br;q=0, *;q=0') == (files[2], None)
+    logger.info("static_assets function publish_assets unhappy path unit test is successful")
+
+############ TESTS FOR country_index.py functions ############
+def test_country_index():
+    """
+    Test the CountryIndex and CountryIndexService classes in the country_index.py script
+    """
+    countries = ['United States of America', 'United Kingdom', 'Korea (South)', 'Korea (North)', "Cote d'Ivoire",
+                 'Congo (Kinshasa)', 'Congo (Brazzaville)', 'Syrian Arab Republic (Syria)', 'Iran, Islamic Republic of',
+                 'Spain', 'Italy', 'Austria', 'Australia']
+    index = country_index.CountryIndex(countries)
+
+    #happy path: exact names in any case or accents, derived names and aliases all resolve
+    assert index.resolve('SPAIN') == 'Spain'
+    assert index.resolve("  the Côte d'Ivoire ") == "Cote d'Ivoire"
+    assert index.resolve('syria') == 'Syrian Arab Republic (Syria)'
+    assert index.resolve('Iran') == 'Iran, Islamic Republic of'
+    assert index.resolve('USA') == 'United States of America'
+    assert index.resolve('south korea') == 'Korea (South)'
+    assert index.suggest('Austrlia')[0][0] == 'Australia'
+    assert index.suggest('Itly')[0][0] == 'Italy'
+    logger.info("country_index function CountryIndex happy path unit test is successful")
+
+    #unhappy path: unknown and ambiguous names do not resolve, aliases for countries without a forecast are not indexed
+    assert index.resolve('Atlantis') is None
+    assert index.resolve('congo') is None and index.resolve('korea') is None
+    assert index.resolve('russia') is None
+    assert index.suggest('zzzz') == []
+    logger.info("country_index function CountryIndex unhappy path unit test is successful")
+
+    #happy path: the service picks up a new country list when the file changes
+    country_list_file = 'test_countries.pkl'
+    with open(country_list_file, 'wb') as f:
+        pickle.dump(countries, f)
+    service = country_index.CountryIndexService(country_list_file)
+    assert service.get().resolve('Peru') is None
+    with open(country_list_file, 'wb') as f:
+        pickle.dump(countries + ['Peru'], f)
+    os.utime(country_list_file, (time.time() + 5, time.time() + 5))
+    assert service.get().resolve('peru') == 'Peru'
+    logger.info("country_index function CountryIndexService happy path unit test is successful")
+
+    #unhappy path: an unreadable country list keeps the current index
+    with open(country_list_file, 'wb') as f:
+        f.write(b'not a pickle')
+    os.utime(country_list_file, (time.time() + 10, time.time() + 10))
+    assert service.get().resolve('peru') == 'Peru'
+    # and is not read again until it changes
+    with mock.patch.object(country_index.CountryIndex, 'from_file') as from_file:
+        assert service.get().resolve('peru') == 'Peru'
+        assert from_file.call_count == 0
+    logger.info("country_index function CountryIndexService unhappy path unit test is successful")
+
+############ TESTS FOR write_behind.py functions ############
+def test_write_behind_queue():
+    """
+    Test the WriteBehindQueue class in the write_behind.py script
+    """
+    db_file = 'test_write_behind.db'
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    engine_string = 'sqlite:///{}'.format(db_file)
+    User_App_Inputs.__table__.create(sql.create_engine(engine_string))
+    row = {'date': datetime(2020, 5, 1).date(), 'name': 'test', 'age': 30, 'country_of_residence': 'Spain',
+           'country_input': 'Italy'}
+
+    #happy path: rows are written in batches of at most max_batch_rows and everything is flushed on close
+    writer = write_behind.WriteBehindQueue(engine_string, User_App_Inputs.__table__, max_batch_rows=100,
+                                           max_batch_ms=50)
+    for i in range(250):
+        assert writer.submit(dict(row, age=i))
+    writer.close()
+    metrics = writer.metrics()
+    assert metrics['written'] == 250 and metrics['enqueued'] == 250 and metrics['queue_depth'] == 0
+    assert metrics['batches'] >= 3
+    written_df = pd.read_sql("SELECT * FROM covid_app_user_inputs", sql.create_engine(engine_string))
+    assert sorted(written_df['age']) == list(range(250))
+    # a single row is written after max_batch_ms without waiting for a full batch
+    writer = write_behind.WriteBehindQueue(engine_string, User_App_Inputs.__table__, max_batch_rows=100,
+                                           max_batch_ms=50)
+    writer.submit(row)
+    time.sleep(1)
+    assert writer.metrics()['written'] == 1
+    writer.close()
+    logger.info("write_behind function WriteBehindQueue happy path unit test is successful")
+
+    #unhappy path: rows that cannot be written are counted as failed and rows submitted after close are dropped
+    writer = write_behind.WriteBehindQueue('sqlite:///test_write_behind_missing.db', User_App_Inputs.__table__,
+                                           max_batch_ms=10, max_retries=1)
+    writer.submit(row)
+    writer.close()
+    assert not writer.submit(row)
+    metrics = writer.metrics()
+    assert metrics['failed'] == 1 and metrics['written'] == 0 and metrics['dropped'] == 1
+    logger.info("write_behind function WriteBehindQueue unhappy path unit test is successful")
+
+############ TESTS FOR query_cache.py functions ############
+def test_query_cache():
+    """
+    Test the QueryCache class and data version functions in the query_cache.py script
+    """
+    db_file = 'test_query_cache.db'
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    engine_string = 'sqlite:///{}'.format(db_file)
+    forecast_df = pd.DataFrame({'country': ['Spain', 'Italy'] * 7,
+                                'date': pd.date_range('2020-05-01', '2020-05-07').repeat(2),
+                                'confirmed_cases_forecast': range(14)})
+    forecast_df.to_sql('country_covid_forecast', sql.create_engine(engine_string), index=False)
+    query = """SELECT * FROM country_covid_forecast WHERE country = :country"""
+
+    #happy path: repeated queries are served from the cache until the data version is bumped
+    cache = query_cache.QueryCache(max_entries=2, ttl_seconds=60, version_check_seconds=0)
+    assert query_cache.get_data_version(engine_string) == 0
+    spain_df = cache.get(query, engine_string, {'country': 'Spain'})
+    assert len(spain_df) == 7 and set(spain_df['country']) == {'Spain'}
+    spain_df['country'] = 'changed'
+    assert set(cache.get(query, engine_string, {'country': 'Spain'})['country']) == {'Spain'}
+    assert cache.metrics()['hits'] == 1 and cache.metrics()['misses'] == 1
+    assert query_cache.bump_data_version(engine_string) == 1
+    assert query_cache.bump_data_version(engine_string) == 2
+    cache.get(query, engine_string, {'country': 'Spain'})
+    assert cache.metrics()['misses'] == 2
+    # least recently used entries are evicted past max_entries
+    cache.get(query, engine_string, {'country': 'Italy'})
+    cache.get(query, engine_string, {'country': 'France'})
+    assert cache.metrics()['evictions'] >= 1 and cache.metrics()['entries'] == 2
+    logger.info("query_cache function QueryCache happy path unit test is successful")
+
+    #unhappy path: parameters are never interpolated into the SQL, so a malicious value just matches nothing
+    injected_df = cache.get(query, engine_string, {'country': "Spain' OR '1'='1"})
+    assert len(injected_df) == 0
+    # expired entries are queried again
+    cache = query_cache.QueryCache(ttl_seconds=0, version_check_seconds=60)
+    cache.get(query, engine_string, {'country': 'Spain'})
+    cache.get(query, engine_string, {'country': 'Spain'})
+    assert cache.metrics()['hits'] == 0 and cache.metrics()['misses'] == 2
+    logger.info("query_cache function QueryCache unhappy path unit test is successful")
+
 ############ TESTS FOR get_news.py functions ############
 # ALL BUT ONE FUNCTION IN THIS SCRIPT INTERACT WITH AN API or s3.
 def test_write_data_to_local():
@@ -410,6 +1478,137 @@ def test_write_data_to_local():
     gn.write_data_to_local(dict1,"unhappy_test.json")
     logger.info("get_news function write_data_to_local unhappy path unit test is successful")
 
+############ TESTS FOR helper.py functions ############
+class InMemoryS3:
+    """
+    Minimal stand-in for a boto3 s3 client covering the calls made by the helper s3 lookups. Listing pages at 1000 keys
+    like list_objects_v2, objects carry an md5 ETag and a conditional GET of an unchanged object raises a 304 like s3
+    does. Counts the list and get calls made.
+    """
+    def __init__(self):
+        self.objects = {}
+        self.list_calls = 0
+        self.get_calls = 0
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        body = Body.encode('utf-8') if isinstance(Body, str) else Body
+        self.objects[Key] = {'Body': body, 'LastModified': datetime.now(timezone.utc),
+                             'ETag': '"{}"'.format(hashlib.md5(body).hexdigest())}
+        return {'ETag': self.objects[Key]['ETag']}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise botoexceptions.ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {'ETag': self.objects[Key]['ETag'], 'ContentLength': len(self.objects[Key]['Body'])}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.get_calls += 1
+        if Key not in self.objects:
+            raise botoexceptions.ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'missing'}}, 'GetObject')
+        if IfNoneMatch is not None and IfNoneMatch == self.objects[Key]['ETag']:
+            raise botoexceptions.ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key]['Body']), 'ETag': self.objects[Key]['ETag']}
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, 'rb') as f:
+            self.put_object(Bucket, Key, f.read())
+
+    def download_file(self, Bucket, Key, Filename):
+        with open(Filename, 'wb') as f:
+            f.write(self.get_object(Bucket, Key)['Body'].read())
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None, MaxKeys=1000):
+        self.list_calls += 1
+        keys = sorted(k for k in self.objects if k.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = {'Contents': [{'Key': k, 'LastModified': self.objects[k]['LastModified']}
+                             for k in keys[start:start + MaxKeys]]}
+        if start + MaxKeys < len(keys):
+            page['IsTruncated'] = True
+            page['NextContinuationToken'] = str(start + MaxKeys)
+        return page
+
+    def get_paginator(self, operation_name):
+        s3 = self
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                token = None
+                while True:
+                    page = s3.list_objects_v2(ContinuationToken=token, **kwargs)
+                    yield page
+                    token = page.get('NextContinuationToken')
+                    if token is None:
+                        break
+        return Paginator()
+
+def test_get_latest_s3_data():
+    """
+    Test the get_latest_s3_data function (and the '_latest' manifest functions) in the helper.py script
+    """
+    s3 = InMemoryS3()
+    base_time = datetime(2020, 5, 1, tzinfo=timezone.utc)
+    for i in range(2500):
+        s3.objects['models/country/{:04d}/model.pkl'.format(i)] = {'Body': b'', 'LastModified': base_time + timedelta(minutes=i)}
+    # make an object past the first page of the listing the newest one
+    s3.objects['models/country/2200/model.pkl']['LastModified'] = base_time + timedelta(days=30)
+
+    #happy path: the first lookup lists every page and writes the manifest, the second lookup only reads the manifest
+    with mock.patch('boto3.client', return_value=s3):
+        latest = helper.get_latest_s3_data('bucket', 'models/country')
+        assert latest['Key'] == 'models/country/2200/model.pkl'
+        assert s3.list_calls == 3
+        assert 'models/country/_latest' in s3.objects
+        latest = helper.get_latest_s3_data('bucket', 'models/country')
+        assert latest['Key'] == 'models/country/2200/model.pkl'
+        assert latest['LastModified'] == base_time + timedelta(days=30)
+        assert s3.list_calls == 3
+        # a new write moves the manifest and 'latest' paths resolve to its directory
+        helper.update_latest_manifest('bucket', 'models/country', 'models/country/2020-06-01/model.pkl', s3=s3)
+        assert helper.resolve_latest_s3_dir('bucket', 'models/country/latest') == 'models/country/2020-06-01'
+        assert helper.resolve_latest_s3_dir('bucket', 'models/country/2020-05-02') == 'models/country/2020-05-02'
+    logger.info("helper function get_latest_s3_data happy path unit test is successful")
+
+    #unhappy path: an empty s3 path exits
+    with mock.patch('boto3.client', return_value=InMemoryS3()):
+        with pytest.raises(SystemExit):
+            helper.get_latest_s3_data('bucket', 'models/global')
+    logger.info("helper function get_latest_s3_data unhappy path unit test is successful")
+
+############ TESTS FOR instrumentation.py functions ############
+def test_stage():
+    """
+    Test the stage context manager in the instrumentation.py script
+    """
+    #happy path: run a nested stage, report some rows and round trips and verify the JSON lines written out
+    fname = 'test_metrics.jsonl'
+    if os.path.exists(fname):
+        os.remove(fname)
+    with instrumentation.stage('outer_stage', json_path=fname) as outer:
+        outer.add_rows(10)
+        with instrumentation.stage('inner_stage', json_path=fname, country='Spain'):
+            instrumentation.add_rows(3)
+            instrumentation.increment('db_round_trips')
+    with open(fname) as f:
+        records = [json.loads(line) for line in f]
+    # inner stage finishes first so it is written first
+    assert [r['stage'] for r in records] == ['inner_stage', 'outer_stage']
+    assert records[0]['labels'] == {'country': 'Spain'}
+    assert records[0]['rows'] == 3 and records[1]['rows'] == 10
+    assert records[0]['db_round_trips'] == 1 and records[1]['db_round_trips'] == 1
+    assert records[1]['wall_seconds'] >= records[0]['wall_seconds']
+    assert records[1]['peak_rss_bytes'] > 0
+    logger.info("instrumentation function stage happy path unit test is successful")
+
+    #unhappy path: an exception inside the stage is re-raised and the stage is recorded as an error
+    with pytest.raises(SystemExit):
+        with instrumentation.stage('failing_stage', json_path=fname):
+            raise SystemExit(1)
+    with open(fname) as f:
+        records = [json.loads(line) for line in f]
+    assert records[-1]['stage'] == 'failing_stage' and records[-1]['status'] == 'error'
+    logger.info("instrumentation function stage unhappy path unit test is successful")
+
 def run_unit_tests():
     """
     Wrapper function that executes all unit tests when called
@@ -417,28 +1616,72 @@ def run_unit_tests():
 
     # run unit tests for data_acquistion.py (other functions interact with API or s3)
     test_write_to_local()
+    test_acquire_data_concurrent()
     # run unit tests for data_preparation.py (other functions interact with s3 or database)
     test_get_local_data()
+    test_get_local_archive_data()
     test_get_country_daily()
     test_get_global_daily()
+    # run unit tests for schema.py
+    test_parse_records()
+    # run unit tests for chunked_preparation.py
+    test_prepare_in_chunks()
+    # run unit tests for hierarchy.py
+    test_hierarchy()
     # run unit tests for generate_trend_plots.py (other functions interact with s3 or database)
     test_save_html_to_local()
+    test_generate_world_time_lapse()
     # run unit tests for train_models.py (other functions interact with s3)
+    test_read_data_from_db()
     test_reduce_and_reshape_data()
     test_train_global_model()
     test_train_country_models()
     test_forward_chaining_eval_global_model()
     test_save_global_model_local()
+    # run unit tests for series_store.py
+    test_series_store()
+    # run unit tests for baseline_models.py
+    test_naive_drift_model()
+    test_select_baseline_models()
+    # run unit tests for arima_serializer.py
+    test_arima_serializer()
     # run unit tests for generate_forecasts.py (other functions interact with s3)
     test_get_model()
     test_get_global_forecast()
     test_get_country_forecast()
+    test_generate_country_forecasts()
     test_write_data_to_local()
+    # run unit tests for model_registry.py
+    test_model_registry()
+    # run unit tests for artifact_cache.py
+    test_artifact_cache()
+    # run unit tests for reconciliation.py
+    test_reconcile()
+    # run unit tests for forecast_metrics.py
+    test_forecast_metrics()
+    # run unit tests for backtest.py
+    test_backtest()
+    # run unit tests for forecast_pipeline.py
+    test_run_pipeline()
     # run unit tests for generate_forecast_plots.py (other functions interact with s3)
     test_generate_forecast_plot()
     test_get_html_and_save()
+    # run unit tests for render_plots.py
+    test_render_artifacts()
+    # run unit tests for static_assets.py
+    test_publish_assets()
+    # run unit tests for country_index.py
+    test_country_index()
+    # run unit tests for write_behind.py
+    test_write_behind_queue()
+    # run unit tests for query_cache.py
+    test_query_cache()
     # run unit tests for get_news.py
     test_write_data_to_local()
+    # run unit tests for helper.py
+    test_get_latest_s3_data()
+    # run unit tests for instrumentation.py
+    test_stage()
 
 
 if __name__ == '__main__':
@@ -6,25 +6,38 @@ import yaml
 import helper
 from sklearn.model_selection import TimeSeriesSplit
 import logging.config
-import boto3
 import sys
-import botocore.exceptions as botoexceptions
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
 import unidecode
 import pickle
 from shutil import copyfile
+import time
+import warnings
+import arima_serializer
+import baseline_models
+import forecast_metrics
+import hierarchy
+import instrumentation
+import model_registry
+import tempfile
+import series_store
 
 #set-up logging
 logging.config.fileConfig(fname="local.conf")
 logger = logging.getLogger(__name__)
 
-def read_data_from_db(model_type,engine_string=None):
+# name of the global model artifact in the model registry
+GLOBAL_MODEL_FILENAME = "ARIMA_global_model"
+
+def read_data_from_db(model_type,engine_string=None,window_days=None):
     """
     Retrieve data from MySQL database locally or in RDS
     Args:
         model_type (str): can specify 'global' or 'country' so that the correct table is queried
         engine_string (str): sqlalchemy string for the connection.
+        window_days (int): optional number of most recent days to read (the training window), all history if None or 0
 
     Returns:
         df (pandas DataFrame): DataFrame of covid19 data retrieved from MySQL database
@@ -44,9 +57,33 @@ def read_data_from_db(model_type,engine_string=None):
     # get sqlalchemy engine
     engine = helper.get_engine(engine_string)
 
-    # query the database
-    query = """SELECT * FROM  {}""".format(table_name)
-    df = helper.get_data_from_database(query,engine_string)
+    # query the database, only for the columns the models are trained on
+    columns = ['Date', 'Confirmed'] if model_type == 'global' else ['Country', 'Date', 'Confirmed']
+    return read_table_from_db(table_name,columns,engine_string,window_days)
+
+def read_table_from_db(table_name,columns,engine_string=None,window_days=None):
+    """
+    Retrieve columns of a daily cases table (of any level of the hierarchy, see hierarchy.py)
+    Args:
+        table_name (str): the table to query
+        columns (list): columns to read
+        engine_string (str): sqlalchemy string for the connection.
+        window_days (int): optional number of most recent days to read (the training window), all history if None or 0
+
+    Returns:
+        df (pandas DataFrame): DataFrame of covid19 data retrieved from MySQL database
+    """
+    query = """SELECT {} FROM  {}""".format(", ".join(columns), table_name)
+    params = None
+    if window_days:
+        # the training window is applied by the database, so older history is never read
+        max_date_df = helper.get_data_from_database("""SELECT MAX(Date) AS Max_Date FROM {}""".format(table_name),
+                                                    engine_string)
+        max_date = pd.to_datetime(max_date_df['Max_Date'][0])
+        if not pd.isna(max_date):
+            query += """ WHERE Date >= :since"""
+            params = {'since': (max_date - pd.Timedelta(days=window_days - 1)).strftime('%Y-%m-%d')}
+    df = helper.get_data_from_database(query,engine_string,params)
 
     return df
 
@@ -94,9 +131,9 @@ def train_global_model(df,model_params,optional_fit_args):
     logger.info("Global daily forecasting model trained")
     return model_arima
 
-def forward_chaining_eval_global_model(df,model_params,optional_fit_args,nbr_days_forecast):
+def forward_chaining_forecasts(df,model_params,optional_fit_args,nbr_days_forecast):
     """
-    Evaluate COVID19 global confirmed cases forecasting model using a walk forward validation approach
+    Forecasts of each fold of a walk forward validation of the global forecasting model
     Args:
         df (pandas DataFrame): input data used for training
         model_params (dict): ARIMA required fit parameters used in training
@@ -104,80 +141,368 @@ def forward_chaining_eval_global_model(df,model_params,optional_fit_args,nbr_day
         nbr_days_forecast: Number of days into the future to be forecasted
 
     Returns:
-        avg_mape (float): Average Mean Average Percent Error across all folds of the walk forward approach
+        folds (list of tuples): (y_pred, y_test, y_train) forecast, actual and training values of each fold
     """
 
     test_size = float(nbr_days_forecast) / len(df)
     n_splits = int((1 // test_size) - 1)
     tscv = TimeSeriesSplit(n_splits=n_splits)
-    y_preds_arima = []
-    mapes_arima = []
-    counter = 1
+    folds = []
     for train_index, test_index in tscv.split(df):
         y_train = df.iloc[train_index]
         y_test = df.iloc[test_index]
         arima_def = ARIMA(y_train, order=(model_params['p'], model_params['d'], model_params['q']))
         model_arima = arima_def.fit(**optional_fit_args,disp=0)
         y_pred = model_arima.forecast(len(y_test))[0]
-        y_preds_arima.append(np.round(y_pred))
-        mapes_arima.append(round((abs((y_pred - y_test.values) / y_test.values) * 100).mean()))
-        counter+=1
+        folds.append((y_pred, y_test.values, y_train.values))
+    return folds
+
+def evaluate_global_folds(folds):
+    """
+    Accuracy metrics of every fold of forward_chaining_forecasts, computed at once on the stacked folds
+    Args:
+        folds (list of tuples): output of forward_chaining_forecasts
+
+    Returns:
+        evaluation_df (pandas DataFrame): model, fold, series and the forecast_metrics.METRICS of each fold
+    """
+    y_pred, y_test, y_train = zip(*folds)
+    return forecast_metrics.evaluation_frame(['Global'] * len(folds), forecast_metrics.stack(y_test),
+                                             forecast_metrics.stack(y_pred),
+                                             forecast_metrics.stack(y_train, align='right'),
+                                             model='global', fold=list(range(len(folds))))
+
+def forward_chaining_eval_global_model(df,model_params,optional_fit_args,nbr_days_forecast):
+    """
+    Evaluate COVID19 global confirmed cases forecasting model using a walk forward validation approach
+    Args:
+        df (pandas DataFrame): input data used for training
+        model_params (dict): ARIMA required fit parameters used in training
+        optional_fit_args: ARIMA model additional hyperparameters used in trainig
+        nbr_days_forecast: Number of days into the future to be forecasted
+
+    Returns:
+        avg_mape (float): Average Mean Average Percent Error across all folds of the walk forward approach
+    """
+    mape = forecast_metrics.summarize(evaluate_global_folds(
+        forward_chaining_forecasts(df,model_params,optional_fit_args,nbr_days_forecast)))['mape']
+    return np.round(np.float64(mape if mape is not None else np.nan),3)
+
+# days at the end of each country's series its models are evaluated on
+HOLDOUT_DAYS = 7
+
+class FitBudgetExceeded(Exception):
+    """Raised from the optimizer callback when an ARIMA fit runs past its time budget"""
+    pass
+
+def fit_arima_with_budget(y,model_params,optional_fit_args,fit_budget=None):
+    """
+    Fits an ARIMA model while recording fit diagnostics and enforcing an optional iteration/time budget
+    Args:
+        y (pandas Series): confirmed cases by day to fit to
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        fit_budget (dict): optional limits for the fit
+            - max_seconds (float): wall time after which the optimizer is stopped (checked once per iteration)
+            - max_iterations (int): caps the optimizer's maxiter
 
-    avg_mape = np.round(np.mean(mapes_arima),3)
+    Returns:
+        model_arima: ARIMA trained model object, None if the fit failed or ran past its time budget
+        diagnostics (dict): Fit_Seconds, Iterations, Converged, Warning_Count and Fit_Status of the fit
+    """
+    if fit_budget is None:
+        fit_budget = {}
+    fit_args = dict(optional_fit_args)
+    max_iterations = fit_budget.get('max_iterations')
+    if max_iterations is not None:
+        fit_args['maxiter'] = min(fit_args.get('maxiter', max_iterations), max_iterations)
+    max_seconds = fit_budget.get('max_seconds')
+
+    start = time.perf_counter()
+
+    def check_budget(params):
+        # called by the optimizer after every iteration
+        if max_seconds is not None and time.perf_counter() - start > max_seconds:
+            raise FitBudgetExceeded("ARIMA fit ran past its {} second budget".format(max_seconds))
+
+    model_arima = None
+    with warnings.catch_warnings(record=True) as caught_warnings:
+        warnings.simplefilter("always")
+        try:
+            arima_def = ARIMA(y, order=(model_params['p'], model_params['d'], model_params['q']))
+            model_arima = arima_def.fit(**fit_args, disp=0, callback=check_budget)
+            fit_status = 'ok'
+        except FitBudgetExceeded:
+            fit_status = 'time_budget_exceeded'
+        except Exception as e:
+            # a single pathological series should never take down the whole training run
+            logger.debug("ARIMA fit failed: {}:{}".format(type(e).__name__, e))
+            fit_status = 'failed'
+
+    mle_retvals = getattr(model_arima, 'mle_retvals', None) or {}
+    diagnostics = {'Fit_Seconds': round(time.perf_counter() - start, 4),
+                   'Iterations': mle_retvals.get('iterations', mle_retvals.get('fcalls')),
+                   'Converged': bool(mle_retvals.get('converged', False)),
+                   'Warning_Count': len(caught_warnings),
+                   'Fit_Status': fit_status}
+    return model_arima, diagnostics
+
+def fit_country_arima(y,baseline_mape,model_params,optional_fit_args,fit_budget=None):
+    """
+    ARIMA step of train_country_models for one country: fits on all but the last HOLDOUT_DAYS days and, if that beats
+    the country's baseline on those days, fits again on all the data
+    Args:
+        y (array-like): confirmed cases of the country by day
+        baseline_mape (float): holdout MAPE of the country's best baseline model (NaN if it has none)
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        fit_budget (dict): optional 'max_seconds'/'max_iterations' limits per fit
 
-    return avg_mape
+    Returns:
+        model_arima: ARIMA model trained on all the data, None if it does not beat the baseline or a fit failed
+        arima_forecast (numpy array): its holdout forecast, None along with the model
+        diagnostics (dict): fit diagnostics of both fits (see fit_arima_with_budget)
+    """
+    y = pd.Series(y).reset_index(drop=True)
+    holdout_train, holdout_actuals = y.iloc[:-HOLDOUT_DAYS], y.iloc[-HOLDOUT_DAYS:]
+    model_eval_arima_fit, diagnostics = fit_arima_with_budget(holdout_train,model_params,optional_fit_args,fit_budget)
+    if model_eval_arima_fit is None:
+        return None, None, diagnostics
+    arima_forecast = model_eval_arima_fit.forecast(HOLDOUT_DAYS)[0]
+    arima_mape = forecast_metrics.mape(holdout_actuals, arima_forecast)[0]
+    if not (np.isnan(baseline_mape) or arima_mape < baseline_mape):
+        return None, None, diagnostics
+    # train on all the data
+    model_arima, full_diagnostics = fit_arima_with_budget(y,model_params,optional_fit_args,fit_budget)
+    full_diagnostics['Fit_Seconds'] += diagnostics['Fit_Seconds']
+    return model_arima, (arima_forecast if model_arima is not None else None), full_diagnostics
+
+def fit_stored_country_arima(store,row,baseline_mape,model_params,optional_fit_args,fit_budget=None):
+    """fit_country_arima of a series of a series_store.SeriesStore, run in the worker processes of fit_country_arimas"""
+    return fit_country_arima(store[row],baseline_mape,model_params,optional_fit_args,fit_budget)
+
+def fit_country_arimas(countries,series,rows,baseline_mapes,model_params,optional_fit_args,fit_budget=None,workers=None):
+    """
+    Runs fit_country_arima for the given rows, one after the other or on a process pool. The pool reads the series
+    from a memory mapped series_store.SeriesStore, so a task sends the workers a row number rather than the series
+    Args:
+        countries (list): name of each country
+        series (list): confirmed cases of each country by day
+        rows (list): positions of the countries to fit
+        baseline_mapes (array-like): holdout MAPE of each country's best baseline model
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        fit_budget (dict): optional 'max_seconds'/'max_iterations' limits per fit
+        workers (int): number of processes, the fits run in this process if None or 1
 
-def train_country_models(df,model_params,optional_fit_args):
+    Returns:
+        arima_results (dict): row -> output of fit_country_arima
+    """
+    arima_results = {}
+    if not workers or workers <= 1 or len(rows) <= 1:
+        for i in rows:
+            with instrumentation.stage('train_country_model', country=countries[i]) as stage_metrics:
+                stage_metrics.add_rows(len(series[i]))
+                arima_results[i] = fit_country_arima(series[i],baseline_mapes[i],model_params,optional_fit_args,fit_budget)
+        return arima_results
+
+    with instrumentation.stage('train_country_models_parallel') as stage_metrics, \
+            series_store.SeriesStore.create(countries, series) as store:
+        stage_metrics.add_rows(sum(len(series[i]) for i in rows))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(fit_stored_country_arima, store, i, baseline_mapes[i], model_params,
+                                   optional_fit_args, fit_budget): i for i in rows}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    arima_results[i] = future.result()
+                except Exception as e:
+                    # e.g. a worker process that died: the country keeps its baseline model
+                    logger.error("ARIMA fit for {} failed in its worker process: {}:{}".format(
+                        countries[i], type(e).__name__, e))
+                    arima_results[i] = (None, None, {'Fit_Seconds': 0., 'Iterations': None, 'Converged': False,
+                                                     'Warning_Count': 0, 'Fit_Status': 'failed'})
+    return arima_results
+
+def has_enough_data(y,baselines=None):
     """
-    Trains a ARIMA model for forecasting confirmed cases of COVID-19 for each country that has the necessary data
+    Whether a country's series gets a model: min_days days with confirmed cases and a holdout to evaluate it on
+    Args:
+        y (pandas Series): confirmed cases by day
+        baselines (dict): optional baselines configs with 'min_days' (default 5)
+
+    Returns:
+        bool
+    """
+    return (y > 0).sum() >= (baselines or {}).get('min_days', 5) and len(y) > HOLDOUT_DAYS + 1
+
+def choose_models(series,model_params,optional_fit_args,fit_budget=None,baselines=None,workers=None,names=None):
+    """
+    Chooses and fits the model of each series. The baseline models (see baseline_models.py) are fit to every series at
+    once and the one with the lowest MAPE on the last HOLDOUT_DAYS days is the series' model, unless an ARIMA model does
+    better there. ARIMA is only fit for series with enough data whose best baseline MAPE is above
+    baselines->arima_above_mape, and a fit that fails or runs past the fit budget leaves the series with its baseline.
+    Used by train_country_models and, at every cut-off, by backtest.py
+    Args:
+        series (list): confirmed cases by day (pandas Series) of each country, all with enough data (has_enough_data)
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        fit_budget (dict): optional 'max_seconds'/'max_iterations' limits per fit and 'slow_fit_seconds' threshold
+            above which a fit is logged as slow
+        baselines (dict): optional 'arima_above_mape' and 'options' (model name -> options of baseline_models fit_many)
+        workers (int): optional number of processes the ARIMA fits run on (see fit_country_arimas)
+        names (list): optional name of each series for the log, their positions by default
+
+    Returns:
+        models (list): trained model object of each series
+        model_types (list): 'arima' or the baseline_models.MODELS name of each model
+        holdout_forecasts (list): forecast of the last HOLDOUT_DAYS days by the model trained without them
+        fit_diagnostics (list of dicts): Fit_Seconds, Iterations, Converged, Warning_Count and Fit_Status of the ARIMA
+            fits of each series ('not_fit' if ARIMA was not tried)
+    """
+    if fit_budget is None:
+        fit_budget = {}
+    if baselines is None:
+        baselines = {}
+    if names is None:
+        names = list(range(len(series)))
+    series = [y.reset_index(drop=True) for y in series]
+
+    # for a rough evaluation of each model, train on all but the last HOLDOUT_DAYS days and evaluate on those
+    holdout_train = [y.iloc[:-HOLDOUT_DAYS] for y in series]
+    holdout_actuals = [y.iloc[-HOLDOUT_DAYS:] for y in series]
+    with instrumentation.stage('fit_baseline_models') as stage_metrics:
+        stage_metrics.add_rows(sum(len(y) for y in series))
+        model_types, baseline_mapes, holdout_forecasts = baseline_models.select(
+            forecast_metrics.stack(holdout_train, align='right'), forecast_metrics.stack(holdout_actuals),
+            baselines.get('options'))
+        baseline_params = baseline_models.fit_all(forecast_metrics.stack(series, align='right'), baselines.get('options'))
+    model_types, holdout_forecasts = list(model_types), list(holdout_forecasts)
+    models = [baseline_models.MODELS[name].from_params(baseline_params[name], i) for i, name in enumerate(model_types)]
+
+    # ARIMA needs at least two weeks of data with confirmed cases, and is only worth it where the baselines are off
+    arima_rows = [i for i, y in enumerate(series)
+                  if (y > 0).sum() > 13 and not baseline_mapes[i] <= baselines.get('arima_above_mape', 0)]
+    arima_results = fit_country_arimas(names,series,arima_rows,baseline_mapes,model_params,optional_fit_args,
+                                       fit_budget,workers)
+
+    fit_diagnostics = []
+    for i, name in enumerate(names):
+        diagnostics = {'Fit_Seconds': 0., 'Iterations': None, 'Converged': False, 'Warning_Count': 0,
+                       'Fit_Status': 'not_fit'}
+        if i in arima_results:
+            model_arima, arima_forecast, diagnostics = arima_results[i]
+            if model_arima is not None:
+                models[i] = model_arima
+                model_types[i] = 'arima'
+                holdout_forecasts[i] = arima_forecast
+            if diagnostics['Fit_Status'] != 'ok':
+                logger.warning("ARIMA fit for {} ended with status '{}', keeping its {} model".format(
+                    name, diagnostics['Fit_Status'], model_types[i]))
+            if diagnostics['Fit_Seconds'] > fit_budget.get('slow_fit_seconds', float('inf')):
+                logger.warning("Slow ARIMA fit for {}: {}s, {} iterations, converged={}".format(
+                    name, diagnostics['Fit_Seconds'], diagnostics['Iterations'], diagnostics['Converged']))
+        fit_diagnostics.append(diagnostics)
+    return models, model_types, holdout_forecasts, fit_diagnostics
+
+def train_country_models(df,model_params,optional_fit_args,fit_budget=None,baselines=None,workers=None):
+    """
+    Trains a forecasting model of confirmed cases of COVID-19 for each country that has the necessary data
+    (has_enough_data), the model of each chosen by choose_models so one bad country cannot stall the run.
     Args:
         df (pandas DataFrame): input data consisting of confirmed cases globally by day
         model_params (dict): ARIMA model required fit parameters
         optional_fit_args (dict): ARIMA model additional hyperparameters
+        fit_budget (dict): optional 'max_seconds'/'max_iterations' limits per fit and 'slow_fit_seconds' threshold
+            above which a fit is logged as slow
+        baselines (dict): optional 'min_days' (days with cases a country needs for a model), 'arima_above_mape' and
+            'options' (model name -> options of baseline_models fit_many)
+        workers (int): optional number of processes the ARIMA fits run on (see fit_country_arimas)
 
     Returns:
-        country_models_df (pandas: ARIMA trained model object
+        country_models_df (pandas DataFrame): Country, trained model object, holdout metrics (MAPE, sMAPE, MASE, RMSE
+        and MSE) and fit diagnostics (Model_Type, Fit_Seconds, Iterations, Converged, Warning_Count, Fit_Status) for
+        each country a model was built for
 
     """
     # get list of each country in the dataset
     country_list = df.Country.unique()
-    # initial lists to be appeneded to through training loop
-    mapes_country_arima = []
-    countries_w_models =[]
-    country_models = []
-
-    # for each country in the list, attempt to build an ARIMA model for forecasting
-    for cntry in country_list:
-        #subset dataframe to country of interest
-        df_train = df.loc[df['Country'] == cntry]
-        df_train.reset_index(inplace=True,drop=True)
-        y = df_train['Confirmed']
-        #only perform training if there are at least two weeks of data with at least 1 confirmed cases in that country
-        enough_data_flag = len(df_train.loc[df_train['Confirmed']>0])
-        if enough_data_flag > 13:
-            # train on all the data
-            arima_def = ARIMA(y, order=(model_params['p'], model_params['d'], model_params['q']))
-            model_arima = arima_def.fit(**optional_fit_args, disp=0)
-            # append model object reference to a list
+    countries_w_models = []
+    series = []
+    for cntry, df_train in df.groupby('Country', sort=False):
+        y = df_train['Confirmed'].reset_index(drop=True)
+        if has_enough_data(y, baselines):
             countries_w_models.append(cntry)
-            country_models.append(model_arima)
-
-            # for a rough evaluation of each model, train on all but last 7 days and evaluate on those 7
-            y_train = y.iloc[0:len(y) - 7]
-            y_test = y.iloc[-7:]
-            arima_model_eval = ARIMA(y_train, order=(model_params['p'], model_params['d'], model_params['q']))
-            model_eval_arima_fit = arima_model_eval.fit(**optional_fit_args, disp=0)
-            y_pred = model_eval_arima_fit.forecast(len(y_test))[0]
-            mapes_country_arima.append((abs((y_pred -y_test) / y_test) * 100).mean())
-        else:
-            pass
+            series.append(y)
+
+    country_models, model_types, holdout_forecasts, fit_diagnostics = choose_models(
+        series,model_params,optional_fit_args,fit_budget,baselines,workers,names=countries_w_models)
+
     # create a dataframe consisting of the countries for which a model could be built. In that dataframe have country name,
-    # reference to trained model object, and its approximate MAPE
-    country_models_df = pd.DataFrame({'Country': countries_w_models,'Model':country_models,'MAPE':mapes_country_arima})
+    # reference to trained model object, its approximate accuracy and the diagnostics of its fit
+    holdout_metrics = forecast_metrics.evaluate(forecast_metrics.stack([y.iloc[-HOLDOUT_DAYS:] for y in series]),
+                                                forecast_metrics.stack(holdout_forecasts),
+                                                forecast_metrics.stack([y.iloc[:-HOLDOUT_DAYS] for y in series],
+                                                                       align='right'))
+    country_models_df = pd.DataFrame({'Country': countries_w_models,'Model':country_models,
+                                      'MAPE': holdout_metrics['mape'],'sMAPE': holdout_metrics['smape'],
+                                      'MASE': holdout_metrics['mase'],'RMSE': holdout_metrics['rmse'],
+                                      # holdout error variance, used to weight the country in forecast reconciliation
+                                      'MSE': holdout_metrics['rmse'] ** 2,'Model_Type': model_types})
+    country_models_df = pd.concat([country_models_df, pd.DataFrame(fit_diagnostics, columns=['Fit_Seconds', 'Iterations',
+                                   'Converged', 'Warning_Count', 'Fit_Status'])], axis=1)
     no_model_countries = len(country_list)-len(country_models_df)
     logger.info("Country models trained. Models could not be generated for {} countries due to lack of data.".format(no_model_countries))
+    logger.info("Country models by type: {}".format(country_models_df['Model_Type'].value_counts().to_dict()))
+    failed_fits = country_models_df['Fit_Status'].isin(['failed', 'time_budget_exceeded']).sum()
+    if failed_fits > 0:
+        logger.warning("{} ARIMA fits failed or ran past their budget, see the country_model_diagnostics table"
+                       .format(failed_fits))
     return country_models_df
 
+def get_country_model_diagnostics(country_models_df):
+    """
+    Reduces the output of "train_country_models" to the diagnostics table saved to the database
+    Args:
+        country_models_df (pandas DataFrame): Country models DataFrame saved out from "train_country_models" function
+
+    Returns:
+        diagnostics_df (pandas DataFrame): one row of fit diagnostics per country, stamped with the training date
+    """
+    # the other holdout metrics are kept in the model_evaluation table (see get_model_evaluation)
+    diagnostics_df = country_models_df.drop(columns=['Model', 'sMAPE', 'MASE', 'RMSE', 'MSE'])
+    diagnostics_df.insert(1, 'Date', datetime.now().date())
+    return diagnostics_df
+
+def get_model_evaluation(country_models_df,country_version,global_evaluation_df=None,global_version=None,
+                         model='country'):
+    """
+    Rows of the model_evaluation table for a training run: the holdout metrics of each country model and the forward
+    chaining metrics of each fold of the global model
+    Args:
+        country_models_df (pandas DataFrame): Country models DataFrame saved out from "train_country_models" function
+        country_version (str): registry version the country models were published as
+        global_evaluation_df (pandas DataFrame): optional output of evaluate_global_folds
+        global_version (str): registry version the global model was published as
+        model (str): hierarchy level of the models of country_models_df
+
+    Returns:
+        evaluation_df (pandas DataFrame): date, version, model, series, fold and the forecast_metrics.METRICS
+    """
+    country_df = country_models_df[['Country', 'MAPE', 'sMAPE', 'MASE', 'RMSE']].rename(columns={
+        'Country': 'series', 'MAPE': 'mape', 'sMAPE': 'smape', 'MASE': 'mase', 'RMSE': 'rmse'})
+    country_df.insert(0, 'model', model)
+    country_df.insert(1, 'fold', 0)
+    country_df.insert(0, 'version', country_version)
+    frames = [country_df]
+    if global_evaluation_df is not None:
+        global_df = global_evaluation_df.copy()
+        global_df.insert(0, 'version', global_version)
+        frames.append(global_df)
+    evaluation_df = pd.concat(frames, ignore_index=True)[['version', 'model', 'series', 'fold'] + forecast_metrics.METRICS]
+    evaluation_df.insert(0, 'date', datetime.now().date())
+    return evaluation_df
+
 def save_global_model_local(model,configfile,local_path,filename):
     """
     Save the global forecasting model to local
@@ -194,9 +519,9 @@ def save_global_model_local(model,configfile,local_path,filename):
         None -- saves trained model object to desired location
     """
 
-    # save model and config to local
+    # save model (ARIMA in the compact format) and config to local
     try:
-        model.save(os.path.join(local_path,filename))
+        arima_serializer.save_model(model,os.path.join(local_path,filename))
     except FileNotFoundError:
         logger.error("Provided local path is not valid. Please correct this in the config file or create this path")
     except PermissionError:
@@ -210,52 +535,6 @@ def save_global_model_local(model,configfile,local_path,filename):
         logger.error("Unexpected error in trying to copy config to new path: {}:{}".format(type(e).__name__, e))
     logger.info("Global model and config were successfully saved to local. They are located in the dir {}.".format(local_path))
 
-def save_global_model_s3(model,configfile,s3_bucket_name,s3_output_path):
-    """
-    Save the global forecasting model to s3
-    Args:
-        model (tmo): trained model object to save
-        configfile(str): reference configuration file associated with this training run
-        s3_bucket_name (str): the name of S3 bucket to save model to (only needed if s3_flag is True)
-        s3_output_path (str): s3 bucket file path (without filename) where output will be saved to (only needed if s3_flag is True)
-
-    Returns:
-        None -- saves trained model object to desired location
-    """
-    # generate filename for output written to s3 based on pull date
-    date_str = datetime.now().strftime("%Y-%m-%d")
-    filename = 'ARIMA_global_{}'.format(date_str)
-    # local path here is arbitrary since its within the docker container not on the host system
-    local_path = 'models/global'
-    local_model_path= os.path.join(local_path,date_str)
-    os.mkdir(local_model_path)
-    # save model and config to local
-    filename = 'ARIMA_global_model'
-    local_file = os.path.join(local_path,filename)
-    model.save(local_file)
-    with open(os.path.join(local_path,"config.yml"), 'w') as file:
-        yaml.dump(configfile, file)
-
-    try:
-        s3 = boto3.client("s3")
-    except botoexceptions.NoCredentialsError:
-        logger.error("Your AWS credentials were not found. Verify that they have been made available as detailed "
-                     "in readme instructions")
-        sys.exit(1)
-
-    s3_model_file = os.path.join(s3_output_path,date_str,filename)
-    s3_config_file = os.path.join(s3_output_path,date_str,"config_{}.yml".format(date_str))
-
-    try:
-        s3.upload_file(local_file, s3_bucket_name, s3_model_file)
-        s3.upload_file(configfile,s3_bucket_name,s3_config_file)
-    except Exception as e:
-        logger.error("Unexpected error in trying to write data to s3: {}:{}".format(type(e).__name__, e))
-        sys.exit(1)
-
-    logger.info("Global model and config were successfully saved to s3 bucket. They are located in the dir {} in "
-                "your s3 bucket".format(os.path.join(s3_output_path, date_str)))
-
 def save_country_models_local(df,configfile,local_path):
     """
     Saves the country level forecasting models to local
@@ -275,10 +554,10 @@ def save_country_models_local(df,configfile,local_path):
         # generate file name for each country using the country name
         filename = 'ARIMA_{}'.format(unidecode.unidecode(countries[i]))
         model = models[i]
-        # try to save model to local
+        # try to save model to local, ARIMA models in the compact format (see arima_serializer.py)
         try:
             local_file = os.path.join(local_path, filename)
-            model.save(local_file)
+            arima_serializer.save_model(model,local_file)
         except FileNotFoundError:
             logger.error("Specified local path for saving the model does not exist. Please create the directory or "
                          "modify configuration: 'save_country_models' in the yaml file for this script")
@@ -302,59 +581,98 @@ def save_country_models_local(df,configfile,local_path):
 
     logger.info("Country models and config were successfully saved to local dir.They are located in the dir {}".format(local_path))
 
-def save_country_models_s3(df,configfile,s3_bucket_name,s3_output_path):
+def train_level_models(level,config,configfile,engine_string=None,s3_flag=False,window_days=None):
     """
-    Saves the country level forecasting models to s3
+    Trains, evaluates and publishes a model for every series of a level of the hierarchy (see hierarchy.py). The models
+    are configured by the train_models-><level>_model_configs block, or country_model_configs if the level has none
     Args:
-        df (pandas DataFrame): Country models DataFrame saved out from "train_country_models" function
+        level (hierarchy.Level): level with keys, e.g. the countries or the provinces
+        config (dict): configurations with train_models and model_registry as top level keys
+        configfile(str): reference configuration file associated with this training run
+        engine_string (str): sqlalchemy string for the connection.
+        s3_flag (bool): publish to the s3 registry rather than the local one
+        window_days (int): optional number of most recent days to train on
+
+    Returns:
+        model_df (pandas DataFrame): output of train_country_models, Country naming the series
+        version (str): the registry version the models were published as
+    """
+    model_configs = config['train_models'].get('{}_model_configs'.format(level.name),
+                                               config['train_models']['country_model_configs'])
+    level_data = read_table_from_db(level.table,level.keys + ['Date','Confirmed'],engine_string,window_days)
+    instrumentation.add_rows(len(level_data))
+    level_data = level.series_frame(level_data)
+    logger.info("Training models for each {} series, this will take a few moments.".format(level.name))
+    logger.warning("You may see some warnings issued from the ARIMA fit. Due to the nature of the data for some "
+                   "countries, the fit/optimization algorithm encounters issues.")
+    model_df = train_country_models(level_data,model_configs['model_params'],model_configs['optional_fit_args'],
+                                    model_configs.get('fit_budget'),model_configs.get('baselines'),
+                                    model_configs.get('workers'))
+    logger.info("Average MAPE across all {} models: {}".format(level.name, forecast_metrics.finite_mean(model_df.MAPE)))
+    logger.info("ARIMA fits took {:.1f}s in total over {} training days per series".format(
+        model_df.Fit_Seconds.sum(), level_data.groupby('Country').size().max()))
+    helper.add_to_database(get_country_model_diagnostics(model_df),"{}_model_diagnostics".format(level.name),'replace',
+                           engine_string)
+    registry = model_registry.get_registry(config['model_registry'],level.name,s3_flag)
+    version = publish_country_models(model_df,configfile,registry)
+    # the app image copies the current country list from the local registry root (see DockerfileApp), so it is written
+    # there whether the models were published locally or to s3
+    local_root = config['model_registry'][level.name]['local_root']
+    os.makedirs(local_root, exist_ok=True)
+    copyfile(registry.fetch('countries.pkl',version),os.path.join(local_root,'countries.pkl'))
+    return model_df, version
+
+def publish_global_model(model,configfile,registry,eval_mape,eval_mse=None):
+    """
+    Publishes the global forecasting model and its config as a new version of the model registry
+    Args:
+        model (tmo): trained model object to publish
         configfile(str): reference configuration file associated with this training run
-        s3_bucket_name (str): s3 bucket name to which the models should be saved
-        s3_output_path (str): path within the s3 bucket to save the models to
+        registry (model_registry.ModelRegistry): registry of the global models (local or s3)
+        eval_mape (float): forward chaining MAPE of the model, recorded in the registry index
+        eval_mse (float): forward chaining MSE of the model, recorded in the registry index for reconciliation
 
     Returns:
-        None -- saves trained model objects to s3
+        version (str): the published registry version
     """
-    try:
-        s3 = boto3.client("s3")
-    except botoexceptions.NoCredentialsError:
-        logger.error("Your AWS credentials were not found. Verify that they have been made available as detailed "
-                     "in readme instructions")
-        sys.exit(1)
-    # Get list of countries
-    countries = df['Country'].values
-    # Get list of the models
-    models = df['Model'].values
-    date_str = datetime.now().strftime("%Y-%m-%d")
-    # Make a directory with the timestamp for the country models. The local path here is arbitrary as its only within
-    # the docker container so didnt make it configurable
-    local_path = "models/country"
-    os.makedirs(os.path.join(local_path, date_str))
-    for i in range(len(countries)):
-        filename = 'ARIMA_{}_{}'.format(unidecode.unidecode(countries[i]), date_str)
-        model = models[i]
-        local_file = os.path.join(local_path, date_str, filename)
-        model.save(local_file)
-        s3_model_file = os.path.join(s3_output_path, date_str, filename)
+    with tempfile.TemporaryDirectory() as staging_dir:
+        save_global_model_local(model,configfile,staging_dir,GLOBAL_MODEL_FILENAME)
+        artifacts = {name: os.path.join(staging_dir, name) for name in os.listdir(staging_dir)}
         try:
-            s3.upload_file(local_file, s3_bucket_name, s3_model_file)
+            version = registry.publish(artifacts, metrics={'mape': eval_mape, 'mse': eval_mse})
         except Exception as e:
-            logger.error("Unexpected error in trying to write data to s3: {}:{}".format(type(e).__name__, e))
+            logger.error("Unexpected error in trying to publish the global model: {}:{}".format(type(e).__name__, e))
             sys.exit(1)
-    s3_config_file = os.path.join(s3_output_path, date_str, "config_{}.yml".format(date_str))
-    countries_write = [unidecode.unidecode(x) for x in countries]
-    with open(os.path.join(local_path, "countries.pkl"), 'wb') as f:
-        pickle.dump(countries_write, f)
-    s3_countries = os.path.join(s3_output_path, date_str, "countries_{}.pkl".format(date_str))
+    return version
 
-    try:
-        s3.upload_file(configfile, s3_bucket_name, s3_config_file)
-        s3.upload_file(os.path.join(local_path, "countries.pkl"), s3_bucket_name, s3_countries)
-    except Exception as e:
-        logger.error("Unexpected error in trying to write data to s3: {}:{}".format(type(e).__name__, e))
-        sys.exit(1)
-    logger.info("Country models and config were successfully saved to s3 bucket.They are located in the dir {}".format(
-        os.path.join(s3_output_path, date_str)))
+def publish_country_models(df,configfile,registry):
+    """
+    Publishes the country level forecasting models, their config and the country list as a new version of the model
+    registry, with the MAPE and model type of each country in the registry index
+    Args:
+        df (pandas DataFrame): Country models DataFrame saved out from "train_country_models" function
+        configfile(str): reference configuration file associated with this training run
+        registry (model_registry.ModelRegistry): registry of the country models (local or s3)
+
+    Returns:
+        version (str): the published registry version
+    """
+    countries = [unidecode.unidecode(x) for x in df['Country'].values]
+    metrics = {'avg_mape': forecast_metrics.finite_mean(df['MAPE']),
+               'mape': dict(zip(countries, df['MAPE'].astype(float))),
+               'mse': dict(zip(countries, df['MSE'].astype(float))),
+               'model_type': dict(zip(countries, df['Model_Type']))}
+    with tempfile.TemporaryDirectory() as staging_dir:
+        save_country_models_local(df,configfile,staging_dir)
+        artifacts = {name: os.path.join(staging_dir, name) for name in os.listdir(staging_dir)}
+        try:
+            version = registry.publish(artifacts, metrics)
+        except Exception as e:
+            logger.error("Unexpected error in trying to publish the country models: {}:{}".format(type(e).__name__, e))
+            sys.exit(1)
+    return version
 
+@instrumentation.timed('run_train_models')
 def run_train_models(args):
     """
     Wrapper function to run model traning and evaluation steps
@@ -374,34 +692,47 @@ def run_train_models(args):
         logger.error("Could not read in the config file--verify correct filename/path.")
         sys.exit(1)
 
-    # get global data, trained global forecasting model, evaluate it, and save it
-    global_data = read_data_from_db('global',args.engine_string)
-    confirmed_series = reduce_and_reshape_data('global',global_data)
-    arima_model = train_global_model(confirmed_series,config['train_models']['global_model_configs']['model_params'],config['train_models']['global_model_configs']['optional_fit_args'])
-    eval_mape = forward_chaining_eval_global_model(confirmed_series,config['train_models']['global_model_configs']['model_params'],config['train_models']['global_model_configs']['optional_fit_args'],config['train_models']['global_model_configs']['nbr_days_forecast'])
-    logger.info("Forward chaining MAPE for global forecasting model is: {}".format(str(eval_mape)))
-   #save_global_model(arima_model,args.config,args.s3_flag,**config['train_models']['global_model_configs']['save_model'])
-
-    if args.s3_flag == True:
-        save_global_model_s3(arima_model,args.config,**config['train_models']['global_model_configs']['save_model_to_s3'])
-    else:
-        save_global_model_local(arima_model,args.config,**config['train_models']['global_model_configs']['save_model_to_local'])
-
-    # get country level data, trained country forecasting models, evaluate it, and save it
-    country_data = read_data_from_db('country',args.engine_string)
-    country_data = reduce_and_reshape_data('country',country_data)
-    logger.info("Training models for each country, this will take a few moments.")
-    logger.warning("You may see some warnings issued from the ARIMA fit. Due to the nature of the data for some "
-                   "countries, the fit/optimization algorithm encounters issues.")
-    model_df = train_country_models(country_data,config['train_models']['country_model_configs']['model_params'],config['train_models']['country_model_configs']['optional_fit_args'])
-    avg_country_model_mape = model_df.MAPE.mean()
-    logger.info("Average MAPE across all country models: "+str(avg_country_model_mape))
-    #save_country_models(model_df,args.config,args.s3_flag,**config['train_models']['country_model_configs']['save_model'])
-
-    if args.s3_flag == True:
-        save_country_models_s3(model_df,args.config,**config['train_models']['country_model_configs']['save_model_to_s3'])
+    try:
+        levels = hierarchy.get_levels(config)
+    except ValueError as e:
+        logger.error("Invalid hierarchy in the config.yml: {}".format(e))
+        sys.exit(1)
+    global_level = hierarchy.top_level(levels)
+
+    global_evaluation_df, global_version = None, None
+    # models are trained on the most recent days only, so the cost of a training run does not grow with the history
+    window_days = config['train_models'].get('training_window_days')
+    logger.info("Training on {}".format("the last {} days".format(window_days) if window_days else "all history"))
+    # get global data, trained global forecasting model, evaluate it, and save it. Bottom up reconciliation forecasts
+    # the globe as the sum of the countries, so no global model is needed then
+    if global_level is None or config['reconciliation']['method'] == 'bottom_up':
+        logger.info("Skipping the global model: with bottom_up reconciliation the global forecast is the sum of the "
+                    "country forecasts")
     else:
-        save_country_models_local(model_df,args.config,**config['train_models']['country_model_configs']['save_model_to_local'])
+        global_data = read_table_from_db(global_level.table,['Date','Confirmed'],args.engine_string,window_days)
+        instrumentation.add_rows(len(global_data))
+        confirmed_series = reduce_and_reshape_data('global',global_data)
+        arima_model = train_global_model(confirmed_series,config['train_models']['global_model_configs']['model_params'],config['train_models']['global_model_configs']['optional_fit_args'])
+        folds = forward_chaining_forecasts(confirmed_series,config['train_models']['global_model_configs']['model_params'],config['train_models']['global_model_configs']['optional_fit_args'],config['train_models']['global_model_configs']['nbr_days_forecast'])
+        global_evaluation_df = evaluate_global_folds(folds)
+        eval_mape = forecast_metrics.summarize(global_evaluation_df)['mape']
+        logger.info("Forward chaining MAPE for global forecasting model is: {}".format(str(eval_mape)))
+        global_registry = model_registry.get_registry(config['model_registry'],global_level.name,args.s3_flag)
+        global_version = publish_global_model(arima_model,args.config,global_registry,eval_mape,
+                                              forecast_metrics.finite_mean(global_evaluation_df['rmse'] ** 2))
+
+    # get the data of every level of the hierarchy with keys (countries, provinces, ...), train a model for each of its
+    # series, evaluate them, and save them
+    evaluation_frames = []
+    for level in hierarchy.series_levels(levels):
+        model_df, version = train_level_models(level,config,args.config,args.engine_string,args.s3_flag,window_days)
+        # the global model is evaluated alongside the level it is the sum of
+        with_global = global_level is not None and global_level.sum_of == level.name
+        evaluation_frames.append(get_model_evaluation(model_df,version,global_evaluation_df if with_global else None,
+                                                      global_version,model=level.name))
+    # metrics of this training run, kept over time for the dashboard
+    if len(evaluation_frames) > 0:
+        helper.add_to_database(pd.concat(evaluation_frames,ignore_index=True),"model_evaluation",'append',args.engine_string)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Train time-series forecasting model(s) for COVID-19 confirmed case numbers')
@@ -0,0 +1,161 @@
+import logging.config
+import queue
+import threading
+import time
+import sqlalchemy as sql
+from sqlalchemy import exc
+
+#set-up logging
+logging.config.fileConfig(fname="local.conf")
+logger = logging.getLogger(__name__)
+
+# put on the queue by close() to tell the writer thread to flush and stop
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Batches inserts into a table on a background thread so the caller never waits on a database commit. Rows are
+    written when max_batch_rows have queued up or max_batch_ms after the first row of a batch arrived, whichever comes
+    first. close() flushes whatever is still queued.
+
+        writer = WriteBehindQueue(engine_string, User_App_Inputs.__table__)
+        writer.submit({'name': 'Jane', ...})
+        writer.close()
+    """
+
+    def __init__(self, engine_string, table, max_batch_rows=100, max_batch_ms=200, max_queue_size=10000,
+                 max_retries=3):
+        self.engine = sql.create_engine(engine_string)
+        self.table = table
+        self.max_batch_rows = max_batch_rows
+        self.max_batch_seconds = max_batch_ms / 1000.
+        self.max_retries = max_retries
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.lock = threading.Lock()
+        self.counters = {'enqueued': 0, 'written': 0, 'failed': 0, 'dropped': 0, 'batches': 0, 'max_queue_depth': 0,
+                         'last_flush_seconds': None}
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="write-behind-{}".format(table.name), daemon=True)
+        self.thread.start()
+
+    def _count(self, **increments):
+        with self.lock:
+            for name, n in increments.items():
+                self.counters[name] += n
+
+    def submit(self, row):
+        """
+        Queues a row for insertion without waiting for the database
+        Args:
+            row (dict): column name -> value
+
+        Returns:
+            queued (bool): False if the queue is full or closed and the row was dropped
+        """
+        if self.closed:
+            self._count(dropped=1)
+            return False
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            logger.warning("Write-behind queue for {} is full, dropping a row".format(self.table.name))
+            self._count(dropped=1)
+            return False
+        with self.lock:
+            self.counters['enqueued'] += 1
+            self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], self.queue.qsize())
+        return True
+
+    def _next_batch(self):
+        """Blocks for the first row, then collects rows until the batch is full or its time is up"""
+        first = self.queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_batch_seconds
+        while len(batch) < self.max_batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                row = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if row is _STOP:
+                return batch, True
+            batch.append(row)
+        return batch, False
+
+    def _flush(self, batch):
+        """Writes a batch in one transaction, retrying with backoff on database errors"""
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(self.table.insert(), batch)
+            except exc.SQLAlchemyError as error:
+                if attempt == self.max_retries:
+                    logger.error("Unable to write {} rows to {} after {} attempts: {}:{}".format(
+                        len(batch), self.table.name, attempt + 1, type(error).__name__, error))
+                    self._count(failed=len(batch))
+                    return
+                time.sleep(0.1 * 2 ** attempt)
+                continue
+            with self.lock:
+                self.counters['written'] += len(batch)
+                self.counters['batches'] += 1
+                self.counters['last_flush_seconds'] = time.monotonic() - start
+            logger.debug("Wrote {} rows to {}".format(len(batch), self.table.name))
+            return
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if len(batch) > 0:
+                self._flush(batch)
+        # rows submitted while close() was running are still written
+        remaining = []
+        while True:
+            try:
+                row = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _STOP:
+                remaining.append(row)
+        for i in range(0, len(remaining), self.max_batch_rows):
+            self._flush(remaining[i:i + self.max_batch_rows])
+
+    def metrics(self):
+        """
+        Current queue depth and counters
+        Returns:
+            metrics (dict): queue_depth plus enqueued, written, failed and dropped rows, batches written, the largest
+            queue depth seen and the duration of the last flush
+        """
+        with self.lock:
+            metrics = dict(self.counters)
+        metrics['queue_depth'] = self.queue.qsize()
+        return metrics
+
+    def close(self, timeout=10):
+        """
+        Flushes queued rows and stops the writer thread
+        Args:
+            timeout (float): seconds to wait for the flush
+
+        Returns:
+            None
+        """
+        if self.closed:
+            return
+        self.closed = True
+        # blocking put: the writer thread is draining the queue, so there will be room
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logger.warning("Write-behind queue for {} did not finish flushing within {}s, {} rows still queued".format(
+                self.table.name, timeout, self.queue.qsize()))
+        else:
+            logger.info("Write-behind queue for {} flushed: {}".format(self.table.name, self.metrics()))